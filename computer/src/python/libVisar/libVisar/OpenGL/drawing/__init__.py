@@ -1 +1,4 @@
 from .drawable import Drawable, Context
+from .cached_context import CachedContext
+from .resources import Resources, SharedProgram
+from .tile_atlas import TileAtlas
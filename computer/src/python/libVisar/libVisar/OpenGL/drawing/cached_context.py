@@ -0,0 +1,139 @@
+import collections
+import numpy as np
+
+from vispy.gloo import Texture2D, FrameBuffer, RenderBuffer, clear, set_viewport, set_state
+
+from .drawable import Context
+from .resources import Resources
+
+
+class CachedContext(Context):
+    '''CachedContext(*drawables, max_entries=2) -> CachedContext
+    A Context that renders its drawables into an offscreen texture, and only redraws that
+    texture when a drawable reports itself dirty. Other frames composite the cached texture
+    with a single quad, so a steady-state UI costs one draw call per eye.
+
+    Drawables opt in by clearing their `dirty` flag in draw() and setting it when something they
+    show changes (ex: in update()). Drawables that never clear it are redrawn every frame, as in Context.
+
+    There is one cache entry per distinct set of staged uniforms (ex: one per eye), kept in LRU order.
+    The viewport must be known (set .viewport, or draw through draw_stereo); otherwise the context
+    draws uncached.
+
+    Counters:
+        cache_hits - Draws served from the cached texture
+        cache_renders - Draws that re-rendered the drawables into the cache
+    '''
+    composite_vertex_shader = """
+        #version 120
+        attribute vec2 position;
+        varying vec2 texcoord;
+        void main() {
+            texcoord = 0.5 * position + 0.5;
+            gl_Position = vec4(position, 0.0, 1.0);
+        }
+    """
+
+    composite_fragment_shader = """
+        #version 120
+        uniform sampler2D texture;
+        varying vec2 texcoord;
+        void main() {
+            gl_FragColor = texture2D(texture, texcoord);
+        }
+    """
+
+    def __init__(self, *args, **kwargs):
+        Context.__init__(self, *args)
+        self.max_entries = kwargs.get('max_entries', 2)
+        self.entries = collections.OrderedDict()  # key -> [texture, framebuffer, content version]
+        self.content_version = 0
+
+        self.composite = Resources.program(self.composite_vertex_shader, self.composite_fragment_shader)
+        self.composite['position'] = Resources.vertex_buffer(np.array([
+            [-1, -1],
+            [ 1, -1],
+            [-1,  1],
+            [ 1,  1],
+        ], dtype=np.float32))
+
+        self.cache_hits = 0
+        self.cache_renders = 0
+
+    def append(self, *args):
+        Context.append(self, *args)
+        self.content_version += 1
+
+    def pop(self, index):
+        self.content_version += 1
+        return Context.pop(self, index)
+
+    def invalidate(self):
+        Context.invalidate(self)
+        self.content_version += 1
+
+    def release(self):
+        Context.release(self)
+        Resources.release(self.composite)
+
+    def reset_counters(self):
+        Context.reset_counters(self)
+        self.cache_hits = 0
+        self.cache_renders = 0
+
+    def _key(self, size):
+        return size + tuple((key, self.uniforms[key].tobytes()) for key in sorted(self.uniforms))
+
+    def _entry(self, key, size):
+        '''Find the cache entry for key, recycling the least recently used one if there is no room'''
+        if key in self.entries:
+            entry = self.entries.pop(key)
+        elif len(self.entries) >= self.max_entries:
+            _, entry = self.entries.popitem(last=False)
+            entry[2] = None
+        else:
+            entry = [None, None, None]
+
+        width, height = size
+        if entry[0] is None or entry[0].shape[:2] != (height, width):
+            entry[0] = Texture2D(shape=(height, width, 4))
+            entry[1] = FrameBuffer(entry[0], RenderBuffer((height, width)))
+            entry[2] = None
+        self.entries[key] = entry
+        return entry
+
+    def _draw_cached(self, viewport):
+        '''Draw into viewport, through the cache'''
+        if self.dirty:
+            self.content_version += 1
+
+        size = tuple(int(n) for n in viewport[2:])
+        entry = self._entry(self._key(size), size)
+        texture, framebuffer, version = entry
+        if version != self.content_version:
+            with framebuffer:
+                set_viewport(0, 0, *size)
+                clear(color=(0, 0, 0, 0), depth=True)
+                Context.draw(self)
+            entry[2] = self.content_version
+            self.cache_renders += 1
+        else:
+            self.cache_hits += 1
+
+        set_viewport(*viewport)
+        self.composite['texture'] = texture
+        set_state(depth_test=False, blend=True, blend_func=('src_alpha', 'one_minus_src_alpha'))
+        self.composite.draw('triangle_strip')
+        set_state(depth_test=True, blend=False)
+
+    def draw(self):
+        if self.viewport is None:
+            Context.draw(self)
+            return
+        self._draw_cached(self.viewport)
+
+    def draw_stereo(self, eyes):
+        for viewport, uniforms in eyes:
+            for key, value in uniforms.items():
+                self.set_uniform(key, value)
+            self._draw_cached(viewport)
@@ -1,15 +1,19 @@
 import numpy as np
+import itertools
 from ...OpenGL import utils
 
 from vispy.geometry import create_cube
 from vispy.util.transforms import perspective, translate, rotate, scale
 from vispy.gloo import (Program, VertexBuffer, IndexBuffer, Texture2D, clear,
-                        FrameBuffer)
+                        FrameBuffer, set_viewport)
+from .resources import Resources
 
 
 class Drawable(object):
     name = "Default Drawable"
     skip = False
+    dirty = True  # Drawables that track their own changes clear this in draw() and set it when they change
+    released = False
     def __init__(self, *args, **kwargs):
         '''Drawable(*args, **kwargs) -> Drawable
         Everything is tracked internally, different drawables will handle things differently
@@ -100,9 +104,35 @@ class Drawable(object):
     def draw(self):
         self.program.draw()
 
+    def release(self):
+        '''Drop this drawable's references to shared GPU resources (See Resources)
+        Call once the drawable is gone for good; calling it again does nothing
+        '''
+        if self.released:
+            return
+        self.released = True
+        for resource in (getattr(self, 'program', None), getattr(self, 'indices', None)):
+            if Resources.is_shared(resource):
+                Resources.release(resource)
+
 class Context(object):
     '''Note contexts are nestable (you can treat a context as a drawable)
+
+    Shared uniforms (view, projection) are staged on the context and only
+    pushed to a drawable when the staged value differs from the last value
+    that drawable received. Staged values are flushed once, at draw time,
+    so translating and re-projecting several times per frame only costs
+    uploads for the values that actually reach a draw call.
+
+    Counters:
+        uploads - Uniform uploads issued to drawables
+        skipped_uploads - Uploads avoided because the drawable was current
     '''
+    skip = False
+    world_locked = False  # If True, the Distorter may late-latch this context's view to the newest pose
+    viewport = None  # (x, y, width, height) this context is drawn into, if the caller knows it
+    _versions = itertools.count(1)
+
     def __init__(self, *args):
         self.drawables = []
         for arg in args:
@@ -110,9 +140,19 @@ class Context(object):
         self.view = np.eye(4)
         self.projection = np.eye(4)
 
+        self.uniforms = {}  # Staged shared uniforms, key -> value
+        self._uniform_versions = {}  # key -> version of the staged value
+        self._pushed = {}  # (id(drawable), key) -> version last pushed
+        self.uploads = 0
+        self.skipped_uploads = 0
+
     def __getitem__(self, key):
         return(self.drawables[key])
 
+    @property
+    def dirty(self):
+        return any(drawable.dirty for drawable in self.drawables if not drawable.skip)
+
     def __setitem__(self, key, value):
         raise(Exception("You should not be attempting to set a drawable during operation...pop it instead"))
 
@@ -121,41 +161,113 @@ class Context(object):
             self.drawables.append(arg)
 
     def pop(self, index):
-        return self.drawables.pop(index)
+        drawable = self.drawables.pop(index)
+        self._forget(drawable)
+        return drawable
+
+    def set_uniform(self, key, value):
+        '''Stage a uniform shared by every drawable in this context
+        Nothing is uploaded until the next draw(), and an unchanged value is not re-staged
+        '''
+        value = np.array(value)
+        staged = self.uniforms.get(key)
+        if staged is not None and staged.shape == value.shape and np.array_equal(staged, value):
+            return
+        self.uniforms[key] = value
+        self._uniform_versions[key] = next(self._versions)
+
+    def push_uniforms(self, drawable):
+        '''Upload the staged uniforms this drawable has not seen yet'''
+        for key, value in self.uniforms.items():
+            version = self._uniform_versions[key]
+            tag = (id(drawable), key)
+            if self._pushed.get(tag) == version:
+                self.skipped_uploads += 1
+                continue
+            if isinstance(drawable, Context):
+                drawable.set_uniform(key, value)
+            else:
+                drawable[key] = value
+            self._pushed[tag] = version
+            self.uploads += 1
+
+    def invalidate(self):
+        '''Force every staged uniform to be re-uploaded at the next draw'''
+        self._pushed = {}
+
+    def reset_counters(self):
+        self.uploads = 0
+        self.skipped_uploads = 0
+
+    def _forget(self, drawable):
+        for key in self.uniforms:
+            self._pushed.pop((id(drawable), key), None)
 
     def translate(self, *args):
         translate(self.view, *args)
-        for drawable in self.drawables:
-            drawable['view'] = self.view
+        self.set_uniform('view', self.view)
 
     def rotate(self, *args):
         rotate(self.view, *args)
-        for drawable in self.drawables:
-            drawable['view'] = self.view
+        self.set_uniform('view', self.view)
 
     def set_projection(self, projection):
         self.projection = projection
-        for drawable in self.drawables:
-            drawable['projection'] = self.projection
+        self.set_uniform('projection', self.projection)
 
     def set_view(self, view):
         self.view = view
-        for drawable in self.drawables:
-            drawable['view'] = self.view
+        self.set_uniform('view', self.view)
 
     def scale_view(self, factor):
         scale(self.view, factor)
         self.set_view(self.view)
         
     def on_resize(self):
-        for drawable in self.drawables:
-            drawable['projection'] = self.projection
+        self.set_uniform('projection', self.projection)
+        self.invalidate()
 
     def draw(self):
         for drawable in self.drawables:
             if not drawable.skip:
+                self.push_uniforms(drawable)
+                drawable.draw()
+
+    def draw_stereo(self, eyes):
+        '''draw_stereo([(viewport, uniforms), ...])
+        Draw every drawable once per eye in a single traversal of the context
+
+        Each eye is a viewport (x, y, width, height) into the bound framebuffer and the
+        shared uniforms (ex: view, projection) for that eye. The uniforms are staged once
+        per call, so values common to both eyes are uploaded at most once per drawable.
+        Viewport changes, draw calls and the per-eye uploads (ex: view) are the same as
+        drawing each eye separately.
+        '''
+        snapshots = []
+        for viewport, uniforms in eyes:
+            for key, value in uniforms.items():
+                self.set_uniform(key, value)
+            snapshots.append((viewport, dict(self.uniforms), dict(self._uniform_versions)))
+
+        for drawable in self.drawables:
+            if drawable.skip:
+                continue
+
+            if isinstance(drawable, Context):
+                drawable.draw_stereo([(viewport, uniforms) for viewport, uniforms, _ in snapshots])
+                continue
+
+            for viewport, uniforms, versions in snapshots:
+                self.uniforms, self._uniform_versions = uniforms, versions
+                set_viewport(*viewport)
+                self.push_uniforms(drawable)
                 drawable.draw()
 
     def update(self):
         for drawable in self.drawables:
-            drawable.update()
\ No newline at end of file
+            drawable.update()
+
+    def release(self):
+        '''Release the shared GPU resources of every drawable in this context'''
+        for drawable in self.drawables:
+            drawable.release()
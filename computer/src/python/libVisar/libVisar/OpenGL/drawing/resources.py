@@ -0,0 +1,230 @@
+import collections
+import hashlib
+import numpy as np
+
+from vispy.gloo import Program, VertexBuffer, IndexBuffer
+
+from ..utils import Logger
+
+
+class _Entry(object):
+    def __init__(self, key, resource):
+        self.key = key
+        self.resource = resource
+        self.refcount = 0
+        self.owner = None  # SharedProgram whose values are currently uploaded (programs only)
+        self.uploaded = {}  # key -> snapshot of the value the Program currently has (programs only)
+        self.bound = None  # Buffer the Program currently has bound (programs only)
+
+
+class SharedProgram(object):
+    '''Per-drawable handle to a Program shared through Resources
+    Behaves like the Program for setting items, binding and drawing. The values a drawable sets are
+    remembered on its handle and re-applied when a different handle draws with the same Program,
+    so drawables sharing a shader never see each other's uniforms. Only the values that differ from
+    what the Program already has are re-applied, so handles sharing most of their values (ex: the
+    same view and projection) switch cheaply.
+
+    Every handle should set the same uniforms (drawables of one class do), since anything a handle
+    never sets is inherited from whoever drew last.
+
+    Note: attributes set from numpy arrays are compared element by element on every owner switch;
+        pass buffers from Resources.vertex_buffer instead.
+    '''
+    def __init__(self, entry):
+        self._entry = entry
+        self.values = collections.OrderedDict()
+        self.bound = None
+        self.released = False
+
+    @property
+    def program(self):
+        return self._entry.resource
+
+    @staticmethod
+    def _snapshot(value):
+        '''Copy of an array-like value (a drawable may edit its array in place), or the object itself (ex: a texture)'''
+        if isinstance(value, (np.ndarray, np.generic, list, tuple, int, long, float)):
+            return np.array(value)
+        return value
+
+    @staticmethod
+    def _same(snapshot, value):
+        if isinstance(snapshot, np.ndarray):
+            return isinstance(value, (np.ndarray, np.generic, list, tuple, int, long, float)) and \
+                np.array_equal(snapshot, value)
+        return snapshot is value
+
+    def _upload(self, key, value):
+        self.program[key] = value
+        self._entry.uploaded[key] = self._snapshot(value)
+
+    def __setitem__(self, key, value):
+        self.values[key] = value
+        if self._entry.owner is self:
+            self._upload(key, value)
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def bind(self, buffer):
+        self.bound = buffer
+        if self._entry.owner is self:
+            self.program.bind(buffer)
+            self._entry.bound = buffer
+
+    def activate(self):
+        '''Make this handle's values current on the shared Program'''
+        entry = self._entry
+        if entry.owner is self:
+            return
+        program = entry.resource
+        if self.bound is not None and self.bound is not entry.bound:
+            program.bind(self.bound)
+            entry.bound = self.bound
+        for key, value in self.values.items():
+            if key in entry.uploaded and self._same(entry.uploaded[key], value):
+                Resources.skipped += 1
+                continue
+            self._upload(key, value)
+        entry.owner = self
+        Resources.switches += 1
+
+    def draw(self, *args, **kwargs):
+        self.activate()
+        self.program.draw(*args, **kwargs)
+
+    def release(self):
+        Resources.release(self)
+
+
+class Resources(object):
+    '''Process-wide cache of GPU resources, shared across drawables
+    Programs are keyed on a hash of their shader source, vertex and index buffers on a hash of their
+    contents, so identical shaders and quads are compiled and uploaded once.
+
+    Usage:
+        >>> self.program = Resources.program(self.vertex_shader, self.fragment_shader)  # A SharedProgram
+        >>> self.program['vertex_position'] = Resources.vertex_buffer(self.vertices)
+        >>> self.indices = Resources.index_buffer([0, 1, 2, 2, 3, 0])
+        ...
+        >>> Resources.release(self.program)  # When the drawable is done with it
+        >>> Resources.evict()  # Free everything that is no longer referenced
+
+    Every program(), vertex_buffer() and index_buffer() call takes a reference, release() drops one.
+    Releasing a SharedProgram also releases the shared buffers set on it.
+    Unreferenced resources stay cached (cheap to recreate a Target) until evict() is called.
+    '''
+    _entries = {}  # key -> _Entry
+    _by_resource = {}  # id(resource) -> _Entry
+
+    # Counters
+    hits = 0
+    misses = 0
+    switches = 0  # SharedProgram owner changes (uniform re-applies)
+    skipped = 0  # Values an owner change did not re-apply, the Program already had them
+
+    @staticmethod
+    def _hash(*parts):
+        digest = hashlib.sha1()
+        for part in parts:
+            digest.update(part)
+        return digest.hexdigest()
+
+    @classmethod
+    def _acquire(self, key, create):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = _Entry(key, create())
+            self._entries[key] = entry
+            self._by_resource[id(entry.resource)] = entry
+            self.misses += 1
+        else:
+            self.hits += 1
+        entry.refcount += 1
+        return entry
+
+    @classmethod
+    def _array_key(self, kind, data):
+        data = np.ascontiguousarray(data)
+        return (kind, self._hash(data.dtype.str, str(data.shape), data.tostring())), data
+
+    @classmethod
+    def program(self, vertex, fragment):
+        '''program(vertex, fragment) -> SharedProgram handle for the compiled shader pair'''
+        key = ('program', self._hash(vertex, '\0', fragment))
+        entry = self._acquire(key, lambda: Program(vertex, fragment))
+        return SharedProgram(entry)
+
+    @classmethod
+    def vertex_buffer(self, data):
+        '''vertex_buffer(data) -> VertexBuffer shared by everyone passing identical data'''
+        key, data = self._array_key('vertex', data)
+        return self._acquire(key, lambda: VertexBuffer(data)).resource
+
+    @classmethod
+    def index_buffer(self, data):
+        '''index_buffer(data) -> IndexBuffer shared by everyone passing identical indices'''
+        data = np.asarray(data)
+        if data.dtype.kind not in 'ui' or data.dtype.itemsize > 4:
+            data = data.astype(np.uint32)
+        key, data = self._array_key('index', data)
+        return self._acquire(key, lambda: IndexBuffer(data)).resource
+
+    @classmethod
+    def is_shared(self, resource):
+        '''is_shared(resource) -> True for a SharedProgram, or a Program or buffer cached here'''
+        return isinstance(resource, SharedProgram) or id(resource) in self._by_resource
+
+    @classmethod
+    def release(self, resource):
+        '''Drop one reference to a SharedProgram or shared buffer
+        A SharedProgram is only released once, however many times this is called on it
+        '''
+        if isinstance(resource, SharedProgram):
+            if resource.released:
+                return
+            resource.released = True
+            entry = resource._entry
+            if entry.owner is resource:
+                entry.owner = None
+            for value in resource.values.values():
+                if id(value) in self._by_resource:
+                    self.release(value)
+        else:
+            entry = self._by_resource.get(id(resource))
+            if entry is None:
+                Logger.warn('Releasing a resource that is not shared:', resource)
+                return
+        entry.refcount = max(entry.refcount - 1, 0)
+
+    @classmethod
+    def evict(self, force=False):
+        '''evict(force=False) -> number of resources freed
+        Frees every unreferenced resource, or everything if force is set
+        '''
+        evicted = 0
+        for key, entry in self._entries.items():
+            if entry.refcount and not force:
+                continue
+            delete = getattr(entry.resource, 'delete', None)
+            if delete is not None:
+                delete()
+            del self._entries[key]
+            del self._by_resource[id(entry.resource)]
+            evicted += 1
+        return evicted
+
+    @classmethod
+    def stats(self):
+        kinds = collections.Counter(key[0] for key in self._entries)
+        return {
+            'programs': kinds['program'],
+            'vertex_buffers': kinds['vertex'],
+            'index_buffers': kinds['index'],
+            'referenced': sum(1 for entry in self._entries.values() if entry.refcount),
+            'hits': self.hits,
+            'misses': self.misses,
+            'switches': self.switches,
+            'skipped': self.skipped,
+        }
@@ -0,0 +1,184 @@
+import collections
+import numpy as np
+
+from vispy.gloo import Texture2D, gl, get_current_canvas
+
+GL_TEXTURE_MAX_LEVEL = 0x813D  # Desktop GL only, not in vispy's ES2 constants
+
+
+class TileAtlas(object):
+    '''TileAtlas(slots=(8, 8), tile_size=256, channels=3) -> TileAtlas
+    One texture divided into fixed-size slots, each holding one tile (ex: a map tile), for streaming many
+    small images to the GPU without ever re-uploading the ones already there.
+
+    insert() uploads a single tile into a free slot with a sub-rectangle set_data; when the atlas is full
+    it recycles the least recently used slot that is not pinned. Shaders find a tile through its slot
+    (column, row), ex: from an indirection table (See indirection_entries and Map).
+
+    With mipmap_levels, the atlas keeps that many mipmap levels, regenerated by generate_mipmaps() after
+    uploads; samplers must then stay atlas.inset (a fraction of a tile) away from slot edges, so the
+    coarsest level never blends neighbouring slots.
+
+    Usage:
+        >>> atlas = TileAtlas((8, 8))
+        >>> atlas.pin(visible_keys)  # Never evict what is on screen
+        >>> if key not in atlas: atlas.insert(key, image)
+        >>> column, row = atlas.slot(key)
+
+    Counters:
+        uploads - Tiles uploaded
+        evictions - Tiles dropped to make room
+    '''
+    # GLSL helpers for samplers built on an atlas; shaders using them start with extensions (after #version).
+    # atlas_coordinates: slot + position within the tile -> atlas coordinates, kept $inset (atlas.inset)
+    # inside the slot so filtering never reads the neighbouring slot.
+    # atlas_sample: samples there, choosing the mipmap level from local_dx/local_dy, the screen derivatives of
+    # the position within the tile taken before any floor(); otherwise the level jumps at tile edges.
+    # Without explicit gradients (GL_ARB_shader_texture_lod) this falls back to plain texture2D.
+    extensions = "#extension GL_ARB_shader_texture_lod : enable"
+    glsl = """
+        vec2 atlas_coordinates(vec2 slot, vec2 local, vec2 atlas_slots, float inset) {
+            return (slot + clamp(local, inset, 1.0 - inset)) / atlas_slots;
+        }
+
+        vec4 atlas_sample(sampler2D atlas, vec2 slot, vec2 local, vec2 local_dx, vec2 local_dy,
+                          vec2 atlas_slots, float inset) {
+            vec2 coordinates = atlas_coordinates(slot, local, atlas_slots, inset);
+        #ifdef GL_ARB_shader_texture_lod
+            return texture2DGradARB(atlas, coordinates, local_dx / atlas_slots, local_dy / atlas_slots);
+        #else
+            return texture2D(atlas, coordinates);
+        #endif
+        }
+    """
+
+    def __init__(self, slots=(8, 8), tile_size=256, channels=3, interpolation='linear', mipmap_levels=0):
+        self.columns, self.rows = slots
+        self.tile_size = tile_size
+        self.channels = channels
+        self.mipmap_levels = mipmap_levels
+        self.stale_mipmaps = False
+        self.texture = Texture2D(shape=(self.rows * tile_size, self.columns * tile_size, channels),
+                                 interpolation=interpolation)
+
+        self.entries = collections.OrderedDict()  # key -> slot index, least recently used first
+        self.free = list(reversed(range(self.columns * self.rows)))
+        self.pinned = set()
+
+        self.uploads = 0
+        self.evictions = 0
+
+    @property
+    def capacity(self):
+        return self.columns * self.rows
+
+    @property
+    def inset(self):
+        '''Half a texel of the coarsest mipmap level, as a fraction of a tile'''
+        return 0.5 * 2 ** self.mipmap_levels / self.tile_size
+
+    @property
+    def slots(self):
+        '''(columns, rows), ex: for the atlas_slots uniform'''
+        return (self.columns, self.rows)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def pin(self, keys):
+        '''Protect $keys from eviction (replaces the previous pinned set), and mark them as used'''
+        self.pinned = set(keys)
+        for key in self.pinned:
+            self.touch(key)
+
+    def touch(self, key):
+        '''Mark $key as recently used'''
+        if key in self.entries:
+            self.entries[key] = self.entries.pop(key)
+
+    def slot(self, key):
+        '''slot(key) -> (column, row) of $key in the atlas, None if it is not loaded'''
+        index = self.entries.get(key)
+        if index is None:
+            return None
+        return (index % self.columns, index // self.columns)
+
+    def _allocate(self):
+        if self.free:
+            return self.free.pop()
+        for key in self.entries:
+            if key not in self.pinned:
+                self.evictions += 1
+                return self.entries.pop(key)
+        return None
+
+    def insert(self, key, image):
+        '''insert(key, image) -> (column, row), or None if every slot is pinned
+        Uploads only this tile; replaces the image if $key is already loaded
+        '''
+        index = self.entries.pop(key, None)
+        if index is None:
+            index = self._allocate()
+            if index is None:
+                return None
+        self.entries[key] = index
+
+        image = np.ascontiguousarray(image)
+        assert image.shape[:2] == (self.tile_size, self.tile_size), \
+            "Atlas tiles must be {0}x{0}, got {1}".format(self.tile_size, image.shape[:2])
+        column, row = index % self.columns, index // self.columns
+        self.texture.set_data(image, offset=(row * self.tile_size, column * self.tile_size))
+        self.uploads += 1
+        self.stale_mipmaps = self.mipmap_levels > 0
+        return (column, row)
+
+    def generate_mipmaps(self):
+        '''Rebuild the mipmaps if tiles were uploaded since the last call
+        Needs the GL context current (ex: call it from draw); gloo has no mipmap support, so this flushes
+        gloo's pending commands and works on the texture's GL handle. Returns whether anything was done;
+        nothing is until the texture exists on the GPU, ie: after the first draw that uses it.
+        '''
+        if not self.stale_mipmaps:
+            return False
+        context = get_current_canvas().context
+        context.flush_commands()
+        texture = context.shared.parser.get_object(self.texture.id)
+        if texture is None:
+            return False
+
+        gl.glBindTexture(gl.GL_TEXTURE_2D, texture.handle)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, self.mipmap_levels)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR_MIPMAP_LINEAR)
+        gl.glGenerateMipmap(gl.GL_TEXTURE_2D)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        self.stale_mipmaps = False
+        return True
+
+    def indirection_entry(self, key):
+        '''indirection_entry(key) -> RGBA uint8 (column, row, 0, loaded) of $key, zeros if it is not loaded'''
+        slot = self.slot(key) if key is not None else None
+        if slot is None:
+            return np.zeros(4, dtype=np.uint8)
+        return np.array((slot[0], slot[1], 0, 255), dtype=np.uint8)
+
+    def indirection_entries(self, keys):
+        '''indirection_entries(keys) -> RGBA uint8 table (keys' shape + (4,)) of indirection_entry for each key,
+        for an indirection texture; keys is a 2D grid (rows of columns) of tile keys, None for empty cells
+        '''
+        rows, columns = len(keys), len(keys[0])
+        table = np.zeros((rows, columns, 4), dtype=np.uint8)
+        for r in range(rows):
+            for c in range(columns):
+                table[r, c] = self.indirection_entry(keys[r][c])
+        return table
+
+    def stats(self):
+        return {
+            'tiles': len(self.entries),
+            'capacity': self.capacity,
+            'uploads': self.uploads,
+            'evictions': self.evictions,
+        }
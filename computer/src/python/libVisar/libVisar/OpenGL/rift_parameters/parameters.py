@@ -32,3 +32,52 @@ ortho_right = np.matrix([
 
 surface_size = 4096
 surface_depth = 64
+
+# Panel pixels per unit of tan(angle) at the lens center, from the Rift SDK (DK2)
+pixels_per_tan_angle = 549.618
+
+# The distortion mesh UVs were calibrated against a $surface_size texture sampled at
+# a 0.1 scale; only UVs below uv_limit land on the rendered eye image
+uv_to_pixels = 0.1 * surface_size
+uv_limit = (2.2, 2.4)
+
+
+def eye_texture_size(projection, render_scale=1.0):
+    '''eye_texture_size(projection, render_scale=1.0) -> (width, height)
+    Size of the eye buffer that gives one texel per panel pixel at the lens center
+    for the field of view of $projection (Like ovrHmd_GetFovTextureSize)
+    Clamped to surface_size
+    '''
+    projection = np.asarray(projection)
+    tan_width = 2.0 / projection[0, 0]
+    tan_height = 2.0 / projection[1, 1]
+    size = np.ceil(np.array([tan_width, tan_height]) * pixels_per_tan_angle * render_scale)
+    return tuple(int(o) for o in np.clip(size, 1, surface_size))
+
+
+# DK2 lens (Rift SDK LensConfig, Distortion_CatmullRom10)
+# Scale of a TanEyeAngle is a Catmull-Rom spline through 1.0, K[1]..K[10], evenly spaced in radius^2 up to lens_max_r^2
+lens_k = (1.003, 1.02, 1.042, 1.066, 1.094, 1.126, 1.162, 1.203, 1.25, 1.31, 1.38)
+lens_max_r = 1.0
+# Red and blue scale relative to green: 1 + c[0] + r^2 * c[1] (red), 1 + c[2] + r^2 * c[3] (blue)
+# Fitted to mesh.dat (with r^2 in TanEyeAngle units, not the SDK's)
+chromatic_aberration = (-0.01234, -0.0165, 0.02059, 0.0165)
+
+# Left eye lens center in the eye's screen NDC and TanEyeAngle per unit of screen NDC (the right eye is mirrored in x)
+# Fitted to mesh.dat; these match the DK2 screen (0.12576m x 0.07074m), 63.5mm lens separation and 0.036 m/tan angle
+lens_center = (-0.00986, 0.0)
+tan_eye_angle_scale = (0.8733, 0.9825)
+
+# Vignette: the mesh fades from vignette_floor at the edge of the eye image to 1 over vignette_fraction of its NDC
+vignette_floor = 0.25
+vignette_fraction = 0.095
+
+
+def fov_tan_angles(projection):
+    '''fov_tan_angles(projection) -> (left, right, up, down) tangents of the half-angles of $projection's field of view'''
+    projection = np.asarray(projection)
+    left = (1.0 - projection[0, 2]) / projection[0, 0]
+    right = (1.0 + projection[0, 2]) / projection[0, 0]
+    up = (1.0 + projection[1, 2]) / projection[1, 1]
+    down = (1.0 - projection[1, 2]) / projection[1, 1]
+    return left, right, up, down
@@ -1,5 +1,9 @@
 import numpy as np
 import os, sys
+import glob
+import hashlib
+
+from ..utils import Logger
 '''
     distortion_data = np.zeros(_len,
         dtype=[
@@ -11,34 +15,101 @@ import os, sys
 '''
 
 fpath = os.path.dirname(os.path.realpath(__file__))
-def read():
-    '''read() -> i_buffers, v_buffers
+mesh_path = os.path.join(fpath, 'mesh.dat')
+
+# Bump when the parsed layout changes, so stale caches are not loaded
+CACHE_VERSION = 1
+
+vertex_dtype = np.dtype([
+    ('pos', np.float32, 2),
+    ('red_xy', np.float32, 2),
+    ('green_xy', np.float32, 2),
+    ('blue_xy', np.float32, 2),
+    ('vignette', np.float32, 1),
+])
+
+
+def read(cache=True):
+    '''read(cache=True) -> i_buffers, v_buffers
     This function reads and returns the actual distortion mesh used by the oculus rift
+
+    The parsed mesh is cached in a binary file next to mesh.dat, named after the cache version and
+    the hash of mesh.dat, and memory-mapped on later runs (no parsing, no copies).
+    Editing mesh.dat changes the hash, so the cache is rebuilt automatically.
     '''
-    f = open(os.path.join(fpath, 'mesh.dat'), 'r')
+    if not cache:
+        return parse()
+
+    with open(mesh_path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    cache_path = os.path.join(fpath, 'mesh.dat.v{}-{}.npy'.format(CACHE_VERSION, digest[:16]))
+
+    if os.path.exists(cache_path):
+        try:
+            return unpack(np.load(cache_path, mmap_mode='r'))
+        except (IOError, ValueError) as e:
+            Logger.warn('Ignoring unreadable distortion mesh cache', cache_path, e)
+
+    i_buffers, v_buffers = parse()
+    write_cache(cache_path, i_buffers, v_buffers)
+    return i_buffers, v_buffers
+
+
+def pack(i_buffers, v_buffers):
+    '''pack(i_buffers, v_buffers) -> one-element structured array holding the whole mesh'''
+    record = np.zeros(1, dtype=[
+        ('left_buffer', vertex_dtype, len(v_buffers['left_buffer'])),
+        ('right_buffer', vertex_dtype, len(v_buffers['right_buffer'])),
+        ('left_indices', np.uint32, len(i_buffers['left_indices'])),
+        ('right_indices', np.uint32, len(i_buffers['right_indices'])),
+    ])
+    for name in ('left_buffer', 'right_buffer'):
+        record[name][0] = v_buffers[name]
+    for name in ('left_indices', 'right_indices'):
+        record[name][0] = i_buffers[name]
+    return record
+
+
+def unpack(record):
+    '''unpack(record) -> i_buffers, v_buffers as views into record'''
+    record = record[0]
+    i_buffers = {
+        'left_indices': record['left_indices'],
+        'right_indices': record['right_indices'],
+    }
+    return i_buffers, {'left_buffer': record['left_buffer'], 'right_buffer': record['right_buffer']}
+
+
+def write_cache(cache_path, i_buffers, v_buffers):
+    '''Write the mesh cache atomically and remove caches of other versions of mesh.dat'''
+    temp_path = cache_path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            np.save(f, pack(i_buffers, v_buffers))
+        os.rename(temp_path, cache_path)
+    except (IOError, OSError) as e:
+        Logger.warn('Could not write the distortion mesh cache', cache_path, e)
+        return
+
+    for stale in glob.glob(os.path.join(fpath, 'mesh.dat.v*.npy')):
+        if stale != cache_path:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+    Logger.log('Cached the distortion mesh in', cache_path)
+
+
+def parse():
+    '''parse() -> i_buffers, v_buffers
+    Parse mesh.dat (slow, see read)
+    '''
+    f = open(mesh_path, 'r')
     states = ['left_vertices', 'right_vertices', 'left_indices', 'right_indices']
 
     vertex_ct = 4225
-    left_buffer = np.zeros(
-        vertex_ct, 
-        dtype=[
-            ('pos', np.float32, 2),
-            ('red_xy', np.float32, 2),
-            ('green_xy', np.float32, 2),
-            ('blue_xy', np.float32, 2),
-            ('vignette', np.float32, 1),
-        ]
-    )
-    right_buffer = np.zeros(
-        vertex_ct, 
-        dtype=[
-            ('pos', np.float32, 2),
-            ('red_xy', np.float32, 2),
-            ('green_xy', np.float32, 2),
-            ('blue_xy', np.float32, 2),
-            ('vignette', np.float32, 1),
-        ]
-    )
+    left_buffer = np.zeros(vertex_ct, dtype=vertex_dtype)
+    right_buffer = np.zeros(vertex_ct, dtype=vertex_dtype)
 
     type_map = {
         'V': 'pos',
@@ -72,7 +143,10 @@ def read():
 
             # print line_ct, ':', left_buffer[type_map[_type]][line_ct]
             line_ct += 1
+    f.close()
 
+    for key in i_buffers:
+        i_buffers[key] = np.array(i_buffers[key], dtype=np.uint32)
     return i_buffers, {'left_buffer': left_buffer, 'right_buffer': right_buffer}
     
 if __name__ == '__main__':
@@ -13,7 +13,7 @@ from vispy.util.transforms import perspective, translate, rotate
 from vispy.gloo import (Program, VertexBuffer, IndexBuffer, Texture2D, clear,
                         FrameBuffer, RenderBuffer, set_viewport, set_state)
 
-from .read_map import read_map
+from ..shaders.make_distortion import MeshGenerator
 import os
 fpath = os.path.dirname(os.path.realpath(__file__))
 
@@ -98,6 +98,7 @@ def make_distortion():
     try:
         mapping = np.load(os.path.join(fpath, 'normalized_map.npy'))
     except IOError:
+        from .read_map import read_map
         mapping = read_map()
         mapping['screen_pos'] = np.apply_along_axis(lambda o: (
                         scale_between(o[0], 0, 960, -1, 1), 
@@ -116,6 +117,22 @@ def checkerboard(grid_num=8, grid_size=32):
     Z = np.row_stack(grid_num // 2 * (row_even, row_odd)).astype(np.uint8)
     return 255 * Z.repeat(grid_size, axis=0).repeat(grid_size, axis=1)
 
+def plot_error_field(resolution, eye='left', generator=None):
+    '''Plot the UV error of a generated mesh against mesh.dat, over the eye's screen (needs matplotlib)'''
+    import matplotlib.pyplot as plt
+
+    generator = generator or MeshGenerator()
+    screen, errors = generator.error_field(resolution, eye)
+    plt.figure()
+    plt.tricontourf(screen[:, 0], screen[:, 1], errors, 20)
+    plt.colorbar(label='UV error (pixels)')
+    plt.title('{0}x{0} {1} eye mesh: max error {2:.2f} px'.format(resolution, eye, errors.max()))
+    plt.xlabel('Screen x (eye NDC)')
+    plt.ylabel('Screen y (eye NDC)')
+    plt.gca().set_aspect('equal')
+    plt.show()
+
+
 class Canvas(app.Canvas):
 
     def __init__(self):
@@ -186,6 +203,11 @@ class Canvas(app.Canvas):
         self.update()
 
 if __name__ == '__main__':
+    # python -m libVisar.OpenGL.rift_parameters.visualize_mesh [--error RESOLUTION [EYE]]
+    if '--error' in sys.argv:
+        args = sys.argv[sys.argv.index('--error') + 1:]
+        plot_error_field(int(args[0]) if args else 32, *args[1:2])
+        sys.exit()
     c = Canvas()
     c.show()
     c.app.run()
\ No newline at end of file
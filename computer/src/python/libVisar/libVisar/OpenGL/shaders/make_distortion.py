@@ -6,7 +6,8 @@ from vispy.gloo import (Program, VertexBuffer, IndexBuffer, Texture2D, clear,
 from vispy import gloo
 
 from ..rift_parameters import read_mesh_txt, parameters
-from ..utils import Logger
+from ..drawing import Resources
+from ..utils import Logger, NullProfiler
 
 
 class Mesh(object):
@@ -26,18 +27,37 @@ class Mesh(object):
     attribute vec2 green_xy;
     attribute vec2 blue_xy;
     attribute float vignette;
+
+    // Timewarp: rotation from the pose the eye was rendered with to the pose at distortion time,
+    // in TanEyeAngle space. Interpolated across the screen from Start to End (Identity: no timewarp)
+    uniform mat4 EyeRotationStart;
+    uniform mat4 EyeRotationEnd;
     
     varying vec2 oRed_xy;
     varying vec2 oGreen_xy;
     varying vec2 oBlue_xy;
     varying float oVignette;
+
+    vec2 timewarp(vec2 tan_eye_angle, mat3 rotation) {
+        // Rotate the (x, y, 1) view ray and project it back onto the Z=1 plane
+        vec3 transformed = rotation * vec3(tan_eye_angle, 1.0);
+        return transformed.xy / transformed.z;
+    }
+
     void main() {
         gl_Position = vec4(pos.xy, 0.5, 1.0);
-        oRed_xy = red_xy;
+
+        float lerp = clamp(0.5 * pos.x + 0.5, 0.0, 1.0);
+        mat3 EyeRotation;
+        EyeRotation[0] = mix(EyeRotationStart[0], EyeRotationEnd[0], lerp).xyz;
+        EyeRotation[1] = mix(EyeRotationStart[1], EyeRotationEnd[1], lerp).xyz;
+        EyeRotation[2] = mix(EyeRotationStart[2], EyeRotationEnd[2], lerp).xyz;
+
+        oRed_xy = timewarp(red_xy, EyeRotation);
         oRed_xy.y = 1 - oRed_xy.y;
-        oGreen_xy = green_xy;
+        oGreen_xy = timewarp(green_xy, EyeRotation);
         oGreen_xy.y = 1 - oGreen_xy.y;
-        oBlue_xy = blue_xy;
+        oBlue_xy = timewarp(blue_xy, EyeRotation);
         oBlue_xy.y = 1 - oBlue_xy.y;
         
         // These corrections are not exact...there is quite a bit of texture clipping at the bottom...not sure why
@@ -64,6 +84,9 @@ class Mesh(object):
     #version 120
     // -> Add capability for setting "enable-aberration, disable rift-projection"
     uniform sampler2D texture;
+    uniform vec2 tex_scale; // Mesh UVs -> eye texture coordinates, follows the eye buffer size
+    uniform vec2 uv_limit; // Mesh UVs past this fall outside the rendered eye image
+    uniform vec2 eye_offset; // Where this eye's image starts in the texture (single-pass stereo)
     varying vec2 oRed_xy;
     varying vec2 oGreen_xy;
     varying vec2 oBlue_xy;
@@ -72,7 +95,6 @@ class Mesh(object):
     void main() {
 
         int test = 0;
-        float tex_scale = 0.1;
 
         float r = 0.0;
         float g = 0.0;
@@ -80,85 +102,460 @@ class Mesh(object):
 
 
         // (This is because the FPGA uses the top right pixel to calibrate for true black)
-        if (((oRed_xy.x * tex_scale) > 0.22) || ((oRed_xy.y * tex_scale) > 0.24)) {
+        if ((oRed_xy.x > uv_limit.x) || (oRed_xy.y > uv_limit.y)) {
             gl_FragColor = vec4(0.0, 0.0, 0.0, 1.0);
         } else {
-            r = texture2D(texture, (oRed_xy * tex_scale)).r;
-            g = texture2D(texture, (oGreen_xy * tex_scale)).g;
-            b = texture2D(texture, (oBlue_xy * tex_scale)).b;
+            r = texture2D(texture, (oRed_xy * tex_scale) + eye_offset).r;
+            g = texture2D(texture, (oGreen_xy * tex_scale) + eye_offset).g;
+            b = texture2D(texture, (oBlue_xy * tex_scale) + eye_offset).b;
             gl_FragColor = vec4(r, g, b, 1);
         }
 
         if (test == 1) {
-            if ((tex_scale * oBlue_xy.x) < 0.0) {
+            if ((tex_scale.x * oBlue_xy.x) < 0.0) {
                 b = 0.9;
             }
-            if ((tex_scale * oBlue_xy.x) > 1.0) {
+            if ((tex_scale.x * oBlue_xy.x) > 1.0) {
                 b = 0.2;
             }
-            if ((tex_scale * oBlue_xy.y) > 1.0) {
+            if ((tex_scale.y * oBlue_xy.y) > 1.0) {
                 r = 0.9;
             }
-            if ((tex_scale * oBlue_xy.y) < 0.0) {
+            if ((tex_scale.y * oBlue_xy.y) < 0.0) {
                 r = 0.2;
             }
             gl_FragColor = vec4(r, g, b, 1);
         }
 
         if (test == 2) {
-            gl_FragColor = vec4(oRed_xy.x * tex_scale, oRed_xy.y * tex_scale, 1, 1);
+            gl_FragColor = vec4(oRed_xy.x * tex_scale.x, oRed_xy.y * tex_scale.y, 1, 1);
         }
 
     }
     '''
 
     @classmethod
-    def make_eye(self, texture, eye):
-        '''make_eye (eye_texture, eye)
+    def make_eye(self, texture, eye, mesh=None):
+        '''make_eye (eye_texture, eye, mesh=None)
         Arguments:
             - eye_texture: The texture (bound to a framebuffer), that represents the view of the eye
             - eye: 'left' or 'right', the eye being rendered
-        Todo:
-            - Use vertex buffer instead of manually binding
+            - mesh: (vertices, indices) to use instead of mesh.dat (ex: from MeshGenerator.generate)
+        Returns:
+            - (program, indices): The vertices are uploaded as one interleaved VertexBuffer; identical index
+                buffers (both eyes of mesh.dat) are shared through Resources
         '''
         assert isinstance(texture, Texture2D), "texture not a texture 2D instance!"
         assert eye in ['left', 'right'], eye + " is not a valid eye (Should be left or right)"
 
         program = Program(self._vert_shader, self._frag_shader)
 
-        i_buffer = self._i_buffers[eye + '_indices']
-        _buffer = self._v_buffers[eye + '_buffer']
-
-        Logger.log('Loading {} eye distortion mesh pos'.format(eye))
-        program['pos'] = _buffer['pos']
-        Logger.log('Loading {} eye distortion mesh red_xy'.format(eye))
-        program['red_xy'] = _buffer['red_xy']
-        Logger.log('Loading {} eye distortion mesh green_xy'.format(eye))
-        program['green_xy'] = _buffer['green_xy']
-        Logger.log('Loading {} eye distortion mesh blue_xy'.format(eye))
-        program['blue_xy'] = _buffer['blue_xy']
-        program['vignette'] = _buffer['vignette']
+        if mesh is None:
+            i_buffer = self._i_buffers[eye + '_indices']
+            _buffer = self._v_buffers[eye + '_buffer']
+        else:
+            _buffer, i_buffer = mesh
+
+        Logger.log('Loading {} eye distortion mesh ({} vertices)'.format(eye, len(_buffer)))
+        program.bind(VertexBuffer(np.ascontiguousarray(_buffer)))
         program['texture'] = texture
+        program['eye_offset'] = (0.0, 0.0)
+        program['EyeRotationStart'] = np.eye(4)
+        program['EyeRotationEnd'] = np.eye(4)
+        program['uv_limit'] = parameters.uv_limit
+        program['tex_scale'] = 1.0 / np.array(parameters.uv_limit)
+
+        return program, Resources.index_buffer(i_buffer)
+
+
+class MeshGenerator(object):
+    '''MeshGenerator(k, max_r, chromatic_aberration, lens_center, tan_eye_angle_scale, projection) -> MeshGenerator
+    Builds the per-eye distortion mesh from the lens parameters (defaults: the DK2, see rift_parameters.parameters)
+    at any grid resolution, instead of the fixed 64x64 grid of mesh.dat
+
+    Like the Rift SDK, the grid is uniform in (green) TanEyeAngle over the eye's field of view; each vertex is
+    placed on the screen by inverting the lens distortion, and its red/green/blue TanEyeAngles are then
+    computed from that screen position.
+
+    Usage:
+        >>> generator = MeshGenerator()
+        >>> vertices, indices = generator.generate(24, 'left')
+        >>> generator.max_error(24)  # Panel pixels, against mesh.dat
+        >>> resolution, error = generator.cheapest(0.5)  # Fewest vertices within half a pixel
+
+    Errors are measured at every mesh.dat vertex: the UV the generated mesh interpolates at that screen
+    position against the UV mesh.dat has there, in TanEyeAngle units times pixels_per_tan_angle.
+    '''
+    resolutions = (4, 6, 8, 12, 16, 20, 24, 32, 40, 48, 64)
+
+    def __init__(self, k=parameters.lens_k, max_r=parameters.lens_max_r,
+                 chromatic_aberration=parameters.chromatic_aberration, lens_center=parameters.lens_center,
+                 tan_eye_angle_scale=parameters.tan_eye_angle_scale, projection=parameters.projection_left):
+        self.k = np.array(k, dtype=np.float64)
+        self.max_r = max_r
+        self.chromatic_aberration = chromatic_aberration
+        self.lens_center = np.array(lens_center, dtype=np.float64)
+        self.tan_eye_angle_scale = np.array(tan_eye_angle_scale, dtype=np.float64)
+        self.fov = parameters.fov_tan_angles(projection)
+        self.segments = self._spline_segments(self.k)
+
+    @staticmethod
+    def _spline_segments(k):
+        '''(p0, m0, p1, m1) of each Catmull-Rom segment, as LensConfig's EvalCatmullRom10Spline'''
+        n = len(k)
+        segments = np.zeros((n, 4))
+        # The curve starts at 1.0; K[0] only sets the slope there
+        segments[0] = (1.0, k[1] - k[0], k[1], 0.5 * (k[2] - k[0]))
+        for i in range(1, n - 2):
+            segments[i] = (k[i], 0.5 * (k[i + 1] - k[i - 1]), k[i + 1], 0.5 * (k[i + 2] - k[i]))
+        segments[n - 2] = (k[n - 2], 0.5 * (k[n - 1] - k[n - 2]), k[n - 1], k[n - 1] - k[n - 2])
+        # Past the last point it is a straight line
+        slope = k[n - 1] - k[n - 2]
+        segments[n - 1] = (k[n - 1], slope, k[n - 1] + slope, slope)
+        return segments
+
+    def scale(self, radius_squared):
+        '''Distortion scale of a TanEyeAngle at $radius_squared (green)'''
+        scaled = (len(self.k) - 1) * np.asarray(radius_squared) / (self.max_r ** 2)
+        segment = np.clip(np.floor(scaled), 0, len(self.k) - 1)
+        t = scaled - segment
+        p0, m0, p1, m1 = self.segments[segment.astype(int)].T
+        omt = 1.0 - t
+        return (p0 * (1.0 + 2.0 * t) + m0 * t) * omt * omt + (p1 * (1.0 + 2.0 * omt) - m1 * omt) * t * t
+
+    def _eye(self, eye):
+        '''-> (x sign, lens center) for eye; the right eye is the left eye mirrored in x'''
+        assert eye in ['left', 'right'], eye + " is not a valid eye (Should be left or right)"
+        sign = 1.0 if eye == 'left' else -1.0
+        return sign, self.lens_center * (sign, 1.0)
+
+    def screen_to_tan(self, screen, eye='left'):
+        '''screen_to_tan(screen, eye) -> (red, green, blue) TanEyeAngles (y down) seen at eye screen NDC positions (N x 2)'''
+        sign, center = self._eye(eye)
+        distorted = (screen - center) * self.tan_eye_angle_scale * (1.0, -1.0)
+        radius_squared = np.sum(distorted ** 2, axis=1)
+        green = self.scale(radius_squared)
+        c = self.chromatic_aberration
+        red = green * (1.0 + c[0] + radius_squared * c[1])
+        blue = green * (1.0 + c[2] + radius_squared * c[3])
+        return tuple(distorted * channel[:, np.newaxis] for channel in (red, green, blue))
+
+    def tan_to_screen(self, tan, eye='left', iterations=40):
+        '''tan_to_screen(tan, eye) -> eye screen NDC where the green TanEyeAngles $tan (N x 2) are seen
+        Inverts the distortion by bisection on the radius: r * scale(r^2) is monotonic, and the scale is at
+        least 1, so the distorted radius lies in [0, radius]
+        '''
+        sign, center = self._eye(eye)
+        radius = np.sqrt(np.sum(tan ** 2, axis=1))
+        low, high = np.zeros_like(radius), radius.copy()
+        for _ in range(iterations):
+            middle = 0.5 * (low + high)
+            below = middle * self.scale(middle ** 2) < radius
+            low = np.where(below, middle, low)
+            high = np.where(below, high, middle)
+        distorted_radius = 0.5 * (low + high)
+        ratio = np.ones_like(radius)
+        nonzero = radius > 0
+        ratio[nonzero] = distorted_radius[nonzero] / radius[nonzero]
+        distorted = tan * ratio[:, np.newaxis]
+        return distorted * (1.0, -1.0) / self.tan_eye_angle_scale + center
+
+    def grid_tan(self, resolution, eye='left'):
+        '''Green TanEyeAngles of the grid vertices, rows top to bottom'''
+        sign, _ = self._eye(eye)
+        left, right, up, down = self.fov
+        if sign < 0:
+            left, right = right, left
+        tan_x, tan_y = np.meshgrid(np.linspace(-left, right, resolution + 1), np.linspace(-up, down, resolution + 1))
+        return np.column_stack([tan_x.ravel(), tan_y.ravel()])
+
+    def generate(self, resolution, eye='left'):
+        '''generate(resolution, eye) -> (vertices, indices)
+        A (resolution + 1)^2 vertex mesh for one eye, in the layout of Mesh (read_mesh_txt.vertex_dtype)
+        '''
+        sign, _ = self._eye(eye)
+        n = resolution + 1
+        screen = np.clip(self.tan_to_screen(self.grid_tan(resolution, eye), eye), -1.0, 1.0)
+        red, green, blue = self.screen_to_tan(screen, eye)
+
+        vertices = np.zeros(n * n, dtype=read_mesh_txt.vertex_dtype)
+        vertices['pos'][:, 0] = 0.5 * screen[:, 0] - 0.5 * sign  # Each eye covers half of the screen
+        vertices['pos'][:, 1] = screen[:, 1]
+        vertices['red_xy'] = red
+        vertices['green_xy'] = green
+        vertices['blue_xy'] = blue
+
+        # Fade out towards the edges of the eye image
+        source_x, source_y = np.meshgrid(np.linspace(-1, 1, n), np.linspace(-1, 1, n))
+        edge = np.maximum(np.abs(source_x), np.abs(source_y)).ravel()
+        vertices['vignette'] = np.clip(parameters.vignette_floor + (1.0 - edge) / parameters.vignette_fraction, 0.0, 1.0)
+
+        return vertices, self.grid_indices(resolution)
+
+    @staticmethod
+    def grid_indices(resolution):
+        '''Two triangles per grid cell, row by row (the same triangles and winding as mesh.dat)
+        Cells are split along the diagonal pointing away from the center, which follows the curvature of the warp
+        '''
+        n = resolution + 1
+        half = resolution // 2
+        row, col = np.meshgrid(np.arange(resolution), np.arange(resolution), indexing='ij')
+        a = (row * n + col).ravel()
+        b, c, d = a + 1, a + n, a + n + 1
+        outward = ((row < half) != (col < half)).ravel()
+        first = np.where(outward[:, np.newaxis], np.column_stack([a, b, d]), np.column_stack([a, b, c]))
+        second = np.where(outward[:, np.newaxis], np.column_stack([d, c, a]), np.column_stack([b, d, c]))
+        return np.column_stack([first, second]).astype(np.uint32).ravel()
+
+    def error_field(self, resolution, eye='left', reference=None):
+        '''error_field(resolution, eye) -> (screen positions, errors in pixels) at every reference vertex
+        reference defaults to the mesh.dat vertices of $eye
+        '''
+        if reference is None:
+            reference = Mesh._v_buffers[eye + '_buffer']
+        sign, _ = self._eye(eye)
+        vertices, _ = self.generate(resolution, eye)
+        n = resolution + 1
+
+        # Eye screen NDC of the reference and generated vertices
+        position = np.array(reference['pos'], dtype=np.float64)
+        screen = position * (2.0, 1.0) + (sign, 0.0)
+        grid_screen = np.array(vertices['pos'], dtype=np.float64) * (2.0, 1.0) + (sign, 0.0)
+
+        # Locate each reference vertex in the generated grid through its (analytic) TanEyeAngle
+        left, right, up, down = self.fov
+        if sign < 0:
+            left, right = right, left
+        green = self.screen_to_tan(screen, eye)[1]
+        col = np.clip(np.floor((green[:, 0] + left) / (left + right) * resolution), 0, resolution - 1).astype(int)
+        row = np.clip(np.floor((green[:, 1] + up) / (up + down) * resolution), 0, resolution - 1).astype(int)
+        a = row * n + col
+        b, c, d = a + 1, a + n, a + n + 1
+        half = resolution // 2
+        outward = ((row < half) != (col < half))[:, np.newaxis]
+        triangles = (
+            np.where(outward, np.column_stack([a, b, d]), np.column_stack([a, b, c])),
+            np.where(outward, np.column_stack([d, c, a]), np.column_stack([b, d, c])),
+        )
+
+        # Barycentric interpolation in whichever of the cell's two triangles contains the point
+        def barycentric(corners):
+            p0, p1, p2 = (grid_screen[corners[:, i]] for i in range(3))
+            v0, v1, v2 = p1 - p0, p2 - p0, screen - p0
+            det = v0[:, 0] * v1[:, 1] - v0[:, 1] * v1[:, 0]
+            w1 = (v2[:, 0] * v1[:, 1] - v2[:, 1] * v1[:, 0]) / det
+            w2 = (v0[:, 0] * v2[:, 1] - v0[:, 1] * v2[:, 0]) / det
+            return np.column_stack([1.0 - w1 - w2, w1, w2])
+
+        first, second = (barycentric(corners) for corners in triangles)
+        use_first = (first.min(axis=1) >= second.min(axis=1))[:, np.newaxis]
+        weights = np.where(use_first, first, second)
+        corners = np.where(use_first, triangles[0], triangles[1])
+
+        errors = np.zeros(len(reference))
+        for channel in ('red_xy', 'green_xy', 'blue_xy'):
+            values = np.array(vertices[channel], dtype=np.float64)
+            interpolated = np.sum(values[corners] * weights[:, :, np.newaxis], axis=1)
+            channel_error = np.sqrt(np.sum((interpolated - reference[channel]) ** 2, axis=1))
+            errors = np.maximum(errors, channel_error)
+        return screen, errors * parameters.pixels_per_tan_angle
+
+    def max_error(self, resolution):
+        '''max_error(resolution) -> largest UV error of either eye against mesh.dat, in panel pixels'''
+        return max(self.error_field(resolution, eye)[1].max() for eye in ('left', 'right'))
+
+    def cheapest(self, threshold=0.5, resolutions=None):
+        '''cheapest(threshold=0.5) -> (resolution, max error) of the smallest mesh within $threshold pixels
+        Falls back to the most accurate candidate if none is good enough
+        '''
+        best = None
+        for resolution in sorted(resolutions or self.resolutions):
+            error = self.max_error(resolution)
+            Logger.log('Distortion mesh {0}x{0}: max error {1:.3f} px'.format(resolution, error))
+            if error <= threshold:
+                return resolution, error
+            if best is None or error < best[1]:
+                best = (resolution, error)
+        Logger.warn('No distortion mesh within {} px, using {}x{}'.format(threshold, best[0], best[0]))
+        return best
+
+
+class DistortionLookup(object):
+    '''DistortionLookup(uvs, texture, eye) -> DistortionLookup
+    Distortion by per-pixel lookup instead of a mesh: the red, green and blue source UVs of every screen pixel
+    are baked into two float textures, and the warp becomes one full-screen quad per eye with a single fetch
+    of each.
+
+    uvs is a (height, width, 3, 2) array of eye texture coordinates (0 to 1) for the red, green and blue
+    channels of each of the eye's screen pixels (row 0 at the bottom); NaN marks pixels that stay black.
+
+    Usage:
+        >>> uvs = DistortionLookup.bake((960, 1080), 'left')  # From the lens model (See MeshGenerator)
+        >>> uvs = DistortionLookup.read_fpga_map('dump', 'left')  # Or the FPGA's calibration map
+        >>> lookup = DistortionLookup(uvs, eye_texture, 'left')
+        >>> lookup.draw()
+
+    Note: The lookup holds final UVs, so timewarp (which rotates TanEyeAngles) is not available.
+    '''
+    vertex_shader = '''
+    #version 120
+    attribute vec2 position;
+    uniform float eye_x; // Center of this eye's half of the screen, in NDC
+    varying vec2 texcoord;
+    void main() {
+        texcoord = 0.5 * position + 0.5;
+        gl_Position = vec4(0.5 * position.x + eye_x, position.y, 0.5, 1.0);
+    }
+    '''
+
+    fragment_shader = '''
+    #version 120
+    uniform sampler2D texture;
+    uniform sampler2D lookup_rg; // (red.uv, green.uv)
+    uniform sampler2D lookup_b; // (blue.uv, valid, unused)
+    uniform vec2 tex_scale; // Lookup UVs -> eye texture coordinates (half width in single-pass stereo)
+    uniform vec2 eye_offset;
+    varying vec2 texcoord;
+    void main() {
+        vec4 rg = texture2D(lookup_rg, texcoord);
+        vec4 b = texture2D(lookup_b, texcoord);
+        if (b.z < 0.5) {
+            gl_FragColor = vec4(0.0, 0.0, 0.0, 1.0);
+        } else {
+            gl_FragColor = vec4(
+                texture2D(texture, rg.xy * tex_scale + eye_offset).r,
+                texture2D(texture, rg.zw * tex_scale + eye_offset).g,
+                texture2D(texture, b.xy * tex_scale + eye_offset).b,
+                1.0);
+        }
+    }
+    '''
 
-        return program, IndexBuffer(i_buffer)
+    # Added to the mesh's TanEyeAngles by Mesh._vert_shader to get mesh UVs (with y flipped)
+    uv_offset = (1.2, 0.13)
+
+    # fpga/scripts/distortion: the map is a (1920, 1080, 3, 2) array of (column, row) camera pixels for the
+    # left half of the panel, -1 where the panel shows nothing
+    fpga_camera_size = (1280, 1024)
+
+    def __init__(self, uvs, texture, eye):
+        assert eye in ['left', 'right'], eye + " is not a valid eye (Should be left or right)"
+        height, width = uvs.shape[:2]
+        valid = np.all(np.isfinite(uvs.reshape(height, width, 6)), axis=2)
+        uvs = np.where(np.isfinite(uvs), uvs, 0.0)
+
+        lookup_rg = uvs[:, :, :2].reshape(height, width, 4).astype(np.float32)
+        lookup_b = np.zeros((height, width, 4), dtype=np.float32)
+        lookup_b[:, :, :2] = uvs[:, :, 2]
+        lookup_b[:, :, 2] = valid
+
+        self.size = (width, height)
+        self.program = Program(self.vertex_shader, self.fragment_shader)
+        self.program['position'] = Resources.vertex_buffer(np.array([
+            [-1, -1],
+            [ 1, -1],
+            [-1,  1],
+            [ 1,  1],
+        ], dtype=np.float32))
+        self.program['eye_x'] = -0.5 if eye == 'left' else 0.5
+        self.program['lookup_rg'] = Texture2D(lookup_rg, interpolation='nearest', internalformat='rgba32f')
+        self.program['lookup_b'] = Texture2D(lookup_b, interpolation='nearest', internalformat='rgba32f')
+        self.program['texture'] = texture
+        self.program['tex_scale'] = (1.0, 1.0)
+        self.program['eye_offset'] = (0.0, 0.0)
+
+    def __setitem__(self, key, value):
+        self.program[key] = value
+
+    def draw(self):
+        self.program.draw('triangle_strip')
+
+    @classmethod
+    def bake(self, size, eye, generator=None):
+        '''bake(size, eye, generator=None) -> uvs for a (width, height) eye, from the lens model
+        Matches what the mesh interpolates, but exact at every pixel; pixels outside the mesh's field of view
+        or past uv_limit are left black, as in the mesh shader
+        '''
+        generator = generator or MeshGenerator()
+        width, height = size
+        x, y = np.meshgrid((np.arange(width) + 0.5) * 2.0 / width - 1.0, (np.arange(height) + 0.5) * 2.0 / height - 1.0)
+        screen = np.column_stack([x.ravel(), y.ravel()])
+
+        left, right, up, down = generator.fov
+        if eye == 'right':
+            left, right = right, left
+        red, green, blue = generator.screen_to_tan(screen, eye)
+        inside = ((green[:, 0] >= -left) & (green[:, 0] <= right) &
+                  (green[:, 1] >= -up) & (green[:, 1] <= down))
+
+        uvs = np.empty((len(screen), 3, 2))
+        for n, tan in enumerate((red, green, blue)):
+            # As Mesh._vert_shader, then normalized by uv_limit like tex_scale
+            mesh_uv = np.column_stack([tan[:, 0] + self.uv_offset[0], 1.0 - tan[:, 1] + self.uv_offset[1]])
+            uvs[:, n] = mesh_uv / parameters.uv_limit
+        # The mesh shader blanks on the red channel's UV
+        inside &= np.all(uvs[:, 0] <= 1.0, axis=1)
+        uvs[~inside] = np.nan
+        return uvs.reshape(height, width, 3, 2).astype(np.float32)
+
+    @classmethod
+    def read_fpga_map(self, path, eye):
+        '''read_fpga_map(path, eye) -> uvs from the FPGA distortion map (make_dump.py's output)
+        UVs address the camera frame as uploaded (row 0 at v = 0). The right eye is the left mirrored,
+        with the camera rows flipped, as data.py builds it
+        '''
+        dump = np.load(path)
+        columns, rows = self.fpga_camera_size
+        half = dump.shape[0] // 2
+        eye_map = dump[:half].astype(np.float64)  # (x, y, channel, (column, row)), y down
+        missing = np.any(eye_map < 0, axis=3)
+        if eye == 'right':
+            eye_map, missing = eye_map[::-1], missing[::-1]
+            eye_map[:, :, :, 1] = rows - 1 - eye_map[:, :, :, 1]
+
+        uvs = (eye_map + 0.5) / (columns, rows)
+        uvs[missing] = np.nan
+        # -> (row, column) with row 0 at the bottom
+        return uvs.transpose(1, 0, 2, 3)[::-1].astype(np.float32)
 
 
 class Distorter(object):
-    def __init__(self, size=(1600, 900), no_distort=False):
+    render_scale_range = (0.5, 2.0)
+
+    # GL eye space (x right, y up, looking down -z) -> the mesh's TanEyeAngle space (y down, +z forward)
+    tan_eye_basis = np.diag([1.0, -1.0, -1.0])
+
+    def __init__(self, size=(1600, 900), no_distort=False, single_pass=False, render_scale=1.0, profiler=None,
+                 pose_source=None, late_latch=False, timewarp=False, mesh_resolution=None, lookup=None):
         '''Distorter object: Applies distortion to Contexts and drawables
 
         - size (X, Y): Size of monitor
         - distortion (Bool): Apply distortion or not?
+        - single_pass (Bool): Render both eyes side-by-side into one framebuffer,
+            traversing each Context once (See draw_single_pass)
+        - render_scale (float): Eye buffer resolution relative to the panel's pixel density
+            at the lens center. Lower is faster, higher is sharper (See set_render_scale)
+        - profiler (FrameProfiler): Records the eye and distortion passes (optional)
+        - pose_source (function): Returns the newest head orientation matrix (ex: State.latest_orientation_matrix)
+        - late_latch (Bool): Re-sample pose_source right before each eye pass and use it as the view
+            of every world_locked Context
+        - timewarp (Bool): Re-sample pose_source right before the distortion pass and rotate the eye
+            images by the change since they were rendered
+        - mesh_resolution (int or float): Generate the distortion mesh with this many cells per side
+            (See MeshGenerator) instead of using mesh.dat. A float below 1 is a pixel error budget instead:
+            the cheapest mesh within it is used
+        - lookup (str): Distort with a per-pixel lookup texture instead of the mesh (See DistortionLookup):
+            'lens' bakes it from the lens model, anything else is the path of an FPGA distortion map
         '''
         self.size = size
-        self.left_eye_tex = gloo.Texture2D(shape=(4096, 4096) + (3,))
-        self.right_eye_tex = gloo.Texture2D(shape=(4096, 4096) + (3,))
-        
-        self.left_eye = gloo.FrameBuffer(self.left_eye_tex, gloo.RenderBuffer(self.size))
-        self.right_eye = gloo.FrameBuffer(self.right_eye_tex, gloo.RenderBuffer(self.size))
+        self.profiler = profiler or NullProfiler()
 
-        self.left_eye_program, self.left_eye_indices = Mesh.make_eye(self.left_eye_tex, 'left')
-        self.right_eye_program, self.right_eye_indices = Mesh.make_eye(self.right_eye_tex, 'right')
+        assert pose_source is not None or not (late_latch or timewarp), "Late-latching and timewarp need a pose_source"
+        self.pose_source = pose_source
+        self.late_latch = late_latch
+        self.timewarp = timewarp
+        self.rendered_pose = {}  # eye -> orientation matrix the eye buffer was rendered with
+        self.single_pass = single_pass
 
         self.IPD = 0.0647 # Interpupilary distance in m
         # Male: 64.7 mm
@@ -167,14 +564,100 @@ class Distorter(object):
         self.L_projection = parameters.projection_left.T
         self.R_projection = parameters.projection_right.T
 
+        # The distortion mesh only samples the part of the old full-screen eye render below
+        # uv_limit. Crop the projections to that window so it fills the whole eye buffer.
+        window = np.array(parameters.uv_limit) * parameters.uv_to_pixels
+        sx, sy = np.array(self.size, dtype=np.float64) / window
+        crop = np.array([
+            [sx, 0, 0, sx - 1],
+            [0, sy, 0, sy - 1],
+            [0, 0, 1, 0],
+            [0, 0, 0, 1],
+        ])
+        self.L_eye_projection = np.dot(np.asarray(self.L_projection), crop.T)
+        self.R_eye_projection = np.dot(np.asarray(self.R_projection), crop.T)
+
+        self.meshes = {'left': None, 'right': None}
+        if mesh_resolution is not None:
+            generator = MeshGenerator()
+            if mesh_resolution < 1:
+                mesh_resolution, _ = generator.cheapest(mesh_resolution)
+            mesh_resolution = int(mesh_resolution)
+            Logger.log('Distortion mesh: {0}x{0} cells'.format(mesh_resolution))
+            self.meshes = dict((eye, generator.generate(mesh_resolution, eye)) for eye in self.meshes)
+
+        assert not (lookup and timewarp), "Timewarp needs the distortion mesh"
+        self.lookups = self.lookup_uvs = None
+        if lookup:
+            eye_size = (self.size[0] // 2, self.size[1])
+            if lookup == 'lens':
+                self.lookup_uvs = dict((eye, DistortionLookup.bake(eye_size, eye)) for eye in ('left', 'right'))
+            else:
+                self.lookup_uvs = dict((eye, DistortionLookup.read_fpga_map(lookup, eye)) for eye in ('left', 'right'))
+            Logger.log('Distortion lookup: {}x{} per eye, from {}'.format(eye_size[0], eye_size[1], lookup))
+
+        self.left_eye_program = self.right_eye_program = None
+        self.set_render_scale(render_scale)
+
         self.no_distort = no_distort
         if self.no_distort:
             self.projection = perspective(30.0, 1920 / float(1080), 2.0, 10.0)
             self.draw = self.draw_no_distortion
+        elif single_pass:
+            self.draw = self.draw_single_pass
         else:
 
             self.draw = self.draw_distortion
 
+    def set_render_scale(self, render_scale):
+        '''Reallocate the eye buffers at $render_scale times the recommended size
+        Clamped to render_scale_range; safe to call between frames
+        '''
+        low, high = self.render_scale_range
+        self.render_scale = min(max(render_scale, low), high)
+        self.eye_size = width, height = parameters.eye_texture_size(self.L_projection, self.render_scale)
+        Logger.log('Eye buffers: {}x{} (render scale {:.2f})'.format(width, height, self.render_scale))
+
+        if self.single_pass:
+            # Both eyes share one texture; the right eye starts halfway across
+            self.left_viewport = (0, 0, width, height)
+            self.right_viewport = (width, 0, width, height)
+
+            self.left_eye_tex = self.right_eye_tex = gloo.Texture2D(shape=(height, 2 * width) + (3,))
+            self.stereo_eyes = gloo.FrameBuffer(self.left_eye_tex, gloo.RenderBuffer((height, 2 * width)))
+            tex_scale = np.array((0.5, 1.0)) / parameters.uv_limit
+        else:
+            self.left_eye_tex = gloo.Texture2D(shape=(height, width) + (3,))
+            self.right_eye_tex = gloo.Texture2D(shape=(height, width) + (3,))
+            
+            self.left_eye = gloo.FrameBuffer(self.left_eye_tex, gloo.RenderBuffer((height, width)))
+            self.right_eye = gloo.FrameBuffer(self.right_eye_tex, gloo.RenderBuffer((height, width)))
+            tex_scale = 1.0 / np.array(parameters.uv_limit)
+
+        if self.left_eye_program is None:
+            self.left_eye_program, self.left_eye_indices = Mesh.make_eye(self.left_eye_tex, 'left', self.meshes['left'])
+            self.right_eye_program, self.right_eye_indices = Mesh.make_eye(self.right_eye_tex, 'right', self.meshes['right'])
+        else:
+            self.left_eye_program['texture'] = self.left_eye_tex
+            self.right_eye_program['texture'] = self.right_eye_tex
+
+        self.left_eye_program['tex_scale'] = tex_scale
+        self.right_eye_program['tex_scale'] = tex_scale
+        if self.single_pass:
+            self.right_eye_program['eye_offset'] = (0.5, 0.0)
+
+        if self.lookup_uvs is not None:
+            if self.lookups is None:
+                self.lookups = {
+                    'left': DistortionLookup(self.lookup_uvs['left'], self.left_eye_tex, 'left'),
+                    'right': DistortionLookup(self.lookup_uvs['right'], self.right_eye_tex, 'right'),
+                }
+            self.lookups['left']['texture'] = self.left_eye_tex
+            self.lookups['right']['texture'] = self.right_eye_tex
+            if self.single_pass:
+                self.lookups['left']['tex_scale'] = self.lookups['right']['tex_scale'] = (0.5, 1.0)
+                self.lookups['right']['eye_offset'] = (0.5, 0.0)
+
     def draw_no_distortion(self, *Contexts):
         '''Distorter WITHOUT applying distortion or chromatic aberration corrections
 
@@ -198,20 +681,103 @@ class Distorter(object):
         gloo.set_clear_color('black')
         gloo.set_state(depth_test=True)
 
-        with self.left_eye:
+        with self.profiler.phase('left_eye', gpu=True), self.left_eye:
+            self.latch_pose(Contexts, 'left')
+            gloo.set_viewport(0, 0, *self.eye_size)
             gloo.clear(color=True, depth=True)
             for context in Contexts:
-                context.translate(0, self.IPD / 2, 0)
-                context.set_projection(self.L_projection)
+                context.set_uniform('view', self.eye_views(context)[0])
+                context.set_projection(self.L_eye_projection)
+                context.viewport = (0, 0) + tuple(self.eye_size)
                 context.draw()
 
-        with self.right_eye:
+        with self.profiler.phase('right_eye', gpu=True), self.right_eye:
+            self.latch_pose(Contexts, 'right')
             gloo.clear(color=True, depth=True)
             for context in Contexts:
-                context.translate(0, -self.IPD / 2, 0)
-                context.set_projection(self.R_projection)
+                context.set_uniform('view', self.eye_views(context)[1])
+                context.set_projection(self.R_eye_projection)
+                context.viewport = (0, 0) + tuple(self.eye_size)
                 context.draw()
 
-        gloo.clear(color=True, depth=True)
-        self.left_eye_program.draw('triangles', self.left_eye_indices)
-        self.right_eye_program.draw('triangles', self.right_eye_indices)
\ No newline at end of file
+        self.apply_distortion()
+
+    def eye_views(self, context):
+        '''eye_views(context) -> (left, right) views: copies of the context's view, shifted half the IPD each way
+        Both draw paths stage these, so the eyes are always one IPD apart and context.view is left as it was
+        '''
+        left_view, right_view = np.array(context.view), np.array(context.view)
+        translate(left_view, 0, self.IPD / 2, 0)
+        translate(right_view, 0, -self.IPD / 2, 0)
+        return left_view, right_view
+
+    def latch_pose(self, Contexts, *eyes):
+        '''Sample the newest pose for the eye pass(es) about to be drawn
+        With late_latch, it becomes the view of every world_locked Context
+        '''
+        if self.pose_source is None:
+            return
+        orientation = np.array(self.pose_source())
+        for eye in eyes:
+            self.rendered_pose[eye] = orientation
+        if self.late_latch:
+            for context in Contexts:
+                if context.world_locked:
+                    context.set_view(np.array(orientation))
+
+    def eye_rotation(self, rendered, current):
+        '''eye_rotation(rendered, current) -> 4x4 timewarp rotation as uploaded to EyeRotationStart/End
+        Maps a view ray of the current head orientation to the ray of the pose the eye buffer
+        was rendered with, expressed in TanEyeAngle space
+        '''
+        # The view uniform is uploaded untransposed, so the eye-from-world rotation GLSL sees is orientation.T
+        delta = np.dot(rendered[:3, :3].T, current[:3, :3])
+        basis = self.tan_eye_basis
+        rotation = np.eye(4)
+        rotation[:3, :3] = np.dot(basis, np.dot(delta, basis)).T  # Transposed for upload
+        return rotation
+
+    def apply_timewarp(self):
+        current = np.array(self.pose_source())
+        for eye, program in (('left', self.left_eye_program), ('right', self.right_eye_program)):
+            rotation = self.eye_rotation(self.rendered_pose[eye], current)
+            program['EyeRotationStart'] = rotation
+            program['EyeRotationEnd'] = rotation
+
+    def apply_distortion(self):
+        '''Warp the eye buffers onto the screen'''
+        with self.profiler.phase('distortion', gpu=True):
+            if self.timewarp:
+                self.apply_timewarp()
+            gloo.set_viewport(0, 0, *self.size)
+            gloo.clear(color=True, depth=True)
+            if self.lookups is not None:
+                self.lookups['left'].draw()
+                self.lookups['right'].draw()
+                return
+            self.left_eye_program.draw('triangles', self.left_eye_indices)
+            self.right_eye_program.draw('triangles', self.right_eye_indices)
+
+    def draw_single_pass(self, *Contexts):
+        '''Distorter.draw(list_of_drawables)
+        Same output as draw_distortion, but both eyes are rendered into side-by-side
+        halves of one framebuffer while walking each Context only once.
+        The eye is chosen by viewport; each eye's view and projection are staged once
+        per frame and only re-uploaded to a drawable when they differ from what it has.
+        Every drawable is still drawn, and gets its view, once per eye: this saves the second
+        framebuffer bind and the uploads both eyes share, not draw calls (Compare with vsr-bench).
+        '''
+        gloo.set_clear_color('black')
+        gloo.set_state(depth_test=True)
+
+        with self.profiler.phase('stereo_eyes', gpu=True), self.stereo_eyes:
+            self.latch_pose(Contexts, 'left', 'right')
+            gloo.clear(color=True, depth=True)
+            for context in Contexts:
+                left_view, right_view = self.eye_views(context)
+                context.draw_stereo([
+                    (self.left_viewport, {'view': left_view, 'projection': self.L_eye_projection}),
+                    (self.right_viewport, {'view': right_view, 'projection': self.R_eye_projection}),
+                ])
+
+        self.apply_distortion()
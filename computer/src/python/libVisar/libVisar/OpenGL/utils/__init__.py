@@ -1,2 +1,4 @@
 from .logger import Logger
-from .utils import checkerboard
\ No newline at end of file
+from .utils import checkerboard
+from .profiler import FrameProfiler, NullProfiler
+from .scheduler import FrameScheduler
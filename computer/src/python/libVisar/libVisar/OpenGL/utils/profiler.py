@@ -0,0 +1,233 @@
+from __future__ import absolute_import
+import collections
+import contextlib
+import itertools
+import json
+import time
+
+import numpy as np
+
+from .logger import Logger
+
+try:
+    # PyOpenGL (optional) exposes the timer queries that vispy.gloo does not
+    from OpenGL import GL
+except ImportError:
+    GL = None
+
+
+class GpuTimer(object):
+    '''Non-blocking GL_TIME_ELAPSED queries
+    Results are collected a few frames after they are issued, so reading them never stalls the pipeline.
+    Timer queries cannot nest; only one query may be open at a time.
+    If PyOpenGL or the extension is unavailable, the timer disables itself (available = False).
+    '''
+    def __init__(self):
+        self.available = GL is not None
+        self.pending = collections.deque()  # (frame, name, query), oldest first
+        self.free = []
+        self.active = None
+
+    def _disable(self, error):
+        '''Stop timing on the GPU after a GL error, logging it once'''
+        if self.available:
+            Logger.warn('GPU timer queries unavailable, GPU times disabled:', error)
+        self.available = False
+        self.pending.clear()
+        self.active = None
+
+    def begin(self, frame, name):
+        if not self.available or self.active is not None:
+            return False
+        try:
+            query = self.free.pop() if self.free else GL.glGenQueries(1)
+            GL.glBeginQuery(GL.GL_TIME_ELAPSED, query)
+        except Exception as e:
+            self._disable(e)
+            return False
+        self.active = (frame, name, query)
+        return True
+
+    def end(self):
+        if self.active is None:
+            return
+        try:
+            GL.glEndQuery(GL.GL_TIME_ELAPSED)
+        except Exception as e:
+            self._disable(e)
+            return
+        self.pending.append(self.active)
+        self.active = None
+
+    def collect(self):
+        '''collect() -> [(frame, name, seconds), ...] for every query whose result is ready'''
+        results = []
+        try:
+            while self.pending:
+                frame, name, query = self.pending[0]
+                if not GL.glGetQueryObjectiv(query, GL.GL_QUERY_RESULT_AVAILABLE):
+                    break
+                nanoseconds = GL.glGetQueryObjectui64v(query, GL.GL_QUERY_RESULT)
+                results.append((frame, name, nanoseconds * 1e-9))
+                self.free.append(query)
+                self.pending.popleft()
+        except Exception as e:
+            self._disable(e)
+        return results
+
+
+class FrameProfiler(object):
+    '''FrameProfiler(history=300, gpu=True) -> FrameProfiler
+    Records per-phase CPU time (and GPU time, where timer queries exist) for the last $history frames
+
+    Usage:
+        >>> profiler.begin_frame()
+        >>> with profiler.phase('update'):
+        ...     do_update()
+        >>> with profiler.phase('distortion', gpu=True):
+        ...     draw_distortion()
+        >>> profiler.end_frame()
+        >>> profiler.stats()['distortion']['p95']
+
+    Phases may nest on the CPU. Only one gpu=True phase may be open at a time.
+    Times are reported in milliseconds.
+    '''
+    percentiles = (50, 95, 99)
+
+    def __init__(self, history=300, gpu=True):
+        self.frames = collections.deque(maxlen=history)
+        self.gpu = GpuTimer() if gpu else None
+        self.frame = None
+        self._frame_ids = itertools.count()
+        self._epoch = time.time()
+
+    def begin_frame(self):
+        if self.frame is not None:
+            self.end_frame()
+        self.frame = {
+            'id': next(self._frame_ids),
+            'start': time.time(),
+            'phases': [],  # (name, start, cpu seconds)
+            'gpu': {},  # name -> gpu seconds
+        }
+
+    def end_frame(self):
+        if self.frame is None:
+            return
+        self.frame['end'] = time.time()
+        self.frames.append(self.frame)
+        self.frame = None
+        self._collect_gpu()
+
+    def discard_frame(self):
+        '''Drop the open frame without recording it (ex: the frame scheduler skipped drawing it)
+        GPU queries already issued for it are still collected, then ignored
+        '''
+        self.frame = None
+
+    @contextlib.contextmanager
+    def phase(self, name, gpu=False):
+        if self.frame is None:
+            self.begin_frame()
+        frame = self.frame
+        timing_gpu = gpu and self.gpu is not None and self.gpu.begin(frame['id'], name)
+        start = time.time()
+        try:
+            yield
+        finally:
+            if timing_gpu:
+                self.gpu.end()
+            frame['phases'].append((name, start, time.time() - start))
+
+    def _collect_gpu(self):
+        if self.gpu is None or not self.gpu.available:
+            return
+        by_id = dict((frame['id'], frame) for frame in self.frames)
+        for frame_id, name, seconds in self.gpu.collect():
+            if frame_id in by_id:
+                gpu = by_id[frame_id]['gpu']
+                gpu[name] = gpu.get(name, 0.0) + seconds
+
+    def samples(self):
+        '''samples() -> {phase: [ms per frame, ...]}
+        The 'frame' entry is the wall time from begin_frame to end_frame, GPU phases are suffixed '(gpu)'
+        '''
+        series = collections.OrderedDict()
+        series['frame'] = [(frame['end'] - frame['start']) * 1e3 for frame in self.frames]
+        for frame in self.frames:
+            totals = collections.OrderedDict()
+            for name, start, seconds in frame['phases']:
+                totals[name] = totals.get(name, 0.0) + seconds
+            for name, seconds in frame['gpu'].items():
+                totals[name + ' (gpu)'] = seconds
+            for name, seconds in totals.items():
+                series.setdefault(name, []).append(seconds * 1e3)
+        return series
+
+    def stats(self):
+        '''stats() -> {phase: {'p50': ms, 'p95': ms, 'p99': ms, 'mean': ms, 'count': frames}}'''
+        stats = collections.OrderedDict()
+        for name, values in self.samples().items():
+            if not values:
+                continue
+            entry = dict(('p{}'.format(p), v) for p, v in zip(self.percentiles, np.percentile(values, self.percentiles)))
+            entry['mean'] = float(np.mean(values))
+            entry['count'] = len(values)
+            stats[name] = entry
+        return stats
+
+    def summary(self):
+        '''Human readable table of stats()'''
+        lines = ['{:<20} {:>8} {:>8} {:>8}'.format('phase (ms)', 'p50', 'p95', 'p99')]
+        for name, entry in self.stats().items():
+            lines.append('{:<20} {:>8.2f} {:>8.2f} {:>8.2f}'.format(name, entry['p50'], entry['p95'], entry['p99']))
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        '''chrome_trace() -> dict in the Chrome trace event format (Load in chrome://tracing)
+        GPU phases are drawn on their own track, starting at the CPU time the query was issued
+        '''
+        events = []
+        for frame in self.frames:
+            events.append(self._event('frame', frame['start'], frame['end'] - frame['start'], 'CPU'))
+            for name, start, seconds in frame['phases']:
+                events.append(self._event(name, start, seconds, 'CPU'))
+                if name in frame['gpu']:
+                    events.append(self._event(name, start, frame['gpu'][name], 'GPU'))
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def dump_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        Logger.log('Wrote frame trace to', path)
+
+    def _event(self, name, start, seconds, track):
+        return {
+            'name': name,
+            'ph': 'X',
+            'pid': 0,
+            'tid': track,
+            'ts': (start - self._epoch) * 1e6,
+            'dur': seconds * 1e6,
+        }
+
+
+class NullProfiler(object):
+    '''Stand-in for FrameProfiler when profiling is off; every call is a no-op'''
+    frames = ()
+
+    def begin_frame(self):
+        pass
+
+    def end_frame(self):
+        pass
+
+    def discard_frame(self):
+        pass
+
+    @contextlib.contextmanager
+    def phase(self, name, gpu=False):
+        yield
+
+    def stats(self):
+        return {}
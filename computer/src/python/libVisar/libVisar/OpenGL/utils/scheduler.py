@@ -0,0 +1,175 @@
+from __future__ import absolute_import, division
+import collections
+import contextlib
+import time
+
+import numpy as np
+
+from .logger import Logger
+
+
+class FrameScheduler(object):
+    '''FrameScheduler(display_rate=60, min_rate=15, idle_rate=2) -> FrameScheduler
+    Decides on each timer tick whether a new frame is worth drawing
+
+    A frame is drawn when something on screen changed (a watched value) and the next vsync-aligned
+    deadline has arrived, or when nothing changed for 1 / idle_rate seconds (keeps clocks, the HUD,
+    etc. ticking over). Everything else is skipped, which saves power on battery units.
+
+    The target rate is display_rate / n (60, 30, 20, 15...) so frames stay aligned to vsync. It steps
+    down when drawing takes longer than the frame budget and back up when there is room again.
+
+    Usage:
+        >>> scheduler = FrameScheduler(display_rate=60)
+        >>> scheduler.watch('targets', lambda: State.targets)
+        >>> timer = app.Timer(scheduler.tick_interval, connect=on_timer)
+        ... # In on_timer
+        >>> if scheduler.should_draw(): canvas.update()
+        ... # In on_draw
+        >>> with scheduler.drawing(): draw()
+        >>> scheduler.stats()
+
+    Counters:
+        drawn - Frames drawn
+        skipped - Ticks where nothing changed and no frame was drawn
+        dropped - Deadlines missed because a tick or a draw ran late
+        duplicated - Frames drawn although nothing changed (idle refresh, window system redraws)
+    '''
+    budget = 0.9  # Step the rate down when the draw time average exceeds this fraction of the frame period
+    headroom = 0.6  # Step it back up when the average fits in this fraction of the faster rate's period
+    smoothing = 0.1  # Weight of the newest draw time in the running average
+
+    def __init__(self, display_rate=60.0, min_rate=15.0, idle_rate=2.0, adaptive=True, clock=time.time):
+        self.display_rate = float(display_rate)
+        self.max_divisor = max(1, int(self.display_rate // min_rate))
+        self.idle_period = 1.0 / idle_rate if idle_rate else None
+        self.adaptive = adaptive
+        self.clock = clock
+
+        self.watchers = collections.OrderedDict()  # name -> [getter, last value]
+        self.divisor = 1
+        self.draw_time = 0.0
+
+        self.epoch = clock()
+        self.next_deadline = self.epoch
+        self.last_draw = self.epoch
+        self.changed = set(['start'])
+
+        self.drawn = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.duplicated = 0
+
+    @property
+    def tick_interval(self):
+        '''Timer interval; ticks run at the display rate, whatever the target rate'''
+        return 1.0 / self.display_rate
+
+    @property
+    def rate(self):
+        return self.display_rate / self.divisor
+
+    @property
+    def period(self):
+        return self.divisor / self.display_rate
+
+    def watch(self, name, getter):
+        '''Redraw whenever getter() returns something different from the last tick'''
+        self.watchers[name] = [getter, getter()]
+
+    def invalidate(self, reason='invalidate'):
+        '''Force a redraw at the next deadline (ex: a key press changed the scene)'''
+        self.changed.add(reason)
+
+    @staticmethod
+    def _equal(a, b):
+        if a is b:
+            return True
+        if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+            return np.array_equal(a, b)
+        try:
+            return bool(a == b)
+        except ValueError:
+            return False
+
+    def poll(self):
+        '''poll() -> set of watcher names that changed since the last poll'''
+        for name, watcher in self.watchers.items():
+            getter, last = watcher
+            value = getter()
+            if not self._equal(value, last):
+                watcher[1] = value
+                self.changed.add(name)
+        return self.changed
+
+    def should_draw(self):
+        '''should_draw() -> True if the caller should draw a frame now
+        Call once per timer tick
+        '''
+        now = self.clock()
+        self.poll()
+        if now < self.next_deadline:
+            return False
+
+        # Whole periods between the deadline and now were missed
+        period = self.period
+        late = int((now - self.next_deadline) // period)
+        if late and self.drawn:
+            self.dropped += late
+        # Next deadline on the vsync grid
+        self.next_deadline = self.epoch + (int((now - self.epoch) // period) + 1) * period
+
+        idle = self.idle_period is not None and now - self.last_draw >= self.idle_period
+        if self.changed or idle:
+            return True
+        self.skipped += 1
+        return False
+
+    def frame_drawn(self, start, end):
+        '''Record a frame drawn between $start and $end (clock seconds)'''
+        if not self.changed:
+            self.duplicated += 1
+        self.changed = set()
+        self.drawn += 1
+        self.last_draw = end
+
+        duration = end - start
+        if duration > self.period:
+            self.dropped += int(duration // self.period)
+        self.draw_time += self.smoothing * (duration - self.draw_time)
+        if self.adaptive:
+            self._adapt()
+
+    @contextlib.contextmanager
+    def drawing(self):
+        '''Context manager around a draw, calls frame_drawn'''
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.frame_drawn(start, self.clock())
+
+    def _adapt(self):
+        divisor = self.divisor
+        if self.draw_time > self.budget * self.period and divisor < self.max_divisor:
+            divisor += 1
+        elif divisor > 1 and self.draw_time < self.headroom * (divisor - 1) / self.display_rate:
+            divisor -= 1
+        if divisor != self.divisor:
+            self.divisor = divisor
+            Logger.log('Frame scheduler target rate: {:.1f} fps'.format(self.rate))
+
+    def stats(self):
+        return {
+            'rate': self.rate,
+            'drawn': self.drawn,
+            'skipped': self.skipped,
+            'dropped': self.dropped,
+            'duplicated': self.duplicated,
+            'draw_ms': self.draw_time * 1e3,
+        }
+
+    def summary(self):
+        return ('target {rate:.1f} fps, draw {draw_ms:.1f} ms, {drawn} drawn, {skipped} skipped, '
+                '{dropped} dropped, {duplicated} duplicated').format(**self.stats())
+
@@ -19,7 +19,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-from .manager import PILImageManager, OSMManager
+from .manager import PILImageManager, NumpyImageManager, OSMManager
+from .tile_store import TileStore
+from .downloader import TileDownloader, TileResponse
 
 # from .animation import *
 # from .manager import *
\ No newline at end of file
@@ -0,0 +1,230 @@
+"""
+Concurrent tile downloads:
+  - A few worker threads, each reusing a keep-alive HTTP connection to
+    the tile server, instead of one new connection per tile.
+  - Every request has a timeout, and failures (network errors, 5xx,
+    429) are retried with exponential backoff.
+  - Conditional requests: given the ETag/Last-Modified of a copy we
+    already have, the server can answer 304 instead of resending it.
+
+Usage:
+  >>> downloader = TileDownloader("http://tile.openstreetmap.org", workers=4)
+  >>> results = downloader.download({(9, 140, 215): "/9/140/215.png"})
+  >>> results[(9, 140, 215)].data
+"""
+import httplib
+import socket
+import threading
+import time
+import Queue
+import urlparse
+
+USER_AGENT = 'OSMViz/1.0 +http://cbick.github.com/osmviz'
+
+
+class TileResponse(object):
+  """
+  Outcome of one tile request.
+    status - HTTP status of the last attempt, None if it never got one
+    data - body of a 200 response, else None
+    etag, modified - the response's ETag and Last-Modified headers
+    error - why the tile could not be fetched, None on 200 and 304
+    attempts - requests made
+  """
+
+  def __init__(self, status=None, data=None, etag=None, modified=None,
+               error=None, attempts=0):
+    self.status = status
+    self.data = data
+    self.etag = etag
+    self.modified = modified
+    self.error = error
+    self.attempts = attempts
+
+  @property
+  def ok(self):
+    return self.status == 200
+
+  @property
+  def not_modified(self):
+    return self.status == 304
+
+  def __repr__(self):
+    return "TileResponse(status=%r, bytes=%r, error=%r)" % (
+      self.status, len(self.data) if self.data is not None else None, self.error)
+
+
+class TileDownloader(object):
+  """
+  Fetches tiles from one server over a pool of keep-alive connections.
+  Safe to share between threads: fetch() borrows a connection from the
+  pool for the duration of a request.
+  """
+
+  retry_statuses = (429, 500, 502, 503, 504)
+
+  def __init__(self, server, workers=4, timeout=10.0, retries=3,
+               backoff=0.5, user_agent=USER_AGENT):
+    """
+    Arguments:
+
+    server - URL of the tile server, including the protocol.
+
+    workers - concurrent requests made by download(). Default 4.
+
+    timeout - seconds to wait on the server, per request. Default 10.
+
+    retries - extra attempts after a failure. Default 3.
+
+    backoff - seconds to wait before the first retry, doubling after
+              every retry. Default 0.5.
+    """
+    url = urlparse.urlsplit(server)
+    if url.scheme == 'https':
+      self.connection_class = httplib.HTTPSConnection
+    elif url.scheme == 'http':
+      self.connection_class = httplib.HTTPConnection
+    else:
+      raise ValueError("Unsupported tile server URL: %s" % server)
+    self.host = url.netloc
+    self.base_path = url.path.rstrip('/')
+    self.workers = workers
+    self.timeout = timeout
+    self.retries = retries
+    self.backoff = backoff
+    self.user_agent = user_agent
+
+    self.pool = Queue.LifoQueue()  # Idle connections, most recently used first
+    self.lock = threading.Lock()  # Guards the counters
+    self.connections = 0  # Opened so far
+    self.requests = 0
+    self.retried = 0
+
+  def _connect(self):
+    with self.lock:
+      self.connections += 1
+    return self.connection_class(self.host, timeout=self.timeout)
+
+  def _borrow(self):
+    try:
+      return self.pool.get_nowait()
+    except Queue.Empty:
+      return self._connect()
+
+  def close(self):
+    """
+    Closes the idle connections.
+    """
+    while True:
+      try:
+        self.pool.get_nowait().close()
+      except Queue.Empty:
+        return
+
+  def _request(self, connection, path, etag, modified):
+    headers = {'User-Agent': self.user_agent, 'Connection': 'keep-alive'}
+    if etag:
+      headers['If-None-Match'] = etag
+    if modified:
+      headers['If-Modified-Since'] = modified
+    with self.lock:
+      self.requests += 1
+    connection.request('GET', self.base_path + path, headers=headers)
+    response = connection.getresponse()
+    data = response.read()  # Always drain, or the connection can't be reused
+    return response, data
+
+  def fetch(self, path, etag=None, modified=None):
+    """
+    Requests path (ex: "/9/140/215.png") and returns a TileResponse.
+    etag and modified are the validators of a copy we already have; if
+    it is still current the server answers 304 and data is None.
+    """
+    result = TileResponse()
+    connection = self._borrow()
+    for attempt in range(self.retries + 1):
+      if attempt:
+        with self.lock:
+          self.retried += 1
+        time.sleep(self.backoff * 2 ** (attempt - 1))
+      result.attempts = attempt + 1
+      try:
+        response, data = self._request(connection, path, etag, modified)
+      except (httplib.HTTPException, socket.error), e:
+        # Stale keep-alive connection, timeout, refused...: start over
+        connection.close()
+        connection = self._connect()
+        result.status, result.error = None, e
+        continue
+
+      result.status = response.status
+      result.etag = response.getheader('ETag')
+      result.modified = response.getheader('Last-Modified')
+      if response.status == 200:
+        result.data, result.error = data, None
+      elif response.status == 304:
+        result.error = None
+      else:
+        result.error = "HTTP %d %s" % (response.status, response.reason)
+      if response.getheader('Connection', '').lower() == 'close':
+        connection.close()
+        connection = self._connect()
+      if response.status not in self.retry_statuses:
+        break
+
+    self.pool.put(connection)
+    return result
+
+  def download(self, requests, callback=None):
+    """
+    Fetches many tiles concurrently, with at most self.workers requests
+    in flight. Blocks until every tile is done.
+    Arguments:
+
+    requests - dict of key -> path, or of key -> (path, etag, modified)
+               to make conditional requests. Keys are up to the caller,
+               ex: (zoom, x, y).
+
+    callback - called as callback(key, response) on the worker thread as
+               soon as each tile is done, ex: to store it. An exception it
+               raises becomes the response's error.
+
+    Returns a dict of key -> TileResponse.
+    """
+    jobs = Queue.Queue()
+    for key, request in requests.items():
+      if isinstance(request, basestring):
+        request = (request, None, None)
+      jobs.put((key,) + tuple(request))
+    results = {}
+
+    def work():
+      while True:
+        try:
+          key, path, etag, modified = jobs.get_nowait()
+        except Queue.Empty:
+          return
+        response = self.fetch(path, etag, modified)
+        results[key] = response
+        if callback:
+          try:
+            callback(key, response)
+          except Exception, e:
+            response.error = e
+
+    threads = [threading.Thread(target=work, name='TileDownloader-%d' % n)
+               for n in range(min(self.workers, len(requests)))]
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return results
+
+  def stats(self):
+    return {
+      'connections': self.connections,
+      'requests': self.requests,
+      'retried': self.retried,
+      'idle': self.pool.qsize(),
+    }
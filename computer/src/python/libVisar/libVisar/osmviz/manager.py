@@ -1,11 +1,12 @@
 """
 OpenStreetMap Management Tool:
   - Provides simple interface to retrieve and tile OSM images
-  - Can use pygame or PIL (to generate pygame Surfaces or PIL images)
+  - Can use pygame, PIL or NumPy (to generate pygame Surfaces, PIL images
+    or NumPy arrays)
 
 Basic idea:
   1. Choose an ImageManager class and construct an instance.
-     - Pygame and PIL implementations available
+     - Pygame, PIL and NumPy implementations available
      - To make your own custom ImageManager, override the ImageManager
        class.
   2. Construct an OSMManager object.
@@ -39,6 +40,11 @@ import urllib
 import hashlib
 import os.path as path
 import os
+import threading
+import email.utils
+from cStringIO import StringIO
+
+from .downloader import TileDownloader
 
 class ImageManager(object):
   """
@@ -80,7 +86,7 @@ class ImageManager(object):
     Create and internally store an image whose dimensions
     are those specified by width and height.
     """
-    if self.image:
+    if self.image is not None:
       raise Exception, "Image already prepared."
     self.image = self.create_image(width,height)
 
@@ -89,7 +95,7 @@ class ImageManager(object):
     Destroys internal representation of the image, if it was
     ever created.
     """
-    if self.image:
+    if self.image is not None:
       del self.image
     self.image = None
 
@@ -99,7 +105,7 @@ class ImageManager(object):
     location at which to place the top left corner of the contents
     of that image, pastes the image into this object's internal image.
     """
-    if not self.image:
+    if self.image is None:
       raise Exception, "Image not prepared"
 
     try:
@@ -169,6 +175,64 @@ class PILImageManager(ImageManager):
 
 
 
+class NumpyImageManager(ImageManager):
+  """
+  An ImageManager which decodes tiles straight into one preallocated
+  (height, width, bands) uint8 NumPy array, ready for Texture2D.set_data.
+  Unlike a PIL image, the result needs no np.asarray() copy, and tiles
+  are never pasted into an intermediate canvas.
+  """
+
+  def __init__(self,mode='RGB',buffer=None,filename=None):
+    """
+    Constructs a NumPy Image Manager.
+    Arguments:
+      mode - the PIL mode tiles are converted to; the array has one
+             band per channel of it. Default 'RGB'.
+      buffer - a contiguous uint8 array to build the image in (its first
+               height*width*bands bytes), ex: to reuse one buffer for
+               every region, or one in shared memory. Default None.
+      filename - build the image in a memory-mapped file of this name
+                 instead, ex: for regions larger than memory.
+                 Default None.
+    """
+    ImageManager.__init__(self)
+    self.mode = mode
+    self.buffer = buffer
+    self.filename = filename
+    try: import PIL.Image
+    except: raise Exception, "PIL could not be imported!"
+    self.PILImage = PIL.Image
+    import numpy
+    self.numpy = numpy
+    self.bands = PIL.Image.getmodebands(mode)
+
+  def create_image(self,width,height):
+    shape = (height, width, self.bands)
+    size = height * width * self.bands
+    if self.buffer is not None:
+      if self.buffer.dtype != self.numpy.uint8 or self.buffer.size < size \
+          or not self.buffer.flags.c_contiguous:
+        raise Exception, "Buffer must be contiguous uint8 of at least %d bytes" % size
+      return self.buffer.reshape(-1)[:size].reshape(shape)
+    if self.filename is not None:
+      return self.numpy.memmap(self.filename, dtype=self.numpy.uint8,
+                               mode='w+', shape=shape)
+    return self.numpy.empty(shape, dtype=self.numpy.uint8)
+
+  def load_image_file(self,imagef):
+    img = self.PILImage.open(imagef)
+    if img.mode != self.mode:
+      img = img.convert(self.mode)
+    return self.numpy.asarray(img).reshape(img.size[1], img.size[0], self.bands)
+
+  def paste_image(self,img,xy):
+    x, y = xy
+    height, width = img.shape[:2]
+    self.getImage()[y:y+height, x:x+width] = img
+
+
+
 class OSMManager(object):
   """
   An OSMManager manages the retrieval and storage of Open Street Map
@@ -190,10 +254,17 @@ class OSMManager(object):
 
     image_manager - ImageManager instance which will be used to do all
                     image manipulation. You must provide this.
+
+    store - TileStore in which to keep downloaded tiles instead of one file
+            per tile in the cache directory. Default None.
+
+    downloader - TileDownloader to fetch tiles with. Default: one for
+                 server, with its default concurrency, timeout and retries.
     """
     cache = kwargs.get('cache')
     server = kwargs.get('server')
     mgr = kwargs.get('image_manager')
+    self.store = kwargs.get('store')
     
     self.cache = None
     
@@ -210,7 +281,7 @@ class OSMManager(object):
       else:
         self.cache = cache
 
-    if not self.cache:
+    if not self.cache and self.store is None:
       self.cache = ( os.getenv("TMPDIR")
                      or os.getenv("TMP")
                      or os.getenv("TEMP")
@@ -230,6 +301,8 @@ class OSMManager(object):
     md5.update(self.server)
     self.cache_prefix =  'osmviz-%s-' % md5.hexdigest()[:5]
 
+    self.downloader = kwargs.get('downloader') or TileDownloader(self.server)
+
     if mgr: # Assume it's a valid manager 
       self.manager = mgr
     else:
@@ -250,13 +323,20 @@ class OSMManager(object):
                  / math.pi) / 2.0 * n)
     return(xtile, ytile)
 
+  def getTilePath(self, tile_coord, zoom):
+    """
+    Given x,y coord of the tile to download, and the zoom level,
+    returns the path of the image on the server.
+    """
+    params = (zoom,tile_coord[0],tile_coord[1])
+    return "/%d/%d/%d.png" % params
+
   def getTileURL(self, tile_coord, zoom):
     """
     Given x,y coord of the tile to download, and the zoom level,
     returns the URL from which to download the image.
     """
-    params = (zoom,tile_coord[0],tile_coord[1])
-    return self.server+"/%d/%d/%d.png" % params
+    return self.server+self.getTilePath(tile_coord,zoom)
 
   def getLocalTileFilename(self, tile_coord, zoom):
     """
@@ -268,19 +348,98 @@ class OSMManager(object):
     params = (self.cache_prefix,zoom,tile_coord[0],tile_coord[1])
     return path.join(self.cache, "%s%d_%d_%d.png" % params)
 
+  def _saveTile(self,tile_coord,zoom,response):
+    """
+    Keeps a downloaded tile (TileResponse) in the store or the cache
+    directory; for a 304, marks our copy as current.
+    """
+    if response.not_modified:
+      if self.store is not None:
+        self.store.touch((zoom,tile_coord[0],tile_coord[1]))
+      else:
+        os.utime(self.getLocalTileFilename(tile_coord,zoom), None)
+    elif response.ok:
+      if self.store is not None:
+        self.store.put((zoom,tile_coord[0],tile_coord[1]), response.data,
+                       response.etag, response.modified)
+      else:
+        # Write then rename, so readers never see a partial tile
+        filename = self.getLocalTileFilename(tile_coord,zoom)
+        partial = "%s.%d.part" % (filename, threading.current_thread().ident)
+        with open(partial, 'wb') as f:
+          f.write(response.data)
+        os.rename(partial, filename)
+
+  def _download(self,tile_coord,zoom):
+    response = self.downloader.fetch(self.getTilePath(tile_coord,zoom))
+    if not response.ok:
+      url = self.getTileURL(tile_coord,zoom)
+      raise Exception, "Unable to retrieve URL: "+url+"\n"+str(response.error)
+    self._saveTile(tile_coord,zoom,response)
+    return response.data
+
+  def hasTile(self,tile_coord,zoom):
+    """
+    Given x,y coord of the tile, and the zoom level,
+    returns whether we already have the tile.
+    """
+    if self.store is not None:
+      return (zoom,tile_coord[0],tile_coord[1]) in self.store
+    return path.isfile(self.getLocalTileFilename(tile_coord,zoom))
+
+  def retrieveTiles(self,tile_coords,zoom,refresh=False):
+    """
+    Given a list of x,y coords of tiles, and the zoom level,
+    downloads the ones we don't have yet, several at a time
+    over reused connections (see TileDownloader).
+    With refresh, also asks the server whether the ones we
+    have are still current, and replaces those that are not.
+    Returns a dict of x,y coord -> TileResponse for the tiles
+    requested from the server; failed ones have an error.
+    """
+    requests = {}
+    for tile_coord in tile_coords:
+      tile_coord = tuple(tile_coord)
+      etag = modified = None
+      if self.hasTile(tile_coord,zoom):
+        if not refresh:
+          continue
+        if self.store is not None:
+          etag, modified = self.store.validators((zoom,)+tile_coord)
+        else:
+          mtime = path.getmtime(self.getLocalTileFilename(tile_coord,zoom))
+          modified = email.utils.formatdate(mtime, usegmt=True)
+      requests[tile_coord] = (self.getTilePath(tile_coord,zoom), etag, modified)
+    return self.downloader.download(
+      requests, lambda tile_coord, response: self._saveTile(tile_coord,zoom,response))
+
+  def retrieveTileData(self,tile_coord,zoom):
+    """
+    Given x,y coord of the tile, and the zoom level,
+    returns the encoded (PNG) image of the tile, from the
+    store or the cache directory if it is there, or else
+    downloaded (and stored).
+    """
+    if self.store is None:
+      return open(self.retrieveTileImage(tile_coord,zoom), 'rb').read()
+    data = self.store.get((zoom,tile_coord[0],tile_coord[1]))
+    if data is None:
+      data = self._download(tile_coord,zoom)
+    return data
+
   def retrieveTileImage(self,tile_coord,zoom):
     """
     Given x,y coord of the tile, and the zoom level,
     retrieves the file to disk if necessary and 
     returns the local filename.
+    With a store, returns a file object holding the
+    image instead (image managers load either).
     """
+    if self.store is not None:
+      return StringIO(self.retrieveTileData(tile_coord,zoom))
     filename = self.getLocalTileFilename(tile_coord,zoom)
     if not path.isfile(filename):
-      url = self.getTileURL(tile_coord,zoom)
-      try:
-        urllib.urlretrieve(url, filename=filename);
-      except Exception,e:
-        raise Exception, "Unable to retrieve URL: "+url+"\n"+str(e)
+      self._download(tile_coord,zoom)
     return filename
 
   def tileNWLatlon(self,tile_coord,zoom):
@@ -319,6 +478,10 @@ class OSMManager(object):
     self.manager.prepare_image( pix_width, pix_height )
     print "Retrieving %d tiles..." % ( (1+maxX-minX)*(1+maxY-minY) ,)
 
+    # Download the missing tiles concurrently; the loop below only reads
+    self.retrieveTiles([(x,y) for x in range(minX,maxX+1)
+                              for y in range(minY,maxY+1)], zoom)
+
     for x in range(minX,maxX+1):
       for y in range(minY,maxY+1):
         fname = self.retrieveTileImage((x,y),zoom)
@@ -0,0 +1,348 @@
+"""
+Single-file tile store:
+  - Keeps every tile of a cache in one SQLite database laid out like an
+    MBTiles file (tiles and metadata tables, TMS tile rows), instead of one
+    PNG file per tile.
+  - Reads go through SQLite's memory map, so looking up a tile is a page
+    lookup rather than a directory scan and a file open.
+  - Optionally keeps each tile's decoded RGB pixels next to the PNG, so
+    readers can skip decoding.
+  - Bounded in size: the least recently used tiles are evicted.
+
+Usage:
+  >>> store = TileStore("map_cache/tiles.mbtiles", max_bytes=512 * 2**20)
+  >>> osm = OSMManager(image_manager=PILImageManager('RGB'), store=store)
+  >>> store.import_directory("map_cache")  # Bring in an old per-file cache
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from cStringIO import StringIO
+
+TILE_SIZE = 256
+
+
+class TileStore(object):
+  """
+  A size-bounded SQLite tile cache that OSMManager can use instead of
+  its directory of PNG files (see OSMManager's store argument).
+  Tiles are addressed as (zoom, x, y) in OSM (XYZ) numbering.
+
+  Safe to share between threads; each thread gets its own connection.
+  """
+
+  # Lets the OS page the database in and out for us
+  mmap_size = 256 * 2**20
+  # Seconds between writes of the access times of tiles read (inserts and
+  # close() write them right away)
+  flush_interval = 5.0
+
+  def __init__(self, filename, max_bytes=None, raw=False, name="osmviz"):
+    """
+    Opens (or creates) the store.
+    Arguments:
+
+    filename - path of the database file.
+
+    max_bytes - evict the least recently used tiles when the stored data
+                grows past this many bytes. Default None (unbounded).
+
+    raw - also store each tile's decoded RGB pixels (TILE_SIZE^2 * 3
+          bytes, needs PIL), returned by pixels(). Default False.
+
+    name - the MBTiles name metadata of a new store.
+    """
+    self.filename = filename
+    self.max_bytes = max_bytes
+    self.raw = raw
+    self.local = threading.local()
+    self.lock = threading.Lock()  # Guards touched and size
+    self.touched = {}  # (zoom, x, y) -> time of the last read, not written yet
+    self.last_flush = time.time()
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+    db = self.connection()
+    with db:
+      db.execute("CREATE TABLE IF NOT EXISTS metadata (name text, value text)")
+      db.execute("CREATE UNIQUE INDEX IF NOT EXISTS name ON metadata (name)")
+      db.execute("CREATE TABLE IF NOT EXISTS tiles (zoom_level integer, "
+                 "tile_column integer, tile_row integer, tile_data blob, "
+                 "pixels blob, accessed real, etag text, modified text)")
+      columns = [row[1] for row in db.execute("PRAGMA table_info(tiles)")]
+      for column in ("etag", "modified"):
+        if column not in columns:  # Stores made before conditional requests
+          db.execute("ALTER TABLE tiles ADD COLUMN %s text" % column)
+      db.execute("CREATE UNIQUE INDEX IF NOT EXISTS tile_index "
+                 "ON tiles (zoom_level, tile_column, tile_row)")
+      db.execute("CREATE INDEX IF NOT EXISTS tile_accessed ON tiles (accessed)")
+      for key, value in (("name", name), ("format", "png"), ("type", "baselayer"),
+                         ("version", "1.1"), ("description", name)):
+        db.execute("INSERT OR IGNORE INTO metadata VALUES (?, ?)", (key, value))
+
+    self.size = db.execute(
+      "SELECT ifnull(sum(length(tile_data) + ifnull(length(pixels), 0)), 0) "
+      "FROM tiles").fetchone()[0]
+
+  def connection(self):
+    """
+    Returns this thread's connection to the store.
+    """
+    db = getattr(self.local, 'db', None)
+    if db is None:
+      db = sqlite3.connect(self.filename, timeout=30.0)
+      db.text_factory = str
+      db.execute("PRAGMA journal_mode=WAL")  # Readers never wait on the writer
+      db.execute("PRAGMA synchronous=NORMAL")
+      db.execute("PRAGMA mmap_size=%d" % self.mmap_size)
+      self.local.db = db
+    return db
+
+  def close(self):
+    """
+    Writes pending access times and closes this thread's connection.
+    """
+    self.flush()
+    db = getattr(self.local, 'db', None)
+    if db is not None:
+      db.close()
+      self.local.db = None
+
+  @staticmethod
+  def _key((zoom, x, y)):
+    # MBTiles rows count from the south (TMS)
+    return (zoom, x, (1 << zoom) - 1 - y)
+
+  def __contains__(self, tile):
+    return self.connection().execute(
+      "SELECT 1 FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+      self._key(tile)).fetchone() is not None
+
+  def __len__(self):
+    return self.connection().execute("SELECT count(*) FROM tiles").fetchone()[0]
+
+  def _read(self, column, tile):
+    row = self.connection().execute(
+      "SELECT %s FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?" % column,
+      self._key(tile)).fetchone()
+    if row is None or row[0] is None:
+      return None
+    with self.lock:
+      self.touched[tile] = time.time()
+    self.flush(force=False)
+    return str(row[0])
+
+  def get(self, tile):
+    """
+    Returns the encoded (PNG) image of tile (zoom, x, y), or None.
+    """
+    return self._read("tile_data", tile)
+
+  def pixels(self, tile):
+    """
+    Returns the decoded RGB pixels of tile (zoom, x, y) as a string of
+    TILE_SIZE * TILE_SIZE * 3 bytes (rows from the top), or None if the
+    tile is missing or the store is not raw.
+    """
+    return self._read("pixels", tile)
+
+  def complete(self, tile):
+    """
+    Returns whether tile (zoom, x, y) is stored, with its decoded pixels
+    if the store is raw.
+    """
+    row = self.connection().execute(
+      "SELECT pixels IS NOT NULL FROM tiles WHERE zoom_level=? AND "
+      "tile_column=? AND tile_row=?", self._key(tile)).fetchone()
+    return row is not None and (bool(row[0]) or not self.raw)
+
+  def fill_pixels(self, tile):
+    """
+    Returns the decoded pixels of tile (zoom, x, y), as pixels() would,
+    decoding its PNG if they are not stored; a raw store then keeps them.
+    That happens to tiles stored while the store was not raw (ex: with
+    put() or import_directory()). Returns None if the tile is missing,
+    raises IOError if its PNG cannot be decoded.
+    """
+    db = self.connection()
+    key = self._key(tile)
+    row = db.execute(
+      "SELECT tile_data, pixels FROM tiles WHERE zoom_level=? AND "
+      "tile_column=? AND tile_row=?", key).fetchone()
+    if row is None:
+      return None
+    with self.lock:
+      self.touched[tile] = time.time()
+    self.flush(force=False)
+    if row[1] is not None:
+      return str(row[1])
+    pixels = self.decode(str(row[0]))
+    if self.raw:
+      with db:
+        filled = db.execute(
+          "UPDATE tiles SET pixels=? WHERE zoom_level=? AND tile_column=? "
+          "AND tile_row=? AND pixels IS NULL",
+          (sqlite3.Binary(pixels),) + key).rowcount
+      with self.lock:
+        self.size += filled * len(pixels)
+      self.evict()
+    return pixels
+
+  def validators(self, tile):
+    """
+    Returns the (etag, modified) HTTP validators the server sent with
+    tile (zoom, x, y), for conditional requests; None if it is missing.
+    """
+    return self.connection().execute(
+      "SELECT etag, modified FROM tiles WHERE zoom_level=? AND "
+      "tile_column=? AND tile_row=?", self._key(tile)).fetchone()
+
+  def touch(self, tile):
+    """
+    Marks tile (zoom, x, y) as used, ex: when the server says our copy
+    is still current.
+    """
+    with self.lock:
+      self.touched[tile] = time.time()
+    self.flush(force=False)
+
+  def decode(self, data):
+    """
+    Returns the RGB pixels of an encoded tile, as pixels() would.
+    """
+    import PIL.Image
+    image = PIL.Image.open(StringIO(data)).convert('RGB')
+    if image.size != (TILE_SIZE, TILE_SIZE):
+      raise IOError("Tile is %dx%d, expected %d" % (image.size + (TILE_SIZE,)))
+    return image.tobytes()
+
+  def _rows(self, tiles, now, strict):
+    for item in tiles:
+      tile, data = item[:2]
+      etag, modified = item[2:] if len(item) > 2 else (None, None)
+      pixels = None
+      if self.raw:
+        try:
+          pixels = sqlite3.Binary(self.decode(data))
+        except IOError:
+          if strict:
+            raise
+          continue
+      yield self._key(tile) + (sqlite3.Binary(data), pixels, now, etag, modified)
+
+  def put(self, tile, data, etag=None, modified=None):
+    """
+    Stores the encoded image data of tile (zoom, x, y), with the ETag and
+    Last-Modified headers it was served with if any.
+    """
+    self.put_many([(tile, data, etag, modified)])
+
+  def put_many(self, tiles, strict=True):
+    """
+    Stores an iterable of ((zoom, x, y), data) or
+    ((zoom, x, y), data, etag, modified) in one transaction;
+    much faster than put() for bulk imports. Returns the number stored.
+    A raw store raises IOError for a tile it cannot decode, or skips it
+    if strict is False.
+    """
+    db = self.connection()
+    rows = list(self._rows(tiles, time.time(), strict))
+    added = sum(len(row[3]) + (len(row[4]) if row[4] is not None else 0)
+                for row in rows)
+    with db:
+      replaced = 0
+      for row in rows:
+        old = db.execute(
+          "SELECT length(tile_data) + ifnull(length(pixels), 0) FROM tiles "
+          "WHERE zoom_level=? AND tile_column=? AND tile_row=?", row[:3]).fetchone()
+        replaced += old[0] if old else 0
+      db.executemany("INSERT OR REPLACE INTO tiles (zoom_level, tile_column, "
+                     "tile_row, tile_data, pixels, accessed, etag, modified) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    with self.lock:
+      self.size += added - replaced
+    self.flush()
+    self.evict()
+    return len(rows)
+
+  def discard(self, tile):
+    """
+    Removes tile (zoom, x, y), ex: if it turned out to be corrupt.
+    """
+    db = self.connection()
+    key = self._key(tile)
+    with db:
+      old = db.execute(
+        "SELECT length(tile_data) + ifnull(length(pixels), 0) FROM tiles "
+        "WHERE zoom_level=? AND tile_column=? AND tile_row=?", key).fetchone()
+      db.execute("DELETE FROM tiles WHERE zoom_level=? AND tile_column=? "
+                 "AND tile_row=?", key)
+    if old:
+      with self.lock:
+        self.size -= old[0]
+
+  def flush(self, force=True):
+    """
+    Writes the access times of the tiles read since the last flush.
+    """
+    with self.lock:
+      if not self.touched or not (force or
+          time.time() - self.last_flush > self.flush_interval):
+        return
+      touched, self.touched = self.touched, {}
+      self.last_flush = time.time()
+    db = self.connection()
+    with db:
+      db.executemany("UPDATE tiles SET accessed=? WHERE zoom_level=? AND "
+                     "tile_column=? AND tile_row=?",
+                     [(when,) + self._key(tile) for tile, when in touched.items()])
+
+  def evict(self):
+    """
+    Deletes the least recently used tiles until the store is within
+    max_bytes (to 90% of it, so we don't evict on every insert).
+    Returns the number of tiles deleted.
+    """
+    if self.max_bytes is None or self.size <= self.max_bytes:
+      return 0
+    target = self.size - 0.9 * self.max_bytes
+    db = self.connection()
+    freed, victims = 0, []
+    for row in db.execute(
+        "SELECT rowid, length(tile_data) + ifnull(length(pixels), 0) "
+        "FROM tiles ORDER BY accessed"):
+      if freed >= target:
+        break
+      victims.append((row[0],))
+      freed += row[1]
+    with db:
+      db.executemany("DELETE FROM tiles WHERE rowid=?", victims)
+    with self.lock:
+      self.size -= freed
+    return len(victims)
+
+  def import_directory(self, directory, prefix="", batch=256):
+    """
+    Bulk-imports a per-file OSMManager cache (files named
+    <prefix><zoom>_<x>_<y>.png, see OSMManager.getLocalTileFilename).
+    The files are left in place, and a raw store skips the ones it cannot
+    decode. Returns the number of tiles imported.
+    """
+    pattern = re.compile(r"^%s(\d+)_(\d+)_(\d+)\.png$" % re.escape(prefix))
+    imported, pending = 0, []
+    for filename in sorted(os.listdir(directory)):
+      match = pattern.match(filename)
+      if not match:
+        continue
+      with open(os.path.join(directory, filename), 'rb') as f:
+        pending.append((tuple(int(n) for n in match.groups()), f.read()))
+      if len(pending) >= batch:
+        imported += self.put_many(pending, strict=False)
+        pending = []
+    if pending:
+      imported += self.put_many(pending, strict=False)
+    return imported
@@ -0,0 +1,86 @@
+import unittest
+import contextlib
+from libVisar.OpenGL.shaders import make_distortion
+from libVisar.OpenGL.shaders import Distorter
+from libVisar.OpenGL.drawing import drawable, Context
+from libVisar.OpenGL.utils import NullProfiler
+
+import numpy as np
+
+class Recorder(object):
+    '''Stands in for a drawable; records the view it is drawn with'''
+    skip = False
+    dirty = True
+
+    def __init__(self):
+        self.uniforms = {}
+        self.views = []
+
+    def __setitem__(self, key, value):
+        self.uniforms[key] = np.array(value)
+
+    def draw(self):
+        self.views.append(self.uniforms['view'])
+
+class NoGL(object):
+    '''Stands in for vispy.gloo, no GL context needed'''
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+class TestDistorter(unittest.TestCase):
+    '''
+    Functions:
+        Distorter.draw_distortion(*Contexts)
+        Distorter.draw_single_pass(*Contexts)
+        Distorter.eye_views(context)
+    '''
+
+    def setUp(self):
+        '''Prepare for unit testing'''
+        self.gloo, self.set_viewport = make_distortion.gloo, drawable.set_viewport
+        make_distortion.gloo = NoGL()
+        drawable.set_viewport = lambda *args: None
+
+        # Only what the eye passes use; the eye buffers need a GL context
+        self.distorter = Distorter.__new__(Distorter)
+        self.distorter.IPD = 0.0647
+        self.distorter.profiler = NullProfiler()
+        self.distorter.pose_source = None
+        self.distorter.eye_size = (64, 64)
+        self.distorter.left_viewport, self.distorter.right_viewport = (0, 0, 64, 64), (64, 0, 64, 64)
+        self.distorter.L_eye_projection, self.distorter.R_eye_projection = np.eye(4), 2 * np.eye(4)
+        self.distorter.left_eye = self.distorter.right_eye = self.distorter.stereo_eyes = contextlib.closing(self)
+        self.distorter.apply_distortion = lambda: None
+
+    def tearDown(self):
+        make_distortion.gloo, drawable.set_viewport = self.gloo, self.set_viewport
+
+    def close(self):
+        pass
+
+    def render(self, draw, frames=3):
+        recorder = Recorder()
+        context = Context(recorder)
+        context.set_view(np.eye(4))
+        for frame in range(frames):
+            draw(context)
+        return recorder.views
+
+    def test_modes_agree(self):
+        two_pass = self.render(self.distorter.draw_distortion)
+        single_pass = self.render(self.distorter.draw_single_pass)
+        self.assertEqual(len(two_pass), 6)
+        self.assertEqual(len(single_pass), 6)
+        for view, expected in zip(single_pass, two_pass):
+            self.assertTrue(np.allclose(view, expected))
+
+    def test_eye_separation(self):
+        for draw in (self.distorter.draw_distortion, self.distorter.draw_single_pass):
+            views = self.render(draw)
+            for left, right in zip(views[::2], views[1::2]):
+                # Row-vector transforms: the translation is the last row
+                self.assertTrue(np.allclose(left[3, :3], (0, self.distorter.IPD / 2, 0)))
+                self.assertTrue(np.allclose(right[3, :3], (0, -self.distorter.IPD / 2, 0)))
+
+if __name__ == '__main__':
+    unittest.main()
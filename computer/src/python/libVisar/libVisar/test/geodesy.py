@@ -0,0 +1,76 @@
+import unittest
+from libVisar.visar.globals import geodesy, LocalFrame
+
+import numpy as np
+
+class TestGeodesy(unittest.TestCase):
+    '''
+    Functions:
+        ecef_to_lla(ecef), lla_to_ecef(lla)
+        ecef_to_enu / enu_to_ecef / ecef_to_ned / ned_to_ecef (points, reference_ecef)
+        LocalFrame.at(reference_ecef)
+    '''
+
+    def setUp(self):
+        '''Prepare for unit testing'''
+        random = np.random.RandomState(0)
+        count = 1000
+        self.lla = np.column_stack([
+            random.uniform(-89.9, 89.9, count),
+            random.uniform(-180.0, 180.0, count),
+            random.uniform(-500.0, 20000.0, count),
+        ])
+        self.reference = np.array((738575.65, -5498374.10, 3136355.42))
+
+    def test_ecef2latlong(self):
+        o_position = geodesy.ecef_to_lla(self.reference)
+        exp_position = np.array([29.646265015740656, -82.34947101109631, 0.003318880684673786])
+        self.assertTrue(np.allclose(o_position, exp_position, rtol=0.0, atol=1e-9))
+
+    def test_round_trip(self):
+        ecef = geodesy.lla_to_ecef(self.lla)
+        lla = geodesy.ecef_to_lla(ecef)
+        self.assertLess(np.abs(lla[:, :2] - self.lla[:, :2]).max(), 1e-9)  # Degrees (~0.1 mm)
+        self.assertLess(np.abs(lla[:, 2] - self.lla[:, 2]).max(), 1e-4)
+        self.assertLess(np.abs(geodesy.lla_to_ecef(lla) - ecef).max(), 1e-4)
+
+    def test_poles(self):
+        for latitude in (90.0, -90.0):
+            ecef = geodesy.lla_to_ecef((latitude, 0.0, 100.0))
+            self.assertTrue(np.allclose(ecef, (0.0, 0.0, np.sign(latitude) * (geodesy.WGS84_B + 100.0)), atol=1e-6))
+            self.assertAlmostEqual(geodesy.ecef_to_lla(ecef)[2], 100.0, places=6)
+
+    def test_batch_matches_single(self):
+        ecef = geodesy.lla_to_ecef(self.lla)
+        for n in range(0, len(self.lla), 97):
+            self.assertTrue(np.array_equal(geodesy.lla_to_ecef(self.lla[n]), ecef[n]))
+            self.assertTrue(np.array_equal(geodesy.ecef_to_lla(ecef[n]), geodesy.ecef_to_lla(ecef)[n]))
+
+    def test_enu(self):
+        lat, lon, alt = geodesy.ecef_to_lla(self.reference)
+        up = geodesy.lla_to_ecef((lat, lon, alt + 100.0))
+        self.assertTrue(np.allclose(geodesy.ecef_to_enu(up, self.reference), (0.0, 0.0, 100.0), atol=1e-6))
+        north = geodesy.ecef_to_enu(geodesy.lla_to_ecef((lat + 0.001, lon, alt)), self.reference)
+        self.assertGreater(north[1], 100.0)
+        self.assertLess(abs(north[0]), 1e-6)
+        east = geodesy.ecef_to_enu(geodesy.lla_to_ecef((lat, lon + 0.001, alt)), self.reference)
+        self.assertGreater(east[0], 90.0)
+        self.assertLess(abs(east[1]), 1e-3)
+
+    def test_local_round_trip(self):
+        ecef = self.reference + np.random.RandomState(1).uniform(-5000.0, 5000.0, (100, 3))
+        enu = geodesy.ecef_to_enu(ecef, self.reference)
+        ned = geodesy.ecef_to_ned(ecef, self.reference)
+        self.assertTrue(np.allclose(geodesy.enu_to_ecef(enu, self.reference), ecef, rtol=0.0, atol=1e-6))
+        self.assertTrue(np.allclose(geodesy.ned_to_ecef(ned, self.reference), ecef, rtol=0.0, atol=1e-6))
+        self.assertTrue(np.allclose(ned, enu[:, [1, 0, 2]] * (1, 1, -1)))
+        # Rotations preserve distances
+        self.assertTrue(np.allclose(np.linalg.norm(enu, axis=1), np.linalg.norm(ecef - self.reference, axis=1)))
+
+    def test_frame_cache(self):
+        frame = LocalFrame.at(self.reference)
+        self.assertIs(LocalFrame.at(tuple(self.reference)), frame)
+        self.assertIsNot(LocalFrame.at(self.reference + 1.0), frame)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import os
+import shutil
+import tempfile
+from cStringIO import StringIO
+from libVisar.osmviz import NumpyImageManager, PILImageManager, OSMManager, TileStore, TileDownloader
+
+import numpy as np
+import PIL.Image as Image
+
+def make_tile(value):
+    buffer = StringIO()
+    Image.fromarray(np.full((256, 256, 3), value, dtype=np.uint8)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+class TestNumpyImageManager(unittest.TestCase):
+    '''
+    Functions:
+        NumpyImageManager(mode='RGB', buffer=None, filename=None)
+        OSMManager(image_manager=...).createOSMImage(bounds, zoom)
+    '''
+
+    def setUp(self):
+        '''Prepare for unit testing'''
+        self.directory = tempfile.mkdtemp()
+        self.store = TileStore(os.path.join(self.directory, 'tiles.mbtiles'))
+        for x in range(140, 143):
+            for y in range(203, 205):
+                self.store.put((9, x, y), make_tile(x + 10 * (y - 203)))
+        self.bounds = (33.8, 34.8, -81.5, -79.5)  # Tiles 140-142, 203-204 at zoom 9
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def create(self, manager):
+        server = 'http://127.0.0.1:9'  # Nothing listens here
+        osm = OSMManager(image_manager=manager, store=self.store, server=server,
+                         downloader=TileDownloader(server, retries=0))
+        return osm.createOSMImage(self.bounds, 9)
+
+    def test_matches_pil(self):
+        image, bounds = self.create(NumpyImageManager('RGB'))
+        expected, expected_bounds = self.create(PILImageManager('RGB'))
+        self.assertEqual(image.shape, (512, 768, 3))
+        self.assertEqual(image.dtype, np.uint8)
+        self.assertTrue(np.array_equal(image, np.asarray(expected)))
+        self.assertEqual(bounds, expected_bounds)
+        self.assertEqual(image[300, 600, 0], 142 + 10)
+
+    def test_buffer(self):
+        buffer = np.zeros(1024 * 1024 * 3, dtype=np.uint8)
+        manager = NumpyImageManager('RGB', buffer=buffer)
+        image, bounds = self.create(manager)
+        self.assertTrue(np.may_share_memory(image, buffer))
+        self.assertTrue(image.flags.c_contiguous)
+        self.assertEqual(image[0, 300, 0], 141)
+        # Too small
+        self.assertRaises(Exception, self.create, NumpyImageManager('RGB', buffer=np.zeros(16, dtype=np.uint8)))
+
+    def test_memory_map(self):
+        filename = os.path.join(self.directory, 'region.raw')
+        image, bounds = self.create(NumpyImageManager('L', filename=filename))
+        self.assertEqual(image.shape, (512, 768, 1))
+        image.flush()
+        self.assertEqual(os.path.getsize(filename), 512 * 768)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+from libVisar.visar.globals import PosePredictor
+
+import numpy as np
+
+def make_pose(position=(0.0, 0.0, 0.0), velocity=(0.0, 0.0, 0.0), angular_velocity=(0.0, 0.0, 0.0)):
+    def vector(v):
+        return {'x': v[0], 'y': v[1], 'z': v[2]}
+    return {
+        'position_ecef': vector(position),
+        'orientation_ecef': {'w': 1.0, 'x': 0.0, 'y': 0.0, 'z': 0.0},
+        'velocity_ecef': vector(velocity),
+        'angular_velocity_ecef': vector(angular_velocity),
+    }
+
+class TestPosePredictor(unittest.TestCase):
+    '''
+    Functions:
+        PosePredictor(model='velocity', max_horizon=0.05)
+        add_sample(timestamp, pose), predict(at_time), predict_matrix(at_time)
+    '''
+
+    def test_no_samples(self):
+        predictor = PosePredictor('velocity')
+        self.assertEqual(predictor.predict(1.0), (None, None))
+        self.assertIsNone(predictor.predict_matrix(1.0))
+
+    def test_velocity(self):
+        predictor = PosePredictor('velocity', max_horizon=0.1)
+        predictor.add_sample(10.0, make_pose((100.0, 0.0, 0.0), velocity=(2.0, 0.0, -4.0),
+                                             angular_velocity=(0.0, 0.0, np.pi)))
+        quaternion, position = predictor.predict(10.05)
+        self.assertTrue(np.allclose(position, (100.1, 0.0, -0.2)))
+        # pi rad/s about z for 0.05 s
+        angle = np.pi * 0.05
+        self.assertTrue(np.allclose(quaternion, (np.cos(angle / 2), 0.0, 0.0, np.sin(angle / 2))))
+
+    def test_acceleration(self):
+        predictor = PosePredictor('acceleration', max_horizon=0.1)
+        predictor.add_sample(10.0, make_pose(velocity=(1.0, 0.0, 0.0)))
+        predictor.add_sample(10.5, make_pose(velocity=(2.0, 0.0, 0.0)))  # 2 m/s^2
+        quaternion, position = predictor.predict(10.6)
+        self.assertTrue(np.allclose(position, (2.0 * 0.1 + 0.5 * 2.0 * 0.1 ** 2, 0.0, 0.0)))
+        # The velocity model ignores the acceleration
+        predictor.model = 'velocity'
+        self.assertTrue(np.allclose(predictor.predict(10.6)[1], (0.2, 0.0, 0.0)))
+
+    def test_horizon(self):
+        predictor = PosePredictor('velocity', max_horizon=0.05)
+        predictor.add_sample(10.0, make_pose(velocity=(1.0, 0.0, 0.0)))
+        self.assertEqual(predictor.horizon(11.0), 0.05)
+        self.assertEqual(predictor.horizon(9.0), 0.0)
+        self.assertTrue(np.allclose(predictor.predict(11.0)[1], (0.05, 0.0, 0.0)))
+        self.assertTrue(np.allclose(predictor.predict(9.0)[1], (0.0, 0.0, 0.0)))
+        # Repeated and older samples are ignored
+        predictor.add_sample(10.0, make_pose((5.0, 0.0, 0.0)))
+        self.assertTrue(np.allclose(predictor.predict(10.0)[1], (0.0, 0.0, 0.0)))
+
+    def test_none(self):
+        predictor = PosePredictor('none', max_horizon=0.1)
+        predictor.add_sample(10.0, make_pose((1.0, 2.0, 3.0), velocity=(9.0, 9.0, 9.0),
+                                             angular_velocity=(1.0, 0.0, 0.0)))
+        quaternion, position = predictor.predict(10.1)
+        self.assertTrue(np.allclose(position, (1.0, 2.0, 3.0)))
+        self.assertTrue(np.allclose(quaternion, (1.0, 0.0, 0.0, 0.0)))
+        self.assertTrue(np.allclose(predictor.predict_matrix(10.1), np.eye(4)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+from libVisar.OpenGL.drawing.resources import _Entry, SharedProgram, Resources
+from libVisar.OpenGL.drawing import Drawable, Context
+
+import numpy as np
+
+class RecordingProgram(object):
+    '''Stands in for a Program; records what is uploaded to it'''
+    def __init__(self):
+        self.uploads = []
+        self.binds = []
+
+    def __setitem__(self, key, value):
+        self.uploads.append(key)
+
+    def bind(self, buffer):
+        self.binds.append(buffer)
+
+    def draw(self, *args):
+        pass
+
+class TestSharedProgram(unittest.TestCase):
+    '''
+    Functions:
+        SharedProgram[key] = value, bind(buffer), activate(), draw()
+    '''
+
+    def setUp(self):
+        '''Prepare for unit testing'''
+        self.program = RecordingProgram()
+        entry = _Entry('program', self.program)
+        self.buttons = [SharedProgram(entry) for n in range(3)]
+        self.texture, self.buffer = object(), object()
+        for n, button in enumerate(self.buttons):
+            button.bind(self.buffer)
+            button['view'] = np.eye(4)
+            button['projection'] = np.eye(4) * 2
+            button['texture'] = self.texture
+            button['offset'] = (0.0, 0.1 * n)
+
+    def test_switch_uploads_differences(self):
+        for button in self.buttons:
+            button.draw('triangles')
+        self.assertEqual(self.program.uploads, ['view', 'projection', 'texture', 'offset', 'offset', 'offset'])
+        self.assertEqual(self.program.binds, [self.buffer])
+
+    def test_in_place_edits(self):
+        model = np.eye(4)
+        first, second = self.buttons[:2]
+        first['model'] = np.eye(4)
+        second['model'] = model
+        second.draw()
+        model[3, 0] = 1.0  # Edited in place, then set again
+        second['model'] = model
+        del self.program.uploads[:]
+        first.draw()
+        self.assertIn('model', self.program.uploads)
+        # Both want the same values again: nothing but their offsets differ
+        second['model'] = np.eye(4)
+        del self.program.uploads[:]
+        second.draw()
+        self.assertEqual(self.program.uploads, ['offset'])
+
+    def test_owner_sets(self):
+        first, second = self.buttons[:2]
+        first.draw()
+        second['view'] = np.eye(4) * 3  # Not the owner: remembered, not uploaded
+        self.assertEqual(self.program.uploads.count('view'), 1)
+        second.draw()
+        self.assertEqual(self.program.uploads.count('view'), 2)
+
+class TestResources(unittest.TestCase):
+    '''
+    Functions:
+        Resources.program(vertex, fragment), vertex_buffer(data), index_buffer(data)
+        Resources.release(resource), evict(force=False), is_shared(resource)
+        Drawable.release(), Context.release()
+    '''
+    vertex = 'void main() { gl_Position = vec4(0.0); }  // TestResources'
+    fragment = 'void main() { gl_FragColor = vec4(1.0); }'
+
+    def test_release_evict(self):
+        first = Resources.program(self.vertex, self.fragment)
+        second = Resources.program(self.vertex, self.fragment)
+        buffer = Resources.vertex_buffer(np.arange(6, dtype=np.float32) + 0.25)
+        first['position'] = buffer
+        program = first.program
+        self.assertIs(second.program, program)
+
+        first.release()
+        first.release()  # Only released once
+        Resources.evict()
+        self.assertTrue(Resources.is_shared(program))  # Still referenced by second
+        self.assertFalse(Resources.is_shared(buffer))  # Released along with first
+
+        second.release()
+        self.assertEqual(Resources.evict(), 1)
+        self.assertFalse(Resources.is_shared(program))
+        self.assertIsNot(Resources.program(self.vertex, self.fragment).program, program)
+        Resources.evict(force=True)
+
+    def test_drawable_release(self):
+        drawable = Drawable.__new__(Drawable)
+        drawable.program = Resources.program(self.vertex, self.fragment)
+        drawable.indices = Resources.index_buffer([0, 1, 2, 3])
+        program, indices = drawable.program.program, drawable.indices
+        Context(Context(drawable)).release()
+        drawable.release()
+        Resources.evict()
+        self.assertFalse(Resources.is_shared(program))
+        self.assertFalse(Resources.is_shared(indices))
+
+if __name__ == '__main__':
+    unittest.main()
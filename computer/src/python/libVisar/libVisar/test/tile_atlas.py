@@ -0,0 +1,65 @@
+import unittest
+from libVisar.OpenGL.drawing import TileAtlas
+
+import numpy as np
+
+def make_tile(value, size=16):
+    return np.full((size, size, 3), value, dtype=np.uint8)
+
+class TestTileAtlas(unittest.TestCase):
+    '''
+    Functions:
+        TileAtlas(slots=(8, 8), tile_size=256, channels=3)
+        insert(key, image), slot(key), pin(keys), touch(key)
+        indirection_entry(key), indirection_entries(keys)
+    '''
+
+    def setUp(self):
+        '''Prepare for unit testing'''
+        self.atlas = TileAtlas((2, 2), tile_size=16)
+
+    def test_insert(self):
+        slots = [self.atlas.insert(n, make_tile(n)) for n in range(4)]
+        self.assertEqual(sorted(slots), [(0, 0), (0, 1), (1, 0), (1, 1)])
+        self.assertEqual(self.atlas.slot(2), slots[2])
+        self.assertIsNone(self.atlas.slot(4))
+        # Replacing a loaded tile keeps its slot
+        self.assertEqual(self.atlas.insert(2, make_tile(9)), slots[2])
+        self.assertEqual(self.atlas.stats(), {'tiles': 4, 'capacity': 4, 'uploads': 5, 'evictions': 0})
+        self.assertRaises(AssertionError, self.atlas.insert, 5, make_tile(0, size=8))
+
+    def test_least_recently_used(self):
+        for n in range(4):
+            self.atlas.insert(n, make_tile(n))
+        self.atlas.touch(0)
+        slot = self.atlas.slot(1)
+        self.assertEqual(self.atlas.insert(4, make_tile(4)), slot)  # 1 was the least recently used
+        self.assertNotIn(1, self.atlas)
+        self.assertIn(0, self.atlas)
+        self.assertEqual(self.atlas.evictions, 1)
+
+    def test_pinning(self):
+        for n in range(4):
+            self.atlas.insert(n, make_tile(n))
+        self.atlas.pin([0, 1, 2])
+        self.atlas.insert(4, make_tile(4))
+        self.assertNotIn(3, self.atlas)
+        self.assertTrue(all(n in self.atlas for n in (0, 1, 2)))
+        # Every slot pinned: nothing is evicted
+        self.atlas.pin([0, 1, 2, 4])
+        self.assertIsNone(self.atlas.insert(5, make_tile(5)))
+        self.assertEqual(len(self.atlas), 4)
+
+    def test_indirection(self):
+        self.atlas.insert('a', make_tile(1))
+        column, row = self.atlas.slot('a')
+        table = self.atlas.indirection_entries([['a', None], ['b', 'a']])
+        self.assertEqual(table.shape, (2, 2, 4))
+        self.assertEqual(table.dtype, np.uint8)
+        self.assertEqual(list(table[0, 0]), [column, row, 0, 255])
+        self.assertEqual(list(table[1, 1]), [column, row, 0, 255])
+        self.assertEqual(list(table[0, 1]), [0, 0, 0, 0])
+        self.assertEqual(list(table[1, 0]), [0, 0, 0, 0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import BaseHTTPServer
+import SocketServer
+from libVisar.osmviz import TileDownloader, TileStore, OSMManager, PILImageManager
+
+class TileHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''Serves "/<zoom>/<x>/<y>.png" as the text "tile <zoom> <x> <y>", with an ETag
+    Paths in server.flaky fail with a 503 that many times first
+    '''
+    protocol_version = 'HTTP/1.1'  # Keep-alive
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.connections.add(self.client_address)
+            failures = server.flaky.get(self.path, 0)
+            if failures:
+                server.flaky[self.path] = failures - 1
+        if failures:
+            return self.reply(503)
+        if not self.path.endswith('.png'):
+            return self.reply(404)
+        etag = '"%s"' % self.path
+        if self.headers.get('If-None-Match') == etag:
+            return self.reply(304, etag=etag)
+        self.reply(200, 'tile ' + ' '.join(self.path[1:-4].split('/')), etag)
+
+    def reply(self, status, body='', etag=None):
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class TileServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), TileHandler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.connections = set()
+        self.flaky = {}
+
+class TestTileDownloader(unittest.TestCase):
+    '''
+    Functions:
+        TileDownloader(server, workers=4, timeout=10.0, retries=3, backoff=0.5)
+        fetch(path, etag=None, modified=None), download(requests, callback=None)
+        OSMManager.retrieveTiles(tile_coords, zoom, refresh=False)
+    '''
+
+    def setUp(self):
+        '''Start a stand-in tile server'''
+        self.server = TileServer()
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_keep_alive(self):
+        downloader = TileDownloader(self.url, workers=4)
+        requests = dict(((9, x, y), '/9/%d/%d.png' % (x, y)) for x in range(10) for y in range(5))
+        results = downloader.download(requests)
+        self.assertEqual(len(results), 50)
+        self.assertTrue(all(response.ok for response in results.values()))
+        self.assertEqual(results[(9, 3, 4)].data, 'tile 9 3 4')
+        # One connection per worker, not per tile
+        self.assertLessEqual(len(self.server.connections), 4)
+        self.assertEqual(downloader.stats()['connections'], len(self.server.connections))
+
+    def test_retry(self):
+        self.server.flaky['/9/1/1.png'] = 2
+        downloader = TileDownloader(self.url, retries=2, backoff=0.01)
+        response = downloader.fetch('/9/1/1.png')
+        self.assertTrue(response.ok)
+        self.assertEqual(response.attempts, 3)
+
+        self.server.flaky['/9/1/2.png'] = 5
+        response = downloader.fetch('/9/1/2.png')
+        self.assertEqual(response.status, 503)
+        self.assertIsNotNone(response.error)
+
+        response = downloader.fetch('/missing')
+        self.assertEqual((response.status, response.attempts), (404, 1))
+
+    def test_unreachable(self):
+        downloader = TileDownloader('http://127.0.0.1:9', retries=1, backoff=0.01, timeout=1.0)
+        response = downloader.fetch('/9/1/1.png')
+        self.assertIsNone(response.status)
+        self.assertIsNotNone(response.error)
+        self.assertEqual(response.attempts, 2)
+
+    def test_conditional(self):
+        downloader = TileDownloader(self.url)
+        first = downloader.fetch('/9/1/1.png')
+        again = downloader.fetch('/9/1/1.png', etag=first.etag)
+        self.assertTrue(again.not_modified)
+        self.assertIsNone(again.data)
+        self.assertIsNone(again.error)
+
+    def test_manager(self):
+        store = TileStore(os.path.join(self.directory, 'tiles.mbtiles'))
+        osm = OSMManager(image_manager=PILImageManager('RGB'), store=store, server=self.url)
+        coords = [(x, y) for x in range(3) for y in range(3)]
+        results = osm.retrieveTiles(coords, 9)
+        self.assertEqual(len(results), 9)
+        self.assertEqual(store.get((9, 2, 1)), 'tile 9 2 1')
+        self.assertEqual(store.validators((9, 2, 1))[0], '"/9/2/1.png"')
+        self.assertEqual(osm.retrieveTiles(coords, 9), {})  # Nothing missing
+        refreshed = osm.retrieveTiles(coords, 9, refresh=True)
+        self.assertTrue(all(response.not_modified for response in refreshed.values()))
+
+    def test_manager_files(self):
+        osm = OSMManager(image_manager=PILImageManager('RGB'), cache=self.directory, server=self.url)
+        osm.retrieveTiles([(5, 6)], 9)
+        with open(osm.getLocalTileFilename((5, 6), 9)) as f:
+            self.assertEqual(f.read(), 'tile 9 5 6')
+        self.assertEqual(osm.retrieveTileImage((5, 6), 9), osm.getLocalTileFilename((5, 6), 9))
+        self.assertEqual(len(self.server.requests), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import shutil
+import tempfile
+import time
+from libVisar.visar.globals.tile_service import TileService
+
+import numpy as np
+
+class RecordingService(TileService):
+    '''Fetches blank tiles without touching the network, recording the order'''
+    def __init__(self, *args, **kwargs):
+        TileService.__init__(self, *args, **kwargs)
+        self.fetched_tiles = []
+
+    def fetch(self, tile):
+        self.fetched_tiles.append(tile)
+        return np.zeros((self.tile_size, self.tile_size, 3), dtype=np.uint8)
+
+    def finish(self, timeout=5.0):
+        '''Run the workers until everything queued is handled'''
+        self.start()
+        deadline = time.time() + timeout
+        while (self.pending or self.queue.qsize()) and time.time() < deadline:
+            time.sleep(0.01)
+        self.stop()
+
+class TestTileService(unittest.TestCase):
+    '''
+    Functions:
+        TileService(cache, zoom=9, radius=2, workers=4, lookahead=60.0)
+        tiles_around(position_lla, velocity_enu=None, zoom=None)
+        request(tiles), collect(limit=None)
+    '''
+
+    def setUp(self):
+        '''Prepare for unit testing'''
+        self.directory = tempfile.mkdtemp()
+        self.service = RecordingService(self.directory, workers=1, server='http://127.0.0.1:9')
+        self.position = (29.646, -82.349, 0.0)
+
+    def tearDown(self):
+        self.service.stop()
+        shutil.rmtree(self.directory)
+
+    def test_tiles_around(self):
+        tiles = self.service.tiles_around(self.position)
+        center = self.service.tile_at(*self.position[:2])
+        self.assertEqual(len(tiles), 25)
+        self.assertEqual(len(set(tiles)), 25)
+        self.assertEqual(tiles[0], center)
+        # Nearest first
+        distances = [(x - center[1]) ** 2 + (y - center[2]) ** 2 for _, x, y in tiles]
+        self.assertEqual(distances, sorted(distances))
+
+    def test_track(self):
+        # 300 m/s east for 60 s: a corridor of about 8 tiles past the block, at most 3 tiles wide
+        tiles = self.service.tiles_around(self.position, velocity_enu=(300.0, 0.0, 0.0), zoom=14)
+        _, x, y = self.service.tile_at(self.position[0], self.position[1], 14)
+        block, corridor = tiles[:25], tiles[25:]
+        self.assertEqual(set(block), set(self.service.tiles_around(self.position, zoom=14)))
+        self.assertTrue(corridor)
+        self.assertTrue(all(tile_x > x + 2 and abs(tile_y - y) <= 1 for _, tile_x, tile_y in corridor))
+
+    def test_antimeridian(self):
+        tiles = self.service.tiles_around((0.1, 179.99, 0.0), zoom=3)
+        columns = set(x for _, x, _ in tiles)
+        self.assertEqual(columns, set([5, 6, 7, 0, 1]))
+        self.assertEqual(self.service.wrap((3, -1, -2)), (3, 7, 0))
+
+    def test_request(self):
+        tiles = self.service.tiles_around(self.position)
+        self.service.request(tiles)
+        self.service.finish()
+        self.assertEqual(self.service.fetched_tiles, tiles)
+        collected = self.service.collect()
+        self.assertEqual([tile[:3] for tile in collected], tiles)
+        self.assertEqual(collected[0][3].shape, (256, 256, 3))
+        self.assertEqual(self.service.stats()['fetched'], 25)
+
+    def test_drop(self):
+        first = [(9, x, 0) for x in range(10)]
+        second = [(9, x, 1) for x in range(3)]
+        self.service.request(first)
+        self.service.request(second + first[:2])
+        self.service.finish()
+        self.assertEqual(set(self.service.fetched_tiles), set(second + first[:2]))
+        self.assertEqual(self.service.stats()['dropped'], 8)
+        self.assertEqual(self.service.stats()['queued'], 0)
+
+    def test_reprioritize(self):
+        first = [(9, x, 0) for x in range(10)]
+        self.service.request(first)
+        # The last tile is now the most urgent one, ex: the tile under the user
+        self.service.request(first[-1:] + first[:-1])
+        self.service.finish()
+        self.assertEqual(self.service.fetched_tiles[:2], [first[0], first[-1]])  # Tied at priority 0
+        self.assertEqual(sorted(self.service.fetched_tiles), sorted(first))  # Each fetched once
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+import os
+import shutil
+import tempfile
+from cStringIO import StringIO
+from libVisar.osmviz import TileStore, OSMManager, PILImageManager, TileDownloader
+from libVisar.visar.globals.tile_service import TileService
+
+import numpy as np
+import PIL.Image as Image
+
+def make_tile(value):
+    buffer = StringIO()
+    Image.fromarray(np.full((256, 256, 3), value, dtype=np.uint8)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+class TestTileStore(unittest.TestCase):
+    '''
+    Functions:
+        TileStore(filename, max_bytes=None, raw=False)
+        get(tile), pixels(tile), put(tile, data), put_many(tiles), discard(tile)
+        complete(tile), fill_pixels(tile)
+        import_directory(directory, prefix='')
+        OSMManager(store=...).retrieveTileImage(tile_coord, zoom)
+    '''
+
+    def setUp(self):
+        '''Prepare for unit testing'''
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'tiles.mbtiles')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        store = TileStore(self.filename)
+        store.put((9, 140, 215), make_tile(10))
+        self.assertEqual(store.get((9, 140, 215)), make_tile(10))
+        self.assertIsNone(store.get((9, 140, 216)))
+        self.assertIsNone(store.pixels((9, 140, 215)))
+        # MBTiles rows count from the south
+        row = store.connection().execute("SELECT tile_row FROM tiles").fetchone()[0]
+        self.assertEqual(row, 2 ** 9 - 1 - 215)
+        # Survives reopening
+        store.close()
+        self.assertIn((9, 140, 215), TileStore(self.filename))
+
+    def test_raw(self):
+        store = TileStore(self.filename, raw=True)
+        store.put((9, 1, 2), make_tile(42))
+        pixels = np.frombuffer(store.pixels((9, 1, 2)), dtype=np.uint8)
+        self.assertEqual(pixels.size, 256 * 256 * 3)
+        self.assertTrue(np.all(pixels == 42))
+        self.assertRaises(IOError, store.put, (9, 1, 3), 'not a png')
+        self.assertNotIn((9, 1, 3), store)
+
+    def test_fill_pixels(self):
+        # Stored before the store was raw: the PNG is there, the pixels are not
+        TileStore(self.filename).put((9, 140, 215), make_tile(42))
+        store = TileStore(self.filename, raw=True)
+        self.assertIsNone(store.pixels((9, 140, 215)))
+        self.assertFalse(store.complete((9, 140, 215)))
+        size = store.size
+
+        service = TileService(self.directory, store=store, server='http://127.0.0.1:9')
+        image = service.fetch((9, 140, 215))
+        self.assertEqual(image.shape, (256, 256, 3))
+        self.assertTrue(np.all(image == 42))
+        # Decoded once, then kept
+        self.assertTrue(store.complete((9, 140, 215)))
+        self.assertEqual(store.size, size + 256 * 256 * 3)
+        self.assertIsNone(store.fill_pixels((9, 140, 216)))
+
+    def test_eviction(self):
+        store = TileStore(self.filename, raw=True, max_bytes=256 * 256 * 3 * 4)
+        for x in range(6):
+            store.put((9, x, 0), make_tile(x))
+            store.get((9, 0, 0))  # Keep the first one in use
+        self.assertLessEqual(store.size, store.max_bytes)
+        self.assertIn((9, 0, 0), store)
+        self.assertIn((9, 5, 0), store)
+        self.assertNotIn((9, 1, 0), store)
+
+    def test_import_directory(self):
+        cache = os.path.join(self.directory, 'cache')
+        os.makedirs(cache)
+        for x in range(3):
+            with open(os.path.join(cache, 'osmviz-abcde-9_%d_7.png' % x), 'wb') as f:
+                f.write(make_tile(x))
+        with open(os.path.join(cache, 'osmviz-abcde-9_3_7.png'), 'wb') as f:
+            f.write('truncated')
+        store = TileStore(self.filename, raw=True)
+        self.assertEqual(store.import_directory(cache, prefix='osmviz-abcde-'), 3)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store.get((9, 2, 7)), make_tile(2))
+
+    def test_manager(self):
+        store = TileStore(self.filename)
+        store.put((9, 140, 215), make_tile(7))
+        server = 'http://127.0.0.1:9'  # Nothing listens here
+        osm = OSMManager(image_manager=PILImageManager('RGB'), store=store, server=server,
+                         downloader=TileDownloader(server, retries=0))
+        image = Image.open(osm.retrieveTileImage((140, 215), 9))
+        self.assertEqual(image.size, (256, 256))
+        self.assertEqual(image.convert('RGB').getpixel((0, 0)), (7, 7, 7))
+        self.assertRaises(Exception, osm.retrieveTileImage, (141, 215), 9)
+
+if __name__ == '__main__':
+    unittest.main()
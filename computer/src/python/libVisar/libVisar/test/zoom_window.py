@@ -0,0 +1,89 @@
+import unittest
+import random
+import shutil
+import tempfile
+from libVisar.visar.drawables.map import _ZoomWindow
+from libVisar.visar.globals.tile_service import TileService
+from libVisar.OpenGL.drawing import TileAtlas
+
+class TestZoomWindow(unittest.TestCase):
+    '''
+    Functions:
+        _ZoomWindow(zoom, service)
+        recenter(position_lla), loaded(tile), refresh(atlas), phase
+    '''
+
+    def setUp(self):
+        '''Prepare for unit testing'''
+        self.directory = tempfile.mkdtemp()
+        self.service = TileService(self.directory, server='http://127.0.0.1:9')
+        self.zoom = 5
+        self.window = _ZoomWindow(self.zoom, self.service)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def position(self, x, y):
+        '''Latitude, longitude of the center of tile (x, y)'''
+        latitude, longitude = self.service.osm.tileNWLatlon((x + 0.5, y + 0.5), self.zoom)
+        return (latitude, (longitude + 180.0) % 360.0 - 180.0, 0.0)
+
+    def check_cells(self):
+        '''Every texel holds the tile the shader expects there, for the window's phase'''
+        window, size = self.window, self.window.size
+        self.assertEqual(len(window.cells), size * size)
+        for (column, row), tile in window.cells.items():
+            dx, dy = (column - window.phase[0]) % size, (row - window.phase[1]) % size
+            self.assertEqual(tile, self.service.wrap((self.zoom, window.origin[0] + dx, window.origin[1] + dy)))
+        self.assertEqual(window.visible, set(window.cells.values()))
+
+    def test_first(self):
+        exposed = self.window.recenter(self.position(10, 12))
+        self.assertEqual(len(exposed), 25)
+        self.assertEqual(self.window.center, (self.zoom, 10, 12))
+        self.assertEqual(self.window.origin, (8, 10))
+        self.assertEqual(self.window.phase, (3, 0))
+        self.assertEqual(len(self.window.stale), 25)
+        self.check_cells()
+        self.assertEqual(self.window.recenter(self.position(10, 12)), [])
+
+    def test_step(self):
+        self.window.recenter(self.position(10, 12))
+        self.window.stale.clear()
+        exposed = self.window.recenter(self.position(11, 11))  # One tile north-east
+        self.assertEqual(len(exposed), 9)  # A row and a column
+        self.assertEqual(set(exposed), set(
+            [(self.zoom, 13, y) for y in range(9, 14)] + [(self.zoom, x, 9) for x in range(9, 14)]))
+        self.assertEqual(len(self.window.stale), 9)
+        self.check_cells()
+
+    def test_random_walk(self):
+        # Across the antimeridian (x 31 -> 0 at zoom 5), with the odd jump
+        walk = random.Random(7)
+        x, y = 29, 14
+        for step in range(300):
+            if walk.random() < 0.05:
+                x += walk.randint(-8, 8)
+            else:
+                x += walk.choice((-1, 0, 1))
+                y += walk.choice((-1, 0, 1))
+            y = min(max(y, 4), 27)  # Away from the poles, where rows are clamped
+            before = set(self.window.visible)
+            exposed = self.window.recenter(self.position(x % 32, y))
+            self.check_cells()
+            self.assertEqual(set(exposed), self.window.visible - before
+                             if len(exposed) < 25 else self.window.visible)
+
+    def test_refresh(self):
+        atlas = TileAtlas((8, 8), tile_size=16)
+        self.window.recenter(self.position(10, 12))
+        self.assertTrue(self.window.refresh(atlas))
+        self.assertFalse(self.window.refresh(atlas))
+        self.window.loaded((self.zoom, 10, 12))
+        self.assertEqual(self.window.stale, set([(0, 2)]))
+        self.window.loaded((self.zoom, 0, 0))  # Not in the window
+        self.assertEqual(len(self.window.stale), 1)
+        self.assertTrue(self.window.refresh(atlas))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+'''Headless render benchmark
+Drives the Renderer and Distorter against an offscreen GL context, replaying a scripted
+pose and target timeline, and reports frame rate, per-phase CPU time and the net change in
+garbage collected objects per frame (a proxy for allocation churn, not an allocation count).
+
+Usage:
+    vsr-bench --frames 600 --targets 100
+    vsr-bench --backend osmesa --single_pass --json results.json
+    vsr-bench --lookup  # Per-pixel lookup distortion, to compare against the mesh
+
+Runs without an HMD or a window; on a GPU-less box use Mesa's software rasterizer through vispy's
+headless backends (egl with EGL_PLATFORM=surfaceless, or osmesa).
+'''
+from __future__ import division
+import argparse
+import gc
+import json
+import resource
+import time
+import numpy as np
+
+from vispy import app, gloo
+
+from ..OpenGL.utils import Logger, FrameProfiler
+from ..OpenGL.utils.transformations import quaternion_from_euler, quaternion_multiply
+from ..OpenGL.drawing import Resources
+from .globals import State
+from . import render_package
+
+parser = argparse.ArgumentParser(description='Benchmark the VisAR renderer offscreen.')
+parser.add_argument('--backend', dest='backend', default='egl',
+                    help='vispy app backend, ex: egl, osmesa, pyglet (default egl)')
+parser.add_argument('--frames', dest='frames', type=int, default=600,
+                    help='Frames to measure')
+parser.add_argument('--warmup', dest='warmup', type=int, default=30,
+                    help='Frames to draw before measuring')
+parser.add_argument('--targets', dest='targets', type=int, default=100,
+                    help='Remote units in the scripted timeline')
+parser.add_argument('--size', dest='size', type=int, nargs=2, default=(1920, 1080), metavar=('WIDTH', 'HEIGHT'),
+                    help='Framebuffer size')
+parser.add_argument('--rate', dest='rate', type=float, default=60.0,
+                    help='Simulated frame rate of the timeline (frames are drawn back to back regardless)')
+parser.add_argument('--seed', dest='seed', type=int, default=0,
+                    help='Timeline random seed')
+parser.add_argument('--map', dest='map', action='store_true', default=False,
+                    help='Include the map (needs a populated map_cache or network access)')
+parser.add_argument('--single_pass', dest='single_pass', action='store_true', default=False,
+                    help='Render both eyes in one pass')
+parser.add_argument('--no_distort', dest='no_distort', action='store_true', default=False,
+                    help='Skip the distortion pass')
+parser.add_argument('--lookup', dest='lookup', nargs='?', metavar='FPGA_MAP', const='lens', default=None,
+                    help='Distort with a per-pixel lookup texture instead of the mesh (See the renderer\'s --lookup)')
+parser.add_argument('--mesh_resolution', dest='mesh_resolution', type=float, default=None,
+                    help='Generated distortion mesh density (See the renderer\'s --mesh_resolution)')
+parser.add_argument('--no_ui_cache', dest='no_ui_cache', action='store_true', default=False,
+                    help='Draw the UI every frame')
+parser.add_argument('--render_scale', dest='render_scale', type=float, default=1.0,
+                    help='Eye buffer resolution scale')
+parser.add_argument('--json', dest='json', default=None,
+                    help='Write the results to this file')
+parser.add_argument('--trace', dest='trace', default=None,
+                    help='Write a Chrome trace of the measured frames to this file')
+
+
+class Timeline(object):
+    '''Timeline(targets=100, seed=0) -> Timeline
+    Deterministic head motion, remote units and UI events as a function of simulated time
+
+    - The head sweeps +/-30 degrees of yaw at 0.25Hz and +/-10 degrees of pitch at 0.4Hz
+    - Remote units drift on 5m circles around fixed offsets, and a tenth of them are replaced every 5 seconds
+    - The selected button moves every 2 seconds and the battery drains over a minute
+    '''
+    churn_period = 5.0
+    button_period = 2.0
+
+    def __init__(self, targets=100, seed=0):
+        random = np.random.RandomState(seed)
+        self.count = targets
+        self.offsets = random.uniform(-100.0, 100.0, (targets, 3))
+        self.phases = random.uniform(0.0, 2 * np.pi, targets)
+        self.base_quaternion = np.array(State.orientation_quaternion)
+        self.base_position = np.array(State.position_ecef)
+
+    def orientation(self, t):
+        yaw = np.radians(30.0) * np.sin(2 * np.pi * 0.25 * t)
+        pitch = np.radians(10.0) * np.sin(2 * np.pi * 0.4 * t)
+        return quaternion_multiply(self.base_quaternion, quaternion_from_euler(pitch, yaw, 0.0))
+
+    def targets(self, t):
+        churn = int(t // self.churn_period) * max(self.count // 10, 1)
+        angles = self.phases + 0.2 * t
+        targets = {}
+        for n in range(self.count):
+            x, y, z = self.base_position + self.offsets[n] + 5.0 * np.array((np.cos(angles[n]), np.sin(angles[n]), 0.0))
+            targets['T%05d' % (n + churn)] = {'position_ecef': {'x': x, 'y': y, 'z': z}}
+        return targets
+
+    def apply(self, t):
+        State.set_orientation(tuple(self.orientation(t)))
+        State.targets = self.targets(t)
+        buttons = sorted(State.buttons)
+        if buttons:
+            State.current_button = buttons[int(t // self.button_period) % len(buttons)]
+        State.battery = max(100 - int(t * 100 / 60.0), 0)
+
+
+def renderer_args(options):
+    '''Command line for the Renderer under test'''
+    argv = ['--always_draw', '--render_scale', str(options.render_scale)]
+    if not options.map:
+        argv.append('--no_map')
+    if options.single_pass:
+        argv.append('--single_pass')
+    if options.no_distort:
+        argv.append('--no_distort')
+    if options.no_ui_cache:
+        argv.append('--no_ui_cache')
+    if options.lookup:
+        argv += ['--lookup', options.lookup]
+    if options.mesh_resolution is not None:
+        argv += ['--mesh_resolution', str(options.mesh_resolution)]
+    return render_package.parser.parse_args(argv)
+
+
+def attach_profiler(renderer, profiler):
+    renderer.profiler = profiler
+    renderer.Distorter.profiler = profiler
+
+
+def run(options):
+    '''run(options) -> (results dict, FrameProfiler of the measured frames)'''
+    app.use_app(options.backend)
+    renderer = render_package.Renderer(size=tuple(options.size), args=renderer_args(options))
+    renderer.set_current()
+    timeline = Timeline(options.targets, options.seed)
+    dt = 1.0 / options.rate
+
+    def frame(n):
+        timeline.apply(n * dt)
+        renderer.on_timer(None)
+        renderer.on_draw(None)
+        gloo.finish()
+
+    attach_profiler(renderer, FrameProfiler(history=options.warmup or 1))
+    for n in range(options.warmup):
+        frame(n)
+
+    profiler = FrameProfiler(history=options.frames)
+    attach_profiler(renderer, profiler)
+    contexts = (renderer.Render_List, renderer.UI_elements)
+    for context in contexts:
+        context.reset_counters()
+
+    # Net change in GC-tracked containers (allocated minus freed; numbers, strings and arrays' data are
+    # not counted). The collector is held off so the count only moves with our frames
+    objects = []
+    gc.collect()
+    gc.disable()
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    try:
+        for n in range(options.warmup, options.warmup + options.frames):
+            before = gc.get_count()[0]
+            frame(n)
+            objects.append(gc.get_count()[0] - before)
+    finally:
+        elapsed = time.time() - start
+        gc.enable()
+
+    results = {
+        'frames': options.frames,
+        'seconds': elapsed,
+        'fps': options.frames / elapsed,
+        'phases': profiler.stats(),
+        'memory': {
+            'net_gc_objects_per_frame': float(np.mean(objects)),
+            'net_gc_objects_per_frame_p95': float(np.percentile(objects, 95)),
+            'peak_rss_growth_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss,
+        },
+        'uniforms': {  # Shared uniform uploads from the contexts to their drawables, to compare --single_pass
+            'uploads_per_frame': sum(context.uploads for context in contexts) / options.frames,
+            'skipped_per_frame': sum(context.skipped_uploads for context in contexts) / options.frames,
+        },
+        'resources': Resources.stats(),
+        'options': vars(options),
+    }
+    if options.trace:
+        profiler.dump_chrome_trace(options.trace)
+    renderer.close()
+    return results, profiler
+
+
+def main():
+    options = parser.parse_args()
+    Logger.set_verbosity('warn')
+    results, profiler = run(options)
+
+    print '{frames} frames in {seconds:.2f} s: {fps:.1f} fps'.format(**results)
+    print profiler.summary()
+    memory = results['memory']
+    print 'Memory: {:.1f} net GC objects/frame (p95 {:.0f}), peak RSS grew {} kB'.format(
+        memory['net_gc_objects_per_frame'], memory['net_gc_objects_per_frame_p95'], memory['peak_rss_growth_kb'])
+    print 'Uniforms: {uploads_per_frame:.1f} uploads/frame, {skipped_per_frame:.1f} skipped/frame'.format(
+        **results['uniforms'])
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        Logger.warn('Wrote benchmark results to', options.json)
+
+
+if __name__ == '__main__':
+    main()
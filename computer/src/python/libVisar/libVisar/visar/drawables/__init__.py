@@ -1,7 +1,8 @@
-from .target import Targets, Target
+from .target import Targets, Target, TargetField
 from .example import Example
 from .map import Map
 from .menu import Button
 from .brain import Brain
 from .toast import Toast
 from .battery import Battery
+from .profiler_hud import ProfilerHud
@@ -7,7 +7,7 @@ from vispy.gloo import (Program, VertexBuffer, IndexBuffer, Texture2D, clear,
                         FrameBuffer, RenderBuffer, set_viewport, set_state)
 from vispy import app, visuals, gloo
 
-from ...OpenGL.drawing import Drawable
+from ...OpenGL.drawing import Drawable, Resources
 from ...OpenGL.utils import Logger
 from ..globals import State, Paths
 
@@ -97,12 +97,12 @@ class Battery(Drawable):
 
         ], dtype=np.float32)
 
-        self.indices = IndexBuffer([
+        self.indices = Resources.index_buffer([
             0, 1, 2,
             2, 3, 0,
         ])
 
-        self.program = Program(self.battery_vertex_shader, self.battery_fragment_shader)
+        self.program = Resources.program(self.battery_vertex_shader, self.battery_fragment_shader)
 
         self.texture = Texture2D(shape=size + (3,))
         self.text_buffer = FrameBuffer(self.texture, RenderBuffer(size))
@@ -129,8 +129,8 @@ class Battery(Drawable):
         # self.default_tex = Texture2D(shape=size + (3,))
         # self.default_tex.set_data(self.level_texture[3])
 
-        self.program['vertex_position']  = self.vertices
-        self.program['default_texcoord'] = self.tex_coords
+        self.program['vertex_position']  = Resources.vertex_buffer(self.vertices)
+        self.program['default_texcoord'] = Resources.vertex_buffer(self.tex_coords)
         self.program['view']             = self.view
         self.program['model']            = self.model
         self.program['projection']       = self.projection
@@ -174,6 +174,7 @@ class Battery(Drawable):
     def set_new_level(self, new_level):
         self.level = new_level
         self.flag = 1
+        self.dirty = True
 
     def make_texture(self):
         with self.text_buffer:
@@ -189,3 +190,4 @@ class Battery(Drawable):
         set_state(depth_test=False)
         self.program.draw('triangles', self.indices)
         set_state(depth_test=True)
+        self.dirty = False
@@ -1,3 +1,5 @@
+import collections
+import time
 import numpy as np
 from ...OpenGL import utils
 from vispy.geometry import create_cube
@@ -5,14 +7,131 @@ from vispy.util.transforms import perspective, translate, rotate, scale, xrotate
 from vispy.gloo import (Program, VertexBuffer, IndexBuffer, Texture2D, clear,
                         FrameBuffer, RenderBuffer, set_viewport, set_state)
 
-from ...osmviz import PILImageManager, OSMManager
+from ...osmviz import NumpyImageManager, OSMManager, TileStore
 import PIL.Image as Image
 
-from ...OpenGL.drawing import Drawable
+from ...OpenGL.drawing import Drawable, Resources, TileAtlas
 from ...OpenGL.utils import Logger
-from ..globals import State, Paths
+from ..globals import State, Paths, geodesy
+from ..globals.tile_service import TileService, EARTH_RADIUS
 import os
 
+class _ZoomWindow(object):
+    '''The (2 * radius + 1)^2 tiles around the user at one zoom level, and the indirection texture the map
+    shader finds them through (See TileAtlas.indirection_entry)
+
+    The window is toroidal: tile (x, y) always lives in texel (x mod size, y mod size), with x counted
+    continuously across the antimeridian. When the window moves, only the texels of the rows and columns
+    that came into view change; the shader finds the rest by wrapping with the window's phase.
+    '''
+    def __init__(self, zoom, service):
+        self.zoom = zoom
+        self.service = service
+        self.size = 2 * service.radius + 1
+        self.center = None
+        self.origin = None  # (x, y) of the north-west tile, x not wrapped
+        self.cells = {}  # texel (column, row) -> tile
+        self.texels = collections.defaultdict(set)  # tile -> texels showing it
+        self.visible = set()
+        self.stale = set()  # Texels whose entry has not been uploaded
+        self.role = None  # Level of the pyramid this window is bound to in the shader
+        self.bound = None  # Placement and phase last sent to the shader
+        self.indirection = Texture2D(np.zeros((self.size, self.size, 4), dtype=np.uint8), interpolation='nearest')
+
+    @property
+    def phase(self):
+        '''Texel of the north-west tile'''
+        if self.origin is None:
+            return (0, 0)
+        return (self.origin[0] % self.size, self.origin[1] % self.size)
+
+    def _exposed(self, old, new):
+        '''Tiles (x, y) of the window at origin $new that were not in the window at origin $old'''
+        size = self.size
+        if old is None or abs(new[0] - old[0]) >= size or abs(new[1] - old[1]) >= size:
+            return [(x, y) for y in range(new[1], new[1] + size) for x in range(new[0], new[0] + size)]
+
+        def entering(start, previous):
+            return range(start, previous) if start < previous else range(previous + size, start + size)
+
+        rows, columns = entering(new[1], old[1]), entering(new[0], old[0])
+        kept_rows = range(max(new[1], old[1]), min(new[1], old[1]) + size)
+        return ([(x, y) for y in rows for x in range(new[0], new[0] + size)] +
+                [(x, y) for y in kept_rows for x in columns])
+
+    def recenter(self, position_lla):
+        '''Center the window on the tile under position_lla; -> the tiles that came into view'''
+        center = self.service.tile_at(position_lla[0], position_lla[1], self.zoom)
+        if center == self.center:
+            return []
+        zoom, x, y = center
+        radius = self.service.radius
+        if self.center is None:
+            origin = (x - radius, y - radius)
+        else:
+            n = 2 ** zoom
+            dx = (x - self.center[1] + n // 2) % n - n // 2  # The short way around
+            origin = (self.origin[0] + dx, self.origin[1] + y - self.center[2])
+
+        exposed = []
+        for column, row in self._exposed(self.origin, origin):
+            texel = (column % self.size, row % self.size)
+            tile = self.service.wrap((zoom, column, row))
+            previous = self.cells.get(texel)
+            if previous is not None:
+                self.texels[previous].discard(texel)
+                if not self.texels[previous]:
+                    del self.texels[previous]
+            self.cells[texel] = tile
+            self.texels[tile].add(texel)
+            self.stale.add(texel)
+            exposed.append(tile)
+
+        self.center, self.origin = center, origin
+        self.visible = set(self.texels)
+        return exposed
+
+    def loaded(self, tile):
+        '''Note that $tile was uploaded to the atlas'''
+        self.stale.update(self.texels.get(tile, ()))
+
+    def refresh(self, atlas):
+        '''Upload the entries of the stale texels; -> whether there were any'''
+        if not self.stale:
+            return False
+        if len(self.stale) > self.size:
+            table = np.zeros((self.size, self.size, 4), dtype=np.uint8)
+            for (column, row), tile in self.cells.items():
+                table[row, column] = atlas.indirection_entry(tile)
+            self.indirection.set_data(table)
+        else:
+            for column, row in self.stale:
+                entry = atlas.indirection_entry(self.cells[column, row])
+                self.indirection.set_data(entry.reshape(1, 1, 4), offset=(row, column))
+        self.stale.clear()
+        return True
+
+    def placement(self, position_lla, span):
+        '''(offset x, offset y, scale x, scale y) taking map uv to window uv, for $span meters of ground
+        centered on position_lla (Web Mercator is conformal, so one scale fits both axes locally)
+        '''
+        latitude, longitude = np.radians(position_lla[0]), position_lla[1]
+        n = 2 ** self.zoom
+        position = np.array([
+            (longitude + 180.0) / 360.0 * n,
+            (1.0 - np.arcsinh(np.tan(latitude)) / np.pi) / 2.0 * n,
+        ])  # In tiles
+        if self.origin is None:
+            origin = np.floor(position) - self.service.radius
+        else:
+            origin = np.array(self.origin, dtype=np.float64)
+            position[0] += np.round((origin[0] + self.service.radius - position[0]) / n) * n  # Same side of the antimeridian
+        tiles = span * n / (2 * np.pi * EARTH_RADIUS * np.cos(latitude))  # Across the map
+        scale = tiles / self.size
+        offset = (position - origin) / self.size - scale / 2.0
+        return np.array([offset[0], offset[1], scale, scale])
+
+
 class Map(Drawable):
     ''' Map
 
@@ -114,6 +233,7 @@ class Map(Drawable):
     
     frame_frag_shader = """
         #version 120
+        """ + TileAtlas.extensions + """
         uniform int hide;
         uniform vec2 map_center; // Latitude, Longitude
         uniform vec4 corners; // min_lat, min_long, max_lat, max_long
@@ -121,15 +241,60 @@ class Map(Drawable):
         uniform vec2 user_position; // Latitude, Longitude
         uniform float user_orientation; // Yaw, radians
 
-        uniform sampler2D map_texture;
+        uniform float zoom; // Continuous zoom level; its fraction fades the base level into the fine one
+
+        uniform sampler2D atlas; // Tiles, in fixed-size slots
+        uniform vec2 atlas_slots; // Slots across, down
+        uniform float atlas_inset;
+        uniform vec2 window_size; // Tiles across, down, of every level's window
+
+        // Per level (zoom - 1, zoom, zoom + 1): one texel per window tile, (slot column, slot row, -, loaded)
+        uniform sampler2D coarse_indirection;
+        uniform sampler2D base_indirection;
+        uniform sampler2D fine_indirection;
+        // Per level: map uv -> window uv, as offset (xy) and scale (zw)
+        uniform vec4 coarse_window;
+        uniform vec4 base_window;
+        uniform vec4 fine_window;
+        // Per level: texel of the window's north-west tile; the indirection textures wrap around
+        uniform vec2 coarse_phase;
+        uniform vec2 base_phase;
+        uniform vec2 fine_phase;
+
         varying vec2 texcoord;
+        """ + TileAtlas.glsl + """
+        vec4 level_color(sampler2D indirection, vec4 window, vec2 phase, vec2 uv) {
+            vec2 position = (window.xy + uv * window.zw) * window_size; // In tiles
+            vec2 position_dx = dFdx(position);
+            vec2 position_dy = dFdy(position);
+            if (any(lessThan(position, vec2(0.0))) || any(greaterThanEqual(position, window_size))) {
+                return vec4(0.0);
+            }
+            vec2 cell = floor(position);
+            vec2 texel = mod(cell + phase, window_size);
+            vec4 entry = texture2D(indirection, (texel + 0.5) / window_size);
+            if (entry.a < 0.5) {
+                return vec4(0.0); // Tile not loaded yet
+            }
+            vec2 slot = floor(entry.xy * 255.0 + 0.5);
+            vec4 color = atlas_sample(atlas, slot, position - cell, position_dx, position_dy, atlas_slots, atlas_inset);
+            return vec4(color.rgb, 1.0);
+        }
+
         void main()
         {
-            vec4 color = texture2D(map_texture, texcoord);
+            // Grey until anything arrives, then each level over the coarser ones wherever it is loaded
+            vec4 coarse = level_color(coarse_indirection, coarse_window, coarse_phase, texcoord);
+            vec4 base = level_color(base_indirection, base_window, base_phase, texcoord);
+            vec4 fine = level_color(fine_indirection, fine_window, fine_phase, texcoord);
+            vec3 color = mix(vec3(0.5), coarse.rgb, coarse.a);
+            color = mix(color, base.rgb, base.a);
+            color = mix(color, fine.rgb, fine.a * fract(zoom));
+
             if (hide == 1){
-                gl_FragColor = vec4(color.rgb, 0.0);
+                gl_FragColor = vec4(color, 0.0);
             } else {
-                gl_FragColor = vec4(color.rgb, 1);
+                gl_FragColor = vec4(color, 1);
             }
             
         }
@@ -144,8 +309,30 @@ class Map(Drawable):
     """
 
     name = "Map"
-    def __init__(self):
+    request_interval = 0.5  # Seconds between re-requests of the predicted track while we stay on one tile
+    tile_memory = 128  # Decoded tiles kept in memory
+    store_bytes = 512 * 2 ** 20  # Bound on the on-disk tile store
+    atlas_slots = (16, 8)  # GPU tile slots; must exceed the three levels' (2 * radius + 1)^2 tiles
+    mipmap_levels = 2
+
+    zoom_levels = (3, 17)  # Coarsest and finest OSM zoom used
+    eye_pixels = (960, 1080)  # One eye of the HMD, to turn the map's projected size into pixels
+    lod_bias = 0.0  # Added to the zoom picked from the on-screen scale; positive is sharper
+
+    def __init__(self, service=None, span=20000.0):
         '''Map drawable - contains the goddamn map
+
+        The map shows $span meters of ground around the user (See set_span). Its zoom level follows from
+        how many pixels the map covers on screen, and it keeps a pyramid of three levels around that:
+        the base level, a finer one it fades into as the zoom grows, and a coarser one that fills in
+        wherever the others have not loaded yet. Changing the span only changes uniforms until it
+        crosses a level.
+
+        Tiles stream in from a TileService (started here if none is given, backed by a raw TileStore in
+        the map cache), so nothing blocks on the network or the disk. Each level's window of
+        (2 * radius + 1)^2 tiles around the user is uploaded one tile at a time into a mipmapped
+        TileAtlas, and the shader finds them through a small wrap-around indirection texture per level;
+        moving to a new tile only uploads the tiles, and rewrites the indirection texels, that came into view.
         '''
         self.projection = np.eye(4)
         self.view = np.eye(4)
@@ -174,38 +361,184 @@ class Map(Drawable):
             [0, 0],
         ], dtype=np.float32)
 
-        self.indices = IndexBuffer([
+        self.indices = Resources.index_buffer([
             0, 1, 2,
             2, 3, 0,
         ])
 
-        ###### TESTING
-        self.position_lla = self.ecef2llh((738575.65, -5498374.10, 3136355.42))
-        ###### TESTING
+        self.position_lla = geodesy.ecef_to_lla(State.position_ecef)
+        self.span = span
+
+        if service is None:
+            service = TileService(self.cache_path(), store=self.tile_store())
+        self.service = service
+        self.service.start()
+        self.tiles = collections.OrderedDict()  # (zoom, x, y) -> image, least recently used first
+        self.windows = {}  # zoom -> _ZoomWindow, for the levels of the pyramid
+        self.last_request = 0.0
 
-        self.map, self.ranges = self.cache_map(self.position_lla[:2])
-        self.map, self.ranges = self.get_map(self.position_lla[:2])
-        self.program = Program(self.frame_vertex_shader, self.frame_frag_shader)
+        window_size = 2 * self.service.radius + 1
+        assert 3 * window_size ** 2 < np.prod(self.atlas_slots), "The tile atlas cannot hold the pyramid"
+        self.atlas = TileAtlas(self.atlas_slots, self.service.tile_size, mipmap_levels=self.mipmap_levels)
+        self.ranges = np.zeros(4)
+
+        self.program = Resources.program(self.frame_vertex_shader, self.frame_frag_shader)
 
         default_map_transform = np.eye(4)
 
-        self.program['vertex_position'] = self.vertices
-        self.program['default_texcoord'] = self.tex_coords
-        self.program['zoom'] = 1
+        self.program['vertex_position'] = Resources.vertex_buffer(self.vertices)
+        self.program['default_texcoord'] = Resources.vertex_buffer(self.tex_coords)
         self.program['view'] = self.view
         self.program['model'] = self.model
         self.program['projection'] = self.projection
 
         self.program['map_transform'] = default_map_transform
         self.program['map_center'] = self.position_lla[:2]
-        self.program['map_texture'] = self.map
+        self.program['atlas'] = self.atlas.texture
+        self.program['atlas_slots'] = self.atlas.slots
+        self.program['atlas_inset'] = self.atlas.inset
+        self.program['window_size'] = (window_size, window_size)
         self.program['corners'] = self.ranges
         self.program['user_position'] = self.position_lla[:2]
         self.program['hide'] = 0
+        self.hide = 0
+        self.zoom = None
+        self.levels = None  # (coarse, base, fine) zooms bound to the shader
+        self.level_windows = None
+        self.set_zoom()
+        self.stream_tiles()
 
     def set_map(self, position_lla):
-        self.map, self.ranges = self.get_map(position_lla[:2])
-        self.program['map_texture'] = self.map
+        '''Recenter the windows on position_lla right away'''
+        self.position_lla = np.asarray(position_lla)
+        self.last_request = 0.0
+        self.set_zoom()
+        self.stream_tiles()
+
+    def set_span(self, span):
+        '''Show $span meters of ground across the map'''
+        self.span = float(span)
+        self.set_zoom()
+
+    def screen_pixels(self):
+        '''Size of the map on screen, in pixels of one eye (the larger of its width and height)'''
+        corners = np.column_stack([self.vertices, np.ones(len(self.vertices))])
+        transform = np.dot(np.dot(self.model, self.program['view']), self.program['projection'])
+        clip = np.dot(corners, transform)
+        if np.any(clip[:, 3] <= 0.0):
+            return max(self.eye_pixels)  # Partly behind the eye; assume it fills the view
+        ndc = clip[:, :2] / clip[:, 3:]
+        return np.max((ndc.max(axis=0) - ndc.min(axis=0)) / 2 * self.eye_pixels)
+
+    def ideal_zoom(self):
+        '''Continuous zoom level at which one tile texel covers about one pixel of the map on screen'''
+        ground = 2 * np.pi * EARTH_RADIUS * np.cos(np.radians(self.position_lla[0]))  # Meters around this latitude
+        texels = self.screen_pixels() * ground / (self.service.tile_size * self.span)
+        return np.log2(max(texels, 1.0)) + self.lod_bias
+
+    def set_zoom(self):
+        '''Pick the zoom from the on-screen scale, and bind the pyramid's levels and windows'''
+        zoom = float(np.clip(self.ideal_zoom(), self.zoom_levels[0] + 1, self.zoom_levels[1] - 1))
+        if zoom != self.zoom:
+            self.zoom = zoom
+            self.program['zoom'] = zoom
+            self.dirty = True
+
+        base = int(zoom)
+        levels = (base - 1, base, base + 1)
+        if levels != self.levels:
+            self.levels = levels
+            for level in list(self.windows):
+                if level not in levels:
+                    del self.windows[level]
+            for level in levels:
+                if level not in self.windows:
+                    self.windows[level] = _ZoomWindow(level, self.service)
+            self.level_windows = [self.windows[level] for level in levels]
+            for role, window in zip(('coarse', 'base', 'fine'), self.level_windows):
+                window.role = role
+                window.bound = None
+                self.program[role + '_indirection'] = window.indirection
+            self.last_request = 0.0  # Ask for the new levels' tiles right away
+
+        for window in self.level_windows:
+            self.place(window)
+
+    def place(self, window):
+        '''Send $window's placement and phase to the shader, if they changed'''
+        bound = np.append(window.placement(self.position_lla, self.span), window.phase)
+        if window.bound is None or not np.allclose(bound, window.bound, rtol=0.0, atol=1e-6):
+            window.bound = bound
+            self.program[window.role + '_window'] = bound[:4]
+            self.program[window.role + '_phase'] = bound[4:]
+            self.dirty = True
+
+    def velocity_enu(self):
+        '''Our velocity (m/s) in East/North/Up, None if the pose has none'''
+        try:
+            velocity = State.pose['velocity_ecef']
+            return np.dot(State.anchor.rotation, (velocity['x'], velocity['y'], velocity['z']))
+        except (KeyError, TypeError):
+            return None
+
+    def stream_tiles(self):
+        '''Request the tiles around us at every level and along our track, and take in the ones that have arrived'''
+        coarse, base, fine = self.level_windows
+        exposed = collections.OrderedDict()  # window -> tiles that came into view
+        for window in self.level_windows:
+            tiles = window.recenter(self.position_lla)
+            if tiles:
+                exposed[window] = tiles
+                self.place(window)  # Its phase must match the texels refreshed below
+
+        now = time.time()
+        if exposed or now - self.last_request > self.request_interval:
+            # The base level and our track first, then the fallback level, then the finer one
+            wanted = self.service.tiles_around(self.position_lla, self.velocity_enu(), base.zoom)
+            wanted += self.service.tiles_around(self.position_lla, None, coarse.zoom)
+            wanted += self.service.tiles_around(self.position_lla, None, fine.zoom)
+            wanted = collections.OrderedDict.fromkeys(wanted)
+            self.service.request([tile for tile in wanted if tile not in self.tiles and tile not in self.atlas])
+            self.last_request = now
+
+        if base in exposed:
+            radius = self.service.radius
+            zoom, x, y = base.center
+            self.ranges = self.service.bounds((zoom, x - radius, y - radius), 2 * radius + 1)
+            self.program['corners'] = self.ranges
+            self.program['map_center'] = self.position_lla[:2]
+
+        visible = set()
+        for window in self.level_windows:
+            visible |= window.visible
+        if exposed:
+            self.atlas.pin(visible)  # Tiles arriving below must not evict the new windows
+            # Upload only the tiles that just came into view; the rest of each window is already there
+            for tiles in exposed.values():
+                for tile in tiles:
+                    if tile not in self.atlas and tile in self.tiles:
+                        self.tiles[tile] = image = self.tiles.pop(tile)  # Now the most recently used
+                        self.atlas.insert(tile, image)
+                        for window in self.level_windows:
+                            window.loaded(tile)
+        for zoom, x, y, image in self.service.collect():
+            tile = (zoom, x, y)
+            self.tiles.pop(tile, None)
+            self.tiles[tile] = image
+            if tile in visible:
+                self.atlas.insert(tile, image)
+                for window in self.level_windows:
+                    window.loaded(tile)
+        while len(self.tiles) > self.tile_memory:
+            self.tiles.popitem(last=False)
+
+        for window in self.level_windows:
+            if window.refresh(self.atlas):
+                self.dirty = True
+
+    def destroy(self):
+        self.service.stop()
+        self.release()
 
     def update(self):
         yaw = State.yaw
@@ -214,37 +547,43 @@ class Map(Drawable):
         # Could use optimization by subtracting current yaw from previous yaw
         map_transform = np.eye(4)
         # map_transform = zrotate(map_transform, counter_yaw)
-        scale(map_transform, 0.2)
         
         self.program['map_transform'] = map_transform
 
         # Convert Forrest's ecef position to lla
-        new_position = State.position_ecef
-        abs_changes = np.fabs(self.position_lla - new_position)
-
-        # if max(abs_changes) > 100:  # (m)
-            # self.set_map(new_position)
-            # pass
-
-        new_position_lla = self.ecef2llh(State.position_ecef)[:2]
+        self.position_lla = geodesy.ecef_to_lla(State.position_ecef)
         self.program['user_position'] = self.position_lla[:2]
+        self.set_zoom()
+        self.stream_tiles()
 
 
-        if State.hide_map:
-            self.program['hide'] = 1
-        else:
-            self.program['hide'] = 0
+        hide = 1 if State.hide_map else 0
+        if hide != self.hide:
+            self.hide = hide
+            self.program['hide'] = hide
+            self.dirty = True
 
     def draw(self):        
         # Disable depth test - UI element
         set_state(depth_test=False)
+        self.atlas.generate_mipmaps()
         self.program.draw('triangles', self.indices)
         set_state(depth_test=True)
+        self.dirty = False
+
+    @classmethod
+    def cache_path(self):
+        return os.path.join(Paths.get_path_to_visar(), 'map_cache')
+
+    @classmethod
+    def tile_store(self):
+        '''The TileStore the map reads from (See vsr-seed to fill it before going offline)'''
+        return TileStore(os.path.join(self.cache_path(), 'tiles.mbtiles'), max_bytes=self.store_bytes, raw=True)
 
     @classmethod 
     def cache_map(self, (latitude, longitude), zoom=9, region_size=6):
         '''Prep a map cache'''
-        imgr = PILImageManager('RGB')
+        imgr = NumpyImageManager('RGB')
         osm = OSMManager(image_manager=imgr, cache=os.path.join(Paths.get_path_to_visar(), 'map_cache'))
 
         half_size = region_size / 2.0
@@ -254,8 +593,7 @@ class Map(Drawable):
             longitude - half_size,
             longitude + half_size,
         )
-        image, bounds = osm.createOSMImage(region, zoom)
-        map_image = np.asarray(image)
+        map_image, bounds = osm.createOSMImage(region, zoom)  # Already an array, ready for a texture
 
         # Book-keeping
         min_lat, max_lat, min_long, max_long = bounds
@@ -281,7 +619,7 @@ class Map(Drawable):
         ... )
 
         '''
-        imgr = PILImageManager('RGB')
+        imgr = NumpyImageManager('RGB')
         osm = OSMManager(image_manager=imgr, cache=os.path.join(Paths.get_path_to_visar(), 'map_cache'))
 
         half_size = region_size / 2.0
@@ -292,11 +630,7 @@ class Map(Drawable):
             longitude + half_size,
         )
 
-        image, bounds = osm.createOSMImage(region, zoom)
-
-        # wh_ratio = float(image.size[0]) / image.size[1]
-        # image2 = image.resize( (int(800 * wh_ratio), 800), Image.ANTIALIAS )
-        map_image = np.asarray(image)
+        map_image, bounds = osm.createOSMImage(region, zoom)  # Already an array, ready for a texture
 
         # Book-keeping
         min_lat, max_lat, min_long, max_long = bounds
@@ -311,41 +645,20 @@ class Map(Drawable):
     @classmethod
     def ecef2llh(self, (x, y, z)):
         '''Convert ECEF to lat/lon/alt without geoid correction
-        Returns alt in meters
+        Returns alt in meters (See geodesy.ecef_to_lla for arrays of points)
         '''
-
-        ep = np.sqrt((self.wgs84_a2 - self.wgs84_b2) / self.wgs84_b2)
-        p = np.sqrt(x**2 + y**2)
-        th = np.arctan2(self.wgs84_a * z, self.wgs84_b * p)
-        lon = np.arctan2(y, x)
-        lat = np.arctan2(z + ep**2 * self.wgs84_b * np.sin(th)**3, p - self.wgs84_e2 * self.wgs84_a * np.cos(th)**3)
-        N = self.wgs84_a / np.sqrt(1 - self.wgs84_e2 * np.sin(lat)**2)
-        alt = p / np.cos(lat) - N
-        
-        lon *= (180. / np.pi)
-        lat *= (180. / np.pi)
-        
-        return np.array([lat, lon, alt])
+        return geodesy.ecef_to_lla((x, y, z))
 
     @classmethod
     def llh2ecef(self, (lat, lon, alt)):
         '''Convert lat/lon/alt coords to ECEF without geoid correction, WGS84 model
-        Remember that alt is in meters
+        Remember that alt is in meters (See geodesy.lla_to_ecef for arrays of points)
         '''
+        return geodesy.lla_to_ecef((lat, lon, alt))
 
-        lat *= (np.pi / 180.0)
-        lon *= (np.pi / 180.0)
-        
-        n = lambda x: self.wgs84_a / np.sqrt(1 - self.wgs84_e2 * (np.sin(x)**2))
-        
-        x = (n(lat) + alt) * np.cos(lat) * np.cos(lon)
-        y = (n(lat) + alt) * np.cos(lat) * np.sin(lon)
-        z = (n(lat) * (1 - self.wgs84_e2) + alt) * np.sin(lat)
-        
-        return np.array([x, y, z])
-        
     @classmethod
-    def llh2geoid(self, (lat, lon, alt)):
-        '''do both of the above to get a geoid-corrected x,y,z position'''
-        (x, y, z) = llh2ecef((lat, lon, alt + self.wgs84_height(lat, lon)))
-        return np.array([x, y, z])
+    def llh2geoid(self, (lat, lon, alt), geoid_height=0.0):
+        '''ECEF position of a point $alt meters above the geoid
+        geoid_height is the geoid's height above the WGS84 ellipsoid at (lat, lon); VisAR has no geoid model
+        '''
+        return geodesy.lla_to_ecef((lat, lon, alt + geoid_height))
@@ -6,7 +6,7 @@ from vispy.gloo import (Program, VertexBuffer, IndexBuffer, Texture2D, clear,
                         FrameBuffer, RenderBuffer, set_viewport, set_state)
 from vispy import app, visuals, gloo
 
-from ...OpenGL.drawing import Drawable
+from ...OpenGL.drawing import Drawable, Resources
 from ...OpenGL.utils import Logger
 from ..globals import State
 
@@ -110,21 +110,22 @@ class Button(Drawable):
 
         ], dtype=np.float32)
 
-        self.indices = IndexBuffer([
+        self.indices = Resources.index_buffer([
             0, 1, 2,
             2, 3, 0,
         ])
 
-        self.program = Program(self.button_vertex_shader, self.button_fragment_shader)
+        self.program = Resources.program(self.button_vertex_shader, self.button_fragment_shader)
 
-        self.program['vertex_position'] = self.vertices
-        self.program['default_texcoord'] = self.tex_coords
+        self.program['vertex_position'] = Resources.vertex_buffer(self.vertices)
+        self.program['default_texcoord'] = Resources.vertex_buffer(self.tex_coords)
         self.program['view'] = self.view
         self.program['model'] = self.model
         self.program['projection'] = self.projection
         self.program['background_color'] = color
 
         self.program['highlighted'] = 0
+        self.highlighted = 0
 
         # self.texture = Texture2D(shape=(1000, 1000) + (3,))        
         # self.text_buffer = FrameBuffer(self.texture, RenderBuffer((1000, 1000)))
@@ -144,10 +145,11 @@ class Button(Drawable):
         - Hide if I need to be hidden
 
         '''
-        if State.current_button == self.position:
-            self.program['highlighted'] = 1
-        else:
-            self.program['highlighted'] = 0
+        highlighted = 1 if State.current_button == self.position else 0
+        if highlighted != self.highlighted:
+            self.highlighted = highlighted
+            self.program['highlighted'] = highlighted
+            self.dirty = True
 
     def make_text(self, _string):
         self.font_size = 150
@@ -180,3 +182,4 @@ class Button(Drawable):
         set_state(depth_test=False)
         self.program.draw('triangles', self.indices)
         set_state(depth_test=True)
+        self.dirty = False
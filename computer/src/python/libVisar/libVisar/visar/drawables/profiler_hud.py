@@ -0,0 +1,134 @@
+import numpy as np
+import time
+from vispy.util.transforms import translate, scale
+from vispy.gloo import (Program, IndexBuffer, Texture2D, FrameBuffer, RenderBuffer, set_state)
+from vispy import visuals, gloo
+
+from ...OpenGL.drawing import Drawable, Resources
+
+REFRESH_TIME = 0.5  # Re-render the readout every half second
+
+
+class ProfilerHud(Drawable):
+    '''On-HUD readout of a FrameProfiler: frame time and the slowest phases (p50/p95)'''
+    hud_vertex_shader = """
+        #version 120
+        uniform mat4 model;
+        uniform mat4 view;
+        uniform mat4 projection;
+
+        attribute vec3 vertex_position;
+        attribute vec2 default_texcoord;
+
+        varying vec2 texcoord;
+
+        void main() {
+            texcoord = default_texcoord;
+            gl_Position = projection * view * model * vec4(vertex_position, 1.0);
+        }
+    """
+
+    hud_fragment_shader = """
+        #version 120
+        uniform sampler2D texture;
+        varying vec2 texcoord;
+        void main() {
+            vec4 color = texture2D(texture, texcoord);
+            gl_FragColor = vec4(color.rgb, 1);
+        }
+    """
+
+    name = "Profiler HUD"
+    def __init__(self, profiler, canvas, lines=4):
+        '''ProfilerHud(profiler, canvas, lines=4)
+        Arguments:
+            profiler - The FrameProfiler to read
+            canvas - main app.canvas (used for the text transform system)
+            lines - Number of phases to show under the frame time
+        '''
+        self.profiler = profiler
+        self.lines = lines
+        self.projection = np.eye(4)
+        self.view = np.eye(4)
+        self.model = np.eye(4)
+        height, width = 3.0, 8.0
+
+        scale(self.model, 0.2)
+        translate(self.model, 4.4, 4.0, -10)
+
+        self.size = (int(height * 100), int(width * 100))
+
+        self.vertices = np.array([
+            [-width / 2, -height / 2, 0],
+            [ width / 2, -height / 2, 0],
+            [ width / 2,  height / 2, 0],
+            [-width / 2,  height / 2, 0],
+        ], dtype=np.float32)
+
+        self.tex_coords = np.array([
+            [0, 0],
+            [1, 0],
+            [1, 1],
+            [0, 1],
+        ], dtype=np.float32)
+
+        self.indices = Resources.index_buffer([
+            0, 1, 2,
+            2, 3, 0,
+        ])
+
+        self.program = Resources.program(self.hud_vertex_shader, self.hud_fragment_shader)
+        self.program['vertex_position'] = Resources.vertex_buffer(self.vertices)
+        self.program['default_texcoord'] = Resources.vertex_buffer(self.tex_coords)
+        self.program['view'] = self.view
+        self.program['model'] = self.model
+        self.program['projection'] = self.projection
+
+        self.texture = Texture2D(shape=self.size + (3,))
+        self.text_buffer = FrameBuffer(self.texture, RenderBuffer(self.size))
+        self.program['texture'] = self.texture
+
+        # Own text visual; Button and Toast share canvas.text_renderer
+        self.text_renderer = visuals.TextVisual('', bold=True, color=(0.2, 1.0, 0.2, 1.0))
+        self.text_renderer.font_size = 40
+        self.text_renderer.pos = self.size[1] // 2, self.size[0] // 2
+        self.tr_sys = visuals.transforms.TransformSystem(canvas)
+
+        self.text = None
+        self.refresh_at = 0
+
+    def make_text(self):
+        stats = self.profiler.stats()
+        if 'frame' not in stats:
+            return 'Profiling...'
+
+        frame = stats.pop('frame')
+        lines = ['frame {:.1f} / {:.1f} ms ({:.0f} fps)'.format(frame['p50'], frame['p95'], 1e3 / frame['p50'])]
+        slowest = sorted(stats.items(), key=lambda item: -item[1]['p50'])[:self.lines]
+        for name, entry in slowest:
+            lines.append('{} {:.1f} / {:.1f}'.format(name, entry['p50'], entry['p95']))
+        return '\n'.join(lines)
+
+    def update(self):
+        now = time.time()
+        if now < self.refresh_at:
+            return
+        self.refresh_at = now + REFRESH_TIME
+        self.text = self.make_text()
+        self.dirty = True
+
+    def make_texture(self):
+        self.text_renderer.text = self.text
+        with self.text_buffer:
+            gloo.clear(color=(0, 0, 0))
+            self.text_renderer.draw(self.tr_sys)
+
+    def draw(self):
+        if self.text is not None:
+            self.make_texture()
+            self.text = None
+
+        set_state(depth_test=False)
+        self.program.draw('triangles', self.indices)
+        set_state(depth_test=True)
+        self.dirty = False
@@ -4,7 +4,7 @@ from vispy.gloo import (Program, VertexBuffer, IndexBuffer, Texture2D, clear,
                         FrameBuffer, set_state)
 from vispy.util.transforms import perspective, translate, rotate
 from vispy.geometry import create_sphere
-from ...OpenGL.drawing import Drawable
+from ...OpenGL.drawing import Drawable, Resources
 from ...OpenGL import utils
 from ..globals import State, Paths
 
@@ -14,6 +14,188 @@ class Targets(Drawable):
     pass
 
 
+class TargetField(Drawable):
+    '''TargetField(capacity=16) -> TargetField
+    Draws every remote unit's marker from one shared vertex buffer
+
+    Each target owns one slot of three vertices in the buffer. The marker shape is
+    carried per-vertex in 'corner' and the target position in 'center', so the whole
+    field is a single 'triangles' draw call per eye. Free slots are collapsed to a
+    point and rasterize nothing.
+
+    The buffer is edited in place by set_targets(); it only grows (doubling) when
+    there are more targets than slots.
+
+    Centers are ENU offsets from State.anchor (float64 math, float32 upload) and the model matrix
+    is State.local_model, so nothing is rebuilt per frame: centers change when the targets or
+    the anchor do, the model when our position does.
+    '''
+    vertex_shader = """
+        #version 120
+        uniform mat4 model;
+        uniform mat4 view;
+        uniform mat4 projection;
+        uniform float billboard_scale;
+        attribute vec3 corner;
+        attribute vec3 center;
+        attribute vec3 color;
+        varying vec3 v_color;
+
+        void main()
+        {
+            // Prevent rotation of the object relative to camera view
+            mat4 coord_fix;
+            coord_fix[0] = vec4(0.0, 0.0, -1.0, 0.0);
+            coord_fix[1] = vec4(-1.0, 0.0, 0.0, 0.0);
+            coord_fix[2] = vec4(0.0, 1.0, 0.0, 0.0);
+            coord_fix[3] = vec4(0.0, 0.0, 0.0, 1.0);
+
+            mat4 T = projection * coord_fix * view * model;
+
+            // Same billboard as Target: keep the projected center, add an unrotated offset
+            gl_Position = T * vec4(center, 1.0) + vec4(billboard_scale * corner, 0.0);
+            v_color = color;
+        }
+    """
+
+    frag_shader = """
+        #version 120
+        varying vec3 v_color;
+        void main()
+        {
+            gl_FragColor = vec4(v_color, 1);
+        }
+    """
+
+    vertex_dtype = [
+        ('corner', np.float32, 3),
+        ('center', np.float32, 3),
+        ('color', np.float32, 3),
+    ]
+
+    default_color = (1.0, 0.0, 0.5)
+    name = "TargetField"
+    def __init__(self, capacity=16, height=1.0):
+        '''TargetField(capacity, height)
+        Arguments:
+            capacity - Number of targets to allocate slots for up front
+            height - Height of each marker triangle (Meters)
+        '''
+        self.projection = np.eye(4)
+        self.view = np.eye(4)
+        self.model = State.local_model
+
+        # This is a triangle of height $height
+        self.shape = np.array([
+            [0.,           0.,     0.],
+            [-height / 2., height, 0.],
+            [+height / 2., height, 0.],
+        ], dtype=np.float32)
+
+        self.slots = {}  # target key -> slot index
+        self.free = []  # Unused slot indices, next one last
+        self.capacity = 0
+        self.data = np.zeros(0, dtype=self.vertex_dtype)
+        self.positions = np.zeros((0, 3))  # ECEF position of each slot
+        self.anchor_version = State.anchor_version
+        self.source = None  # Dictionary last passed to set_targets
+        self.program = Program(self.vertex_shader, self.frag_shader)
+        self._resize(capacity)
+
+        self.program['view'] = self.view
+        self.program['model'] = self.model
+        self.program['projection'] = self.projection
+        self.program['billboard_scale'] = 10.0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _resize(self, capacity):
+        '''Reallocate the vertex buffer with room for $capacity targets, keeping current slots'''
+        data = np.zeros(capacity * 3, dtype=self.vertex_dtype)
+        data[:len(self.data)] = self.data
+        self.data = data
+        positions = np.zeros((capacity, 3))
+        positions[:len(self.positions)] = self.positions
+        self.positions = positions
+        self.free[:0] = reversed(range(self.capacity, capacity))  # After the slots already free
+        self.capacity = capacity
+        self.buffer = VertexBuffer(self.data)
+        self.program.bind(self.buffer)
+
+    def _free_slot(self):
+        if not self.free:
+            self._resize(max(1, self.capacity * 2))
+        return self.free.pop()
+
+    def _slot(self, key, color=None):
+        '''Slot index for $key, allocating one if needed'''
+        if key not in self.slots:
+            index = self._free_slot()
+            self.slots[key] = index
+            self.data['corner'][index * 3:index * 3 + 3] = self.shape
+            self.data['color'][index * 3:index * 3 + 3] = self.default_color if color is None else color
+        elif color is not None:
+            index = self.slots[key]
+            self.data['color'][index * 3:index * 3 + 3] = color
+        return self.slots[key]
+
+    def _place(self, indices):
+        '''Recompute the centers of the slots at $indices from their ECEF positions'''
+        centers = self.data['center'].reshape(self.capacity, 3, 3)
+        centers[indices] = State.anchor.to_enu(self.positions[indices])[:, np.newaxis, :]
+
+    def set_target(self, key, world_pos, color=None):
+        '''Place (or move) the marker for $key at ECEF $world_pos; does not upload, see set_targets'''
+        index = self._slot(key, color)
+        self.positions[index] = world_pos
+        self._place([index])
+
+    def remove_target(self, key):
+        '''Collapse the slot for $key so it draws nothing; does not upload'''
+        index = self.slots.pop(key)
+        self.data[index * 3:index * 3 + 3] = np.zeros(3, dtype=self.vertex_dtype)
+        self.free.append(index)
+
+    def set_targets(self, target_dict):
+        '''Synchronize the field with a State.targets style dictionary
+            {key: {'position_ecef': {'x', 'y', 'z'}, ('color': (r, g, b))}}
+        All changes go to the GPU in a single buffer upload, and the ENU conversion is one call for every target.
+        Passing the same dictionary again does nothing (State.targets is replaced, not edited, on each update)
+        '''
+        if target_dict is self.source and self.anchor_version == State.anchor_version:
+            return
+        self.source = target_dict
+        self.anchor_version = State.anchor_version
+
+        for key in [key for key in self.slots if key not in target_dict]:
+            self.remove_target(key)
+
+        indices = []
+        for key, target in target_dict.items():
+            index = self._slot(key, target.get('color'))
+            pos = target['position_ecef']
+            self.positions[index] = (pos['x'], pos['y'], pos['z'])
+            indices.append(index)
+        if indices:
+            self._place(indices)
+
+        self.buffer.set_data(self.data)
+
+    def update(self):
+        if self.anchor_version != State.anchor_version:
+            self.anchor_version = State.anchor_version
+            self._place(sorted(self.slots.values()))
+            self.buffer.set_data(self.data)
+        if self.model is not State.local_model:
+            self.model = State.local_model
+            self.program['model'] = self.model
+
+    def draw(self):
+        if self.slots:
+            self.program.draw('triangles')
+
+
 class Target(Drawable):
     '''
     Bibliography:
@@ -27,6 +209,7 @@ class Target(Drawable):
         uniform mat4 model;
         uniform mat4 view;
         uniform mat4 projection;
+        uniform vec3 offset; // ENU offset from State.anchor
         attribute vec3 position;
 
         mat4 make_billboard(mat4 T) {
@@ -36,7 +219,7 @@ class Target(Drawable):
             T_billboard[0] = vec4(d,  0., 0., 0.);
             T_billboard[1] = vec4(0., d,  0., 0.);
             T_billboard[2] = vec4(0., 0., d,  0.);
-            T_billboard[3] = T[3]; // Maintain original translation
+            T_billboard[3] = T * vec4(offset, 1.0); // Maintain the target's projected position
             return T_billboard;
         }
 
@@ -117,9 +300,7 @@ class Target(Drawable):
         self.world_pos = world_pos
         self.projection = np.eye(4)
         self.view = np.eye(4)
-        # self.model = translate(np.eye(4), *world_pos)
-        local_position = State.position_ecef - self.world_pos
-        self.model = translate(np.eye(4), *local_position)
+        self.model = State.local_model
 
         height = 1.0  # Meters
 
@@ -130,28 +311,30 @@ class Target(Drawable):
             [+height / 2., height, 0.],
         ], dtype=np.float32)
 
-        self.program = Program(self.vertex_shader, self.frag_shader)
-        self.program['position'] = self.vertices
+        self.program = Resources.program(self.vertex_shader, self.frag_shader)
+        self.program['position'] = Resources.vertex_buffer(self.vertices)
         self.program['view'] = self.view
         self.program['model'] = self.model
         self.program['projection'] = self.projection
         self.program['color'] = np.array(color)
+        self.set_offset()
+
+    def set_offset(self):
+        '''Upload world_pos as an offset from State.anchor'''
+        self.anchor_version = State.anchor_version
+        self.program['offset'] = State.anchor.to_enu(self.world_pos).astype(np.float32)
 
     def update(self):
-        # local_position = self.world_pos - State.position_ecef
-        x, y, z = self.world_pos
-        local_position = self.world_pos
-        # local_position = np.array([-y, z, -x])
-        self.program['model'] = translate(np.eye(4), *local_position)
-        print np.dot(State.orientation_matrix, np.hstack([local_position, 1.0]))
-        print State.orientation_matrix
-        # print 'local {}'.format(local_position)
+        if self.anchor_version != State.anchor_version:
+            self.set_offset()
+        if self.model is not State.local_model:
+            self.model = State.local_model
+            self.program['model'] = self.model
 
     def move(self, world_pos):
         '''Move this target to a new position'''
-        # self.model = translate(np.eye(4), *world_pos)
-        # self.program['model'] = self.model
         self.world_pos = world_pos
+        self.set_offset()
     
     def draw(self):
         self.program.draw('triangle_strip')
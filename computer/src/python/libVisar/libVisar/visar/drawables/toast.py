@@ -6,7 +6,7 @@ from vispy.gloo import (Program, VertexBuffer, IndexBuffer, Texture2D, clear,
                         FrameBuffer, RenderBuffer, set_viewport, set_state)
 from vispy import app, visuals, gloo
 
-from ...OpenGL.drawing import Drawable
+from ...OpenGL.drawing import Drawable, Resources
 from ...OpenGL.utils import Logger
 from ..globals import State
 
@@ -99,15 +99,15 @@ class Toast(Drawable):
 
         ], dtype=np.float32)
 
-        self.indices = IndexBuffer([
+        self.indices = Resources.index_buffer([
             0, 1, 2,
             2, 3, 0,
         ])
 
-        self.program = Program(self.toast_vertex_shader, self.toast_fragment_shader)
+        self.program = Resources.program(self.toast_vertex_shader, self.toast_fragment_shader)
 
-        self.program['vertex_position'] = self.vertices
-        self.program['default_texcoord'] = self.tex_coords
+        self.program['vertex_position'] = Resources.vertex_buffer(self.vertices)
+        self.program['default_texcoord'] = Resources.vertex_buffer(self.tex_coords)
         self.program['view'] = self.view
         self.program['model'] = self.model
         self.program['projection'] = self.projection
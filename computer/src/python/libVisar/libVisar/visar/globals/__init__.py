@@ -1,4 +1,7 @@
 from .globals import State
 from .menu_controller import Menu_Controller
 from .actions import Actions
-from .paths import Paths
\ No newline at end of file
+from .paths import Paths
+from .prediction import PosePredictor
+from .geodesy import LocalFrame
+from . import geodesy
@@ -0,0 +1,150 @@
+'''Geodesy: conversions between ECEF, LLA (latitude, longitude, altitude) and local ENU/NED frames
+WGS84 ellipsoid, no geoid correction. Latitudes and longitudes are in degrees, everything else in meters.
+
+Every conversion takes a single point (3,) or an N x 3 array, and returns the same shape.
+
+Usage:
+    >>> lla = ecef_to_lla(State.position_ecef)
+    >>> ecef = lla_to_ecef(np.array([[29.6462, -82.3494, 0.0], [29.6470, -82.3500, 10.0]]))
+    >>> enu = ecef_to_enu(target_positions, State.position_ecef)  # N x 3, East/North/Up of us
+    >>> frame = LocalFrame.at(State.position_ecef)  # Or keep the frame and reuse it
+    >>> frame.to_ned(target_positions)
+'''
+import collections
+import numpy as np
+
+WGS84_A = 6378137.0
+WGS84_B = 6356752.314245
+WGS84_E2 = 0.0066943799901975848
+WGS84_EP2 = (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2  # Second eccentricity squared
+
+# ENU -> NED swaps east and north and flips up
+ENU_TO_NED = np.array([
+    [0.0, 1.0, 0.0],
+    [1.0, 0.0, 0.0],
+    [0.0, 0.0, -1.0],
+])
+
+
+def _points(points):
+    '''-> (N x 3 float array, whether the input was a single point)'''
+    points = np.asarray(points, dtype=np.float64)
+    assert points.shape[-1] == 3, "Expected points with 3 coordinates, got shape {}".format(points.shape)
+    return np.atleast_2d(points), points.ndim == 1
+
+
+def _result(points, single):
+    return points[0] if single else points
+
+
+def ecef_to_lla(ecef):
+    '''ecef_to_lla(ecef) -> (latitude, longitude, altitude)
+    Bowring's method; sub-millimeter for altitudes within a few hundred kilometers of the surface
+    '''
+    ecef, single = _points(ecef)
+    x, y, z = ecef.T
+    p = np.sqrt(x ** 2 + y ** 2)
+    theta = np.arctan2(WGS84_A * z, WGS84_B * p)
+    lon = np.arctan2(y, x)
+    lat = np.arctan2(z + WGS84_EP2 * WGS84_B * np.sin(theta) ** 3, p - WGS84_E2 * WGS84_A * np.cos(theta) ** 3)
+
+    # Height along the normal; stable at the poles, unlike p / cos(lat) - N
+    sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+    alt = p * cos_lat + z * sin_lat - WGS84_A * np.sqrt(1.0 - WGS84_E2 * sin_lat ** 2)
+
+    return _result(np.column_stack([np.degrees(lat), np.degrees(lon), alt]), single)
+
+
+def lla_to_ecef(lla):
+    '''lla_to_ecef(lla) -> (x, y, z)'''
+    lla, single = _points(lla)
+    lat, lon = np.radians(lla[:, 0]), np.radians(lla[:, 1])
+    alt = lla[:, 2]
+    sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+    n = WGS84_A / np.sqrt(1.0 - WGS84_E2 * sin_lat ** 2)  # Prime vertical radius of curvature
+
+    x = (n + alt) * cos_lat * np.cos(lon)
+    y = (n + alt) * cos_lat * np.sin(lon)
+    z = (n * (1.0 - WGS84_E2) + alt) * sin_lat
+    return _result(np.column_stack([x, y, z]), single)
+
+
+def enu_rotation(latitude, longitude):
+    '''enu_rotation(latitude, longitude) -> 3x3 rotation taking ECEF vectors to East/North/Up at that point'''
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+    sin_lon, cos_lon = np.sin(lon), np.cos(lon)
+    return np.array([
+        [-sin_lon, cos_lon, 0.0],
+        [-sin_lat * cos_lon, -sin_lat * sin_lon, cos_lat],
+        [cos_lat * cos_lon, cos_lat * sin_lon, sin_lat],
+    ])
+
+
+class LocalFrame(object):
+    '''LocalFrame(reference_ecef) -> LocalFrame
+    East/North/Up and North/East/Down coordinates around a reference point
+
+    Frames are cheap to use but not to build (an ECEF -> LLA conversion and a rotation matrix);
+    LocalFrame.at(reference) keeps the most recently used ones.
+    '''
+    cache_size = 16
+    _cache = collections.OrderedDict()  # reference (tuple) -> LocalFrame
+
+    def __init__(self, reference_ecef):
+        self.origin = np.array(reference_ecef, dtype=np.float64)
+        self.origin_lla = ecef_to_lla(self.origin)
+        self.rotation = enu_rotation(*self.origin_lla[:2])  # ECEF -> ENU
+        self.ned_rotation = np.dot(ENU_TO_NED, self.rotation)  # ECEF -> NED
+
+    @classmethod
+    def at(self, reference_ecef):
+        '''LocalFrame.at(reference_ecef) -> LocalFrame, cached per reference'''
+        key = tuple(float(o) for o in reference_ecef)
+        frame = self._cache.pop(key, None)
+        if frame is None:
+            frame = LocalFrame(key)
+            if len(self._cache) >= self.cache_size:
+                self._cache.popitem(last=False)
+        self._cache[key] = frame
+        return frame
+
+    def to_enu(self, ecef):
+        ecef, single = _points(ecef)
+        return _result(np.dot(ecef - self.origin, self.rotation.T), single)
+
+    def from_enu(self, enu):
+        enu, single = _points(enu)
+        return _result(np.dot(enu, self.rotation) + self.origin, single)
+
+    def to_ned(self, ecef):
+        ecef, single = _points(ecef)
+        return _result(np.dot(ecef - self.origin, self.ned_rotation.T), single)
+
+    def from_ned(self, ned):
+        ned, single = _points(ned)
+        return _result(np.dot(ned, self.ned_rotation) + self.origin, single)
+
+
+def ecef_to_enu(ecef, reference_ecef):
+    return LocalFrame.at(reference_ecef).to_enu(ecef)
+
+
+def enu_to_ecef(enu, reference_ecef):
+    return LocalFrame.at(reference_ecef).from_enu(enu)
+
+
+def ecef_to_ned(ecef, reference_ecef):
+    return LocalFrame.at(reference_ecef).to_ned(ecef)
+
+
+def ned_to_ecef(ned, reference_ecef):
+    return LocalFrame.at(reference_ecef).from_ned(ned)
+
+
+def lla_to_enu(lla, reference_ecef):
+    return ecef_to_enu(lla_to_ecef(lla), reference_ecef)
+
+
+def enu_to_lla(enu, reference_ecef):
+    return ecef_to_lla(enu_to_ecef(enu, reference_ecef))
@@ -7,6 +7,7 @@ from ..audio import AudioController, Parser
 from ..network import NetworkState, PoseHandler
 from ..interface import Interface, DeviceHandler
 from .actions import Actions
+from .geodesy import LocalFrame
 
 import numpy as np
 import os, socket, random, copy
@@ -22,6 +23,13 @@ class State(object):
         Velocity - ECEF
         Angular Velocity - Quaternion
 
+    World-space drawables:
+        ECEF coordinates are ~6.4e6 m, where float32 (what GL gets) only resolves about half a meter.
+        World drawables instead place things by their ENU offset from a nearby anchor (anchor.to_enu(ecef),
+        computed in float64 and uploaded as float32), and use local_model as their model matrix. local_model
+        takes anchor ENU to ECEF axes centered on us, and is rebuilt once per position update.
+        The anchor moves to our position when we get more than anchor_threshold meters from it;
+        anchor_version then increments, and drawables must recompute their offsets.
     '''
 
     absolute_file_path = os.path.dirname(os.path.realpath(__file__))
@@ -32,6 +40,15 @@ class State(object):
 
     position_ecef = np.array((738575.65, -5498374.10, 3136355.42))
 
+    # Local tangent frame for world-space drawables (See update_anchor)
+    anchor_threshold = 1000.0  # Meters
+    anchor = LocalFrame(position_ecef)
+    anchor_version = 0
+    local_position = np.zeros(3)  # Our ENU position relative to the anchor
+    local_model = None  # Set by update_anchor (below the class)
+    # Set when the renderer predicts the pose: it alone then sets position_ecef, and pose updates only store the pose
+    predicted_position = False
+
     menu_controller = Menu_Controller()
     
     # create placeholder references for status objects
@@ -39,6 +56,10 @@ class State(object):
     audio_controller = None
     pose_handler = None
     device_handler = None
+
+    # Most recent pose sample converted by latest_orientation_matrix
+    _latched_sample = None
+    _latched_matrix = None
     
     action_dict = None
 
@@ -104,7 +125,8 @@ class State(object):
               try:
                   position = (event['position_ecef']['x'], event['position_ecef']['y'], 
                               event['position_ecef']['z'])
-                  State.set_position(position)
+                  if not State.predicted_position:
+                      State.set_position(position)
                   orientation = (event['orientation_ecef']['w'], event['orientation_ecef']['x'], event['orientation_ecef']['y'], 
                               event['orientation_ecef']['z'],)
                   State.set_orientation(orientation)
@@ -243,6 +265,26 @@ class State(object):
 
         # self.roll, self.pitch, self.yaw = euler_from_matrix(gl_orientation_matrix)
 
+    @classmethod
+    def latest_orientation_matrix(self):
+        '''Orientation matrix from the newest pose sample the PoseHandler has received
+        Unlike orientation_matrix, this is not held back to the pose callback frequency,
+        so it is suitable for sampling right before rendering (late-latching)
+        Falls back to orientation_matrix if there is no pose server
+        '''
+        sample = self.pose_handler.latest_sample if self.pose_handler is not None else None
+        if sample is None:
+            return self.orientation_matrix
+
+        if sample is not self._latched_sample:
+            try:
+                o = sample[1]['orientation_ecef']
+                self._latched_matrix = quaternion_matrix((o['w'], o['x'], o['y'], o['z']))
+            except (KeyError, TypeError):
+                return self.orientation_matrix
+            self._latched_sample = sample
+        return self._latched_matrix
+
     @classmethod
     def set_orientation(self, quaternion):
         self.orientation_quaternion = quaternion
@@ -253,6 +295,23 @@ class State(object):
         assert np.linalg.norm(position_ecef) < 6700000.0, "You must be on the planet Earth to use Visar."
         assert len(position_ecef) == 3, "position_ecef must be XYZ in ECEF"
         self.position_ecef = np.array(position_ecef)
+        self.update_anchor()
+
+    @classmethod
+    def update_anchor(self):
+        '''Re-anchor the local frame if we moved too far from it, and rebuild local_model'''
+        if np.linalg.norm(self.position_ecef - self.anchor.origin) > self.anchor_threshold:
+            self.anchor = LocalFrame(self.position_ecef)
+            self.anchor_version += 1
+            Logger.log('Re-anchored the local frame at {}'.format(self.anchor.origin_lla))
+        self.local_position = self.anchor.to_enu(self.position_ecef)
+
+        # Row-vector convention, like vispy's translate(): ENU offset -> (offset - us) -> ECEF axes
+        rotation = self.anchor.rotation  # ECEF -> ENU; as a right multiply, ENU rows -> ECEF rows
+        local_model = np.eye(4)
+        local_model[:3, :3] = rotation
+        local_model[3, :3] = -np.dot(self.local_position, rotation)
+        self.local_model = local_model
 
     @classmethod
     def bind_function(self, parameter, callback_function):
@@ -286,3 +345,4 @@ class State(object):
         self.toast = 'Args: %s' % (self.args,) # pop a toast too
 
 
+State.update_anchor()
@@ -0,0 +1,115 @@
+import numpy as np
+
+from ...OpenGL.utils.transformations import (quaternion_matrix, quaternion_multiply, quaternion_about_axis,
+                                              unit_vector)
+
+
+class PosePredictor(object):
+    '''PosePredictor(model='velocity', max_horizon=0.05) -> PosePredictor
+    Extrapolates the newest pose sample to the time it will actually be displayed
+
+    Models:
+        'none' - Hold the last sample
+        'velocity' - Constant linear and angular velocity (velocity_ecef, angular_velocity_ecef)
+        'acceleration' - Constant acceleration, estimated from the change in velocity between samples
+
+    Usage:
+        >>> predictor = PosePredictor('velocity', max_horizon=0.05)
+        >>> predictor.add_sample(receive_time, pose)
+        >>> quaternion, position = predictor.predict(display_time)
+
+    Notes:
+        Quaternions are (w, x, y, z), as used by quaternion_matrix
+        Angular velocity is in rad/s about ECEF axes, like the orientation
+        The horizon (display_time - sample time) is clamped to [0, max_horizon]; extrapolating further
+            than that amplifies sensor noise more than it removes lag
+    '''
+    models = ('none', 'velocity', 'acceleration')
+
+    # Ignore samples closer together than this when differentiating velocity (seconds)
+    min_sample_interval = 1e-3
+
+    def __init__(self, model='velocity', max_horizon=0.05):
+        assert model in self.models, "Unknown prediction model {}, expected one of {}".format(model, self.models)
+        self.model = model
+        self.max_horizon = max_horizon
+
+        self.time = None
+        self.quaternion = None
+        self.position = None
+        self.velocity = np.zeros(3)
+        self.angular_velocity = np.zeros(3)
+        self.acceleration = np.zeros(3)
+        self.angular_acceleration = np.zeros(3)
+
+    @staticmethod
+    def parse_pose(pose):
+        '''parse_pose(pose) -> (quaternion, position, velocity, angular_velocity)
+        pose is a PoseHandler local pose dict; missing velocities are taken as zero
+        '''
+        def vector(key):
+            if key not in pose:
+                return np.zeros(3)
+            return np.array((pose[key]['x'], pose[key]['y'], pose[key]['z']), dtype=np.float64)
+
+        o = pose['orientation_ecef']
+        quaternion = unit_vector(np.array((o['w'], o['x'], o['y'], o['z']), dtype=np.float64))
+        return quaternion, vector('position_ecef'), vector('velocity_ecef'), vector('angular_velocity_ecef')
+
+    def add_sample(self, timestamp, pose):
+        '''Add a pose received at $timestamp (seconds, time.time() clock)
+        Repeated timestamps (the same sample seen twice) are ignored
+        '''
+        if self.time is not None and timestamp <= self.time:
+            return
+        quaternion, position, velocity, angular_velocity = self.parse_pose(pose)
+
+        if self.time is not None:
+            dt = timestamp - self.time
+            if dt >= self.min_sample_interval:
+                self.acceleration = (velocity - self.velocity) / dt
+                self.angular_acceleration = (angular_velocity - self.angular_velocity) / dt
+
+        self.time = timestamp
+        self.quaternion = quaternion
+        self.position = position
+        self.velocity = velocity
+        self.angular_velocity = angular_velocity
+
+    def horizon(self, at_time):
+        '''horizon(at_time) -> seconds the prediction will extrapolate, after clamping'''
+        return float(np.clip(at_time - self.time, 0.0, self.max_horizon))
+
+    def predict(self, at_time):
+        '''predict(at_time) -> (quaternion, position) expected at $at_time
+        Returns (None, None) before the first sample
+        '''
+        if self.time is None:
+            return None, None
+        dt = self.horizon(at_time)
+        if self.model == 'none' or dt == 0.0:
+            return self.quaternion.copy(), self.position.copy()
+
+        velocity = self.velocity
+        angular_velocity = self.angular_velocity
+        if self.model == 'acceleration':
+            # Mean velocity over the horizon under constant acceleration
+            velocity = velocity + 0.5 * self.acceleration * dt
+            angular_velocity = angular_velocity + 0.5 * self.angular_acceleration * dt
+
+        position = self.position + velocity * dt
+
+        rate = np.linalg.norm(angular_velocity)
+        if rate < 1e-9:
+            return self.quaternion.copy(), position
+        # Angular velocity is in the world frame, so the increment is applied on the left
+        delta = quaternion_about_axis(rate * dt, angular_velocity / rate)
+        quaternion = unit_vector(quaternion_multiply(delta, self.quaternion))
+        return quaternion, position
+
+    def predict_matrix(self, at_time):
+        '''predict_matrix(at_time) -> 4x4 orientation matrix, as State.orientation_matrix'''
+        quaternion, position = self.predict(at_time)
+        if quaternion is None:
+            return None
+        return quaternion_matrix(quaternion)
@@ -0,0 +1,231 @@
+from __future__ import division
+import collections
+import itertools
+import os
+import threading
+import time
+import Queue
+import numpy as np
+import PIL.Image as Image
+
+from ...osmviz import OSMManager, PILImageManager, TileStore
+from ...OpenGL.utils import Logger
+
+EARTH_RADIUS = 6378137.0  # Meters, equatorial (tile widths only need to be approximate)
+
+
+class TileService(object):
+    '''TileService(cache, zoom=9, radius=2, workers=4, lookahead=60.0, store=None) -> TileService
+    Fetches and decodes OpenStreetMap tiles on a small pool of background threads,
+    so the render loop never waits on tile I/O
+
+    cache is a directory of one PNG per tile, unless a TileStore (or the path of one) is given as store;
+    a raw store hands over its pre-decoded pixels without decoding anything.
+
+    Tiles are (zoom, x, y) keys. Callers ask for tiles in priority order with request(); a new request
+    replaces the previous one: queued tiles it ranks higher are re-queued at their new priority, and
+    queued tiles that are no longer wanted are dropped when a worker reaches them.
+    tiles_around() builds such a list: the tiles around the current position, nearest
+    first, then a corridor along the track predicted from the velocity.
+
+    Finished tiles are handed over as (zoom, x, y, image) tuples, image an RGB uint8 array, through a
+    deque: the workers append and the render thread pops in collect(), neither one takes a lock.
+
+    Usage:
+        >>> service = TileService(cache_dir)
+        >>> service.start()
+        ... # On the render thread
+        >>> service.request(service.tiles_around(position_lla, velocity_enu))
+        >>> for zoom, x, y, image in service.collect(): ...
+        ...
+        >>> service.stop()
+
+    Counters:
+        fetched - Tiles decoded and handed over
+        failed - Tiles that could not be downloaded or decoded (requests for them are ignored for retry_delay seconds)
+        dropped - Queued tiles skipped because a newer request no longer wanted them
+    '''
+    tile_size = 256
+    max_track_steps = 16  # Cap on the number of points sampled along the predicted track
+    retry_delay = 30.0  # Seconds before a tile that failed is fetched again
+
+    def __init__(self, cache, zoom=9, radius=2, workers=4, lookahead=60.0, server=None, store=None):
+        self.zoom = zoom
+        self.radius = radius
+        self.lookahead = lookahead
+        if isinstance(store, basestring):
+            store = TileStore(store)
+        self.store = store
+        self.osm = OSMManager(image_manager=PILImageManager('RGB'), cache=cache, server=server, store=store)
+
+        self.queue = Queue.PriorityQueue()
+        self.ready = collections.deque()
+        self.lock = threading.Lock()  # Guards wanted, pending, queued, failures and the counters
+        self.wanted = set()  # Tiles of the newest request
+        self.pending = set()  # Tiles queued or being fetched
+        self.queued = {}  # tile -> priority of its live queue entry; older entries for it are skipped
+        self.failures = {}  # tile -> time of the last failure
+        self.order = itertools.count()  # Keeps equal priorities in request order
+
+        self.running = False
+        self.threads = []
+        self.workers = workers
+
+        self.fetched = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.threads = [threading.Thread(target=self._work, name='TileService-{}'.format(n))
+                        for n in range(self.workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self, timeout=1.0):
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def tile_at(self, latitude, longitude, zoom=None):
+        '''tile_at(latitude, longitude) -> (zoom, x, y) of the tile containing that point'''
+        zoom = self.zoom if zoom is None else zoom
+        x, y = self.osm.getTileCoord(longitude, latitude, zoom)
+        return self.wrap((zoom, x, y))
+
+    @staticmethod
+    def wrap((zoom, x, y)):
+        '''Wrap x around the antimeridian and clamp y to the map'''
+        n = 2 ** zoom
+        return (zoom, x % n, min(max(y, 0), n - 1))
+
+    def bounds(self, (zoom, x, y), span=1):
+        '''bounds(tile, span=1) -> (min_lat, min_long, max_lat, max_long) of the span x span tiles from $tile'''
+        max_lat, min_long = self.osm.tileNWLatlon((x, y), zoom)
+        min_lat, max_long = self.osm.tileNWLatlon((x + span, y + span), zoom)
+        return np.array((min_lat, min_long, max_lat, max_long))
+
+    @staticmethod
+    def _ring_order(radius):
+        '''Offsets within $radius tiles, nearest first'''
+        offsets = [(dx, dy) for dx in range(-radius, radius + 1) for dy in range(-radius, radius + 1)]
+        return sorted(offsets, key=lambda (dx, dy): dx * dx + dy * dy)
+
+    def tiles_around(self, position_lla, velocity_enu=None, zoom=None):
+        '''tiles_around(position_lla, velocity_enu=None, zoom=None) -> [tile, ...] in priority order
+        The (2 * radius + 1)^2 block around position_lla, then a 3 tile wide corridor out to where
+        velocity_enu (m/s, East/North/Up) takes us in lookahead seconds; at self.zoom unless given
+        '''
+        zoom = self.zoom if zoom is None else zoom
+        latitude, longitude = position_lla[:2]
+        points = [(latitude, longitude, self.radius)]
+
+        if velocity_enu is not None and self.lookahead:
+            east, north = np.asarray(velocity_enu[:2], dtype=np.float64) * self.lookahead
+            cos_lat = max(np.cos(np.radians(latitude)), 1e-6)
+            tile_width = 2 * np.pi * EARTH_RADIUS * cos_lat / 2 ** zoom
+            steps = min(int(np.hypot(east, north) / tile_width), self.max_track_steps)
+            for step in range(1, steps + 1):
+                fraction = step / steps
+                points.append((
+                    latitude + np.degrees(north * fraction / EARTH_RADIUS),
+                    longitude + np.degrees(east * fraction / (EARTH_RADIUS * cos_lat)),
+                    1,
+                ))
+
+        tiles = collections.OrderedDict()
+        for latitude, longitude, radius in points:
+            _, x, y = self.tile_at(latitude, longitude, zoom)
+            for dx, dy in self._ring_order(radius):
+                tiles[self.wrap((zoom, x + dx, y + dy))] = None
+        return list(tiles)
+
+    def request(self, tiles):
+        '''Fetch $tiles (highest priority first), replacing the previous request'''
+        now = time.time()
+        with self.lock:
+            self.wanted = set(tiles)
+            for priority, tile in enumerate(tiles):
+                if now - self.failures.get(tile, -self.retry_delay) < self.retry_delay:
+                    continue
+                if tile in self.pending and priority >= self.queued.get(tile, -1):
+                    continue  # Already queued at least as high, or being fetched
+                # New, or now more urgent (ex: a corridor tile we have reached): queue it (again)
+                self.pending.add(tile)
+                self.queued[tile] = priority
+                self.queue.put((priority, next(self.order), tile))
+
+    def collect(self, limit=None):
+        '''collect(limit=None) -> [(zoom, x, y, image), ...] handed over since the last call'''
+        tiles = []
+        while self.ready and (limit is None or len(tiles) < limit):
+            tiles.append(self.ready.popleft())
+        return tiles
+
+    def fetch(self, (zoom, x, y)):
+        '''fetch(tile) -> RGB uint8 array; downloads into the cache if needed (blocking)'''
+        if self.store is not None:
+            return self._fetch_stored((zoom, x, y))
+        filename = self.osm.retrieveTileImage((x, y), zoom)
+        try:
+            return np.asarray(Image.open(filename).convert('RGB'))
+        except IOError:
+            os.remove(filename)  # Truncated or not an image; fetch it again next time
+            raise
+
+    def _fetch_stored(self, tile):
+        shape = (self.tile_size, self.tile_size, 3)
+        try:
+            # Decodes tiles stored before the store was raw, once
+            pixels = self.store.fill_pixels(tile)
+            if pixels is None:
+                data = self.osm.retrieveTileData(tile[1:], tile[0])  # A raw store decodes it as it stores it
+                pixels = self.store.pixels(tile) if self.store.raw else self.store.decode(data)
+        except IOError:
+            self.store.discard(tile)
+            raise
+        return np.frombuffer(pixels, dtype=np.uint8).reshape(shape)
+
+    def _work(self):
+        while self.running:
+            try:
+                priority, _, tile = self.queue.get(timeout=0.25)
+            except Queue.Empty:
+                continue
+
+            with self.lock:
+                if self.queued.get(tile) != priority:
+                    continue  # Re-queued at a higher priority, or already fetched from there
+                del self.queued[tile]
+                if tile not in self.wanted:
+                    self.pending.discard(tile)
+                    self.dropped += 1
+                    continue
+
+            try:
+                image = self.fetch(tile)
+            except Exception as e:
+                with self.lock:
+                    self.failed += 1
+                    self.failures[tile] = time.time()
+                Logger.warn('Could not load map tile {}: {}'.format(tile, e))
+            else:
+                self.ready.append(tile + (image,))
+                with self.lock:
+                    self.fetched += 1
+            finally:
+                with self.lock:
+                    self.pending.discard(tile)
+
+    def stats(self):
+        return {
+            'fetched': self.fetched,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'queued': len(self.queued),
+            'ready': len(self.ready),
+        }
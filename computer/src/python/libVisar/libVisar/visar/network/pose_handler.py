@@ -15,6 +15,8 @@ class PoseHandler(Interface):
         {"position_ecef": {"x", "y", "z"}, "orientation_ecef": {"x", "y", "z", "w"}, 
          "velocity_ecef": {"x", "y", "z"}, "angular_velocity_ecef": {"x", "y", "z"}}
       Remote Unit Updates will be a dictionary of {ID : position_ecef}
+      The newest local pose is also kept as latest_sample = (receive time, pose), updated
+        as soon as it arrives rather than at the callback frequency
   '''
 
   def __init__(self, frequency = 1.0/60.0):
@@ -23,6 +25,7 @@ class PoseHandler(Interface):
     
     # setup the object vars
     self.pose = None          # this units current pose
+    self.latest_sample = None # (time.time(), pose) of the newest local pose
     self.kill_flag = False    # kill flag for threads
     self.timer = time.clock() # get system time for update timer
     self.freq = frequency  # update frequency
@@ -59,6 +62,7 @@ class PoseHandler(Interface):
             #TODO: Check Protocol
             if beacon['id'] == 'self': # update this units pose
               self.pose = beacon['data'] 
+              self.latest_sample = (time.time(), self.pose) # single assignment, safe to read from the render thread
             else: # update the remote units pose
               self.remotes[beacon['id']] = beacon['data'] 
           except: pass # ignore bad updates
@@ -10,14 +10,16 @@ from vispy.util.logs import set_log_level
 from vispy import gloo
 from vispy import app
 
-from ..OpenGL.utils import Logger
+from ..OpenGL.utils import Logger, FrameProfiler, NullProfiler, FrameScheduler
+from ..OpenGL.utils.transformations import quaternion_matrix
 from ..OpenGL.shaders import Distorter
-from ..OpenGL.drawing import Drawable, Context
-from .drawables import Example, Target, Map, Button, Brain, Toast, Battery
+from ..OpenGL.drawing import Drawable, Context, CachedContext, Resources
+from .drawables import Example, Target, TargetField, Map, Button, Brain, Toast, Battery, ProfilerHud
 from .environments import Terrain
-from .globals import State, Paths
+from .globals import State, Paths, PosePredictor
 
 import argparse
+import time
 
 parser = argparse.ArgumentParser(description='Display the VisAR augmented reality.')
 parser.add_argument('-d', '--draw_terrain', dest='draw_terrain', action='store_true',
@@ -32,27 +34,76 @@ parser.add_argument('-f', '--fullscreen', dest='full', action='store_true',
 parser.add_argument('-n', '--no_distort', dest='no_distort', action='store_true',
                    default=False,
                    help='Skip applying the distortion (For debugging)')
+parser.add_argument('-s', '--single_pass', dest='single_pass', action='store_true',
+                   default=False,
+                   help='Render both eyes in one pass over the render list')
+parser.add_argument('-r', '--render_scale', dest='render_scale', type=float,
+                   default=1.0,
+                   help='Eye buffer resolution scale, ex: 0.7 for speed, 1.5 for sharpness (Adjust at runtime with + and -)')
+parser.add_argument('-l', '--late_latch', dest='late_latch', action='store_true',
+                   default=False,
+                   help='Sample the head pose right before each eye is drawn')
+parser.add_argument('-t', '--timewarp', dest='timewarp', action='store_true',
+                   default=False,
+                   help='Rotate the eye images by the head motion since they were drawn')
+parser.add_argument('--predict', dest='predict', choices=PosePredictor.models,
+                   default='none',
+                   help='Extrapolate the head pose to the expected display time')
+parser.add_argument('--display_latency', dest='display_latency', type=float,
+                   default=1.0 / 60.0,
+                   help='Seconds from sampling the pose to the frame reaching the display (default one frame)')
+parser.add_argument('--pose_delay', dest='pose_delay', type=float,
+                   default=0.0,
+                   help='Seconds from the pose being measured to the pose server delivering it')
+parser.add_argument('--max_horizon', dest='max_horizon', type=float,
+                   default=0.05,
+                   help='Never extrapolate the pose further than this many seconds')
+parser.add_argument('--mesh_resolution', dest='mesh_resolution', type=float,
+                   default=None,
+                   help='Generate the distortion mesh with this many cells per side instead of loading mesh.dat, '
+                        'or below 1, the cheapest mesh within that many pixels of it (ex: 0.5)')
+parser.add_argument('--lookup', dest='lookup', nargs='?', metavar='FPGA_MAP',
+                   const='lens', default=None,
+                   help='Distort with a per-pixel lookup texture instead of the mesh, baked from the lens model '
+                        'or read from an FPGA distortion map (fpga/scripts/distortion dump)')
+parser.add_argument('--no_ui_cache', dest='no_ui_cache', action='store_true',
+                   default=False,
+                   help='Draw the UI elements every frame instead of compositing a cached texture')
+parser.add_argument('--no_map', dest='no_map', action='store_true',
+                   default=False,
+                   help='Do not show the map (it streams OpenStreetMap tiles in the background)')
+parser.add_argument('--always_draw', dest='always_draw', action='store_true',
+                   default=False,
+                   help='Draw on every timer tick, even when nothing changed')
+parser.add_argument('--idle_fps', dest='idle_fps', type=float,
+                   default=2.0,
+                   help='Redraw at least this often when nothing changes')
 parser.add_argument('-v', '--verbose', dest='verbose', action='store_true',
                     default=False,
                     help='Verbose output')
 parser.add_argument('-b', '--debug', dest='debug', action='store_true',
                     default=False,
                     help='Vispy debug output')
+parser.add_argument('-p', '--profile', dest='profile', nargs='?', metavar='TRACE',
+                    const='visar_trace.json', default=None,
+                    help='Profile frame phases, show them on the HUD and write a Chrome trace on exit (default visar_trace.json)')
 parser.add_argument('--npbrain', dest='brain', action='store_true',
                     default=False,
                     help='Use a demo brain')
 
 
-args = parser.parse_args()
-
 # Presets
-FPS = 60 # Maximum FPS (how often needs_update is checked)
+FPS = 60 # Display refresh rate (how often needs_update is checked)
+MIN_FPS = 15 # Lowest rate the frame scheduler will step down to under load
 
 class Renderer(app.Canvas): # Canvas is a GUI object
-    def __init__(self, size=(1980, 1020)):    
-
+    def __init__(self, size=(1980, 1020), args=None):
+        '''Renderer(size, args) -> Renderer
+        args are the parsed command line options (defaults if None)
+        '''
         app.Canvas.__init__(self, keys='interactive')
         self.size = size 
+        self.args = args if args is not None else parser.parse_args([])
         
         # Create a rendering context (A render list)
         Logger.set_verbosity('log')
@@ -64,9 +115,8 @@ class Renderer(app.Canvas): # Canvas is a GUI object
         ]
 
         # fault tolerant map initialization
-        self.map_ob = Map()
+        self.map_ob = None if self.args.no_map else Map()
         UI_elements = [
-            self.map_ob,
             #Toast(self),
             Button('Toggle Map', self, position=1),
             Button('Make Call', self, position=3),
@@ -75,6 +125,8 @@ class Renderer(app.Canvas): # Canvas is a GUI object
             Button('Stop Voice', self, position=5),
             Battery(),
         ]
+        if self.map_ob is not None:
+            UI_elements.insert(0, self.map_ob)
 
         #fault tolerant map initialization
         #try:    
@@ -85,36 +137,90 @@ class Renderer(app.Canvas): # Canvas is a GUI object
         #    Logger.warn("Failed to Initialize the map")        
         self.hide_map = False
 
+        if self.args.profile:
+            self.profiler = FrameProfiler()
+            UI_elements.append(ProfilerHud(self.profiler, self))
+        else:
+            self.profiler = NullProfiler()
+
         self.view = np.eye(4)
-        self.Render_List = Context(*renders)
-        if args.brain:
+        self.target_field = TargetField()
+        self.Render_List = Context(self.target_field, *renders)
+        self.Render_List.world_locked = True
+        if self.args.brain:
             self.Render_List.append(Brain())
-        if args.draw_terrain:
+        if self.args.draw_terrain:
             terrain = Terrain()
             self.Render_List.append(terrain)
 
-        if args.verbose:
+        if self.args.verbose:
             set_log_level(True)
             Logger.set_verbosity('log')
         else:
             set_log_level('error')
             Logger.set_verbosity('warn')
-        if args.debug:
+        if self.args.debug:
             set_log_level('debug')
 
         self.projection = perspective(30.0, 1920 / float(1080), 2.0, 10.0)
         self.Render_List.set_projection(self.projection)
         self.Render_List.set_view(self.view)
 
-        self.UI_elements = Context(*UI_elements)
+        if self.args.no_ui_cache:
+            self.UI_elements = Context(*UI_elements)
+        else:
+            self.UI_elements = CachedContext(*UI_elements)
         self.UI_elements.set_projection(self.projection)
 
+        # Pose prediction
+        self.predictor = PosePredictor(self.args.predict, max_horizon=self.args.max_horizon)
+        self.have_position = False  # Whether the predictor has seen a position yet
+        State.predicted_position = self.args.predict != 'none'  # Then only on_timer sets the position
+        if self.args.predict == 'none':
+            pose_source = State.latest_orientation_matrix
+        else:
+            pose_source = self.predicted_orientation
+
         # Create the distorter
-        self.Distorter = Distorter(self.size, no_distort=args.no_distort)
+        self.Distorter = Distorter(self.size, no_distort=self.args.no_distort, single_pass=self.args.single_pass,
+                                   render_scale=self.args.render_scale, profiler=self.profiler,
+                                   pose_source=pose_source,
+                                   late_latch=self.args.late_latch, timewarp=self.args.timewarp,
+                                   mesh_resolution=self.args.mesh_resolution, lookup=self.args.lookup)
+
+        # Redraw only when something changed, on vsync-aligned deadlines
+        self.orientation = None
+        self.scheduler = FrameScheduler(display_rate=FPS, min_rate=MIN_FPS, idle_rate=self.args.idle_fps)
+        self.scheduler.watch('pose', lambda: self.orientation)
+        self.scheduler.watch('targets', lambda: State.targets)
+        self.scheduler.watch('ui', lambda: (State.current_button, State.hide_map, State.battery, State.calling))
+        self.scheduler.watch('toast', lambda: State.toast)
 
         # Set an update timer to run every FPS
-        self.interval = 1 / FPS
-        self._timer = app.Timer('auto', connect=self.on_timer, start=True)
+        self.interval = self.scheduler.tick_interval
+        self._timer = app.Timer(self.interval, connect=self.on_timer, start=True)
+
+    def predicted_pose(self):
+        '''predicted_pose() -> (orientation matrix, position_ecef) extrapolated to when the frame being drawn
+        will be displayed; position_ecef is None until a sample with a position has arrived
+        '''
+        sample = State.pose_handler.latest_sample if State.pose_handler is not None else None
+        if sample is not None:
+            receive_time, pose = sample
+            try:
+                self.predictor.add_sample(receive_time - self.args.pose_delay, pose)
+                self.have_position = self.have_position or 'position_ecef' in pose
+            except (KeyError, TypeError):
+                Logger.warn('Bad pose sample for prediction')
+
+        quaternion, position = self.predictor.predict(time.time() + self.args.display_latency)
+        if quaternion is None:
+            return State.orientation_matrix, None
+        return quaternion_matrix(quaternion), position if self.have_position else None
+
+    def predicted_orientation(self):
+        '''Orientation matrix extrapolated to when the frame being drawn will be displayed'''
+        return self.predicted_pose()[0]
   
     def on_timer(self, event):
         if State.shutdown_flag: self.close() # shutdown if signaled
@@ -130,22 +236,55 @@ class Renderer(app.Canvas): # Canvas is a GUI object
         '''
         
         # Update and draw
-        self.Render_List.set_view(State.orientation_matrix)
+        self.profiler.begin_frame()
+        with self.profiler.phase('update'):
+            if self.args.predict != 'none':
+                self.orientation, position = self.predicted_pose()
+                if position is not None:
+                    # The map, the targets and the local frame follow the predicted position too
+                    State.set_position(position)
+            elif self.args.late_latch or self.args.timewarp:
+                self.orientation = State.latest_orientation_matrix()
+            else:
+                self.orientation = State.orientation_matrix
+            self.Render_List.set_view(self.orientation)
+
+            with self.profiler.phase('targets'):
+                self.target_field.set_targets(State.targets) # update the targets
+            with self.profiler.phase('scene_update'):
+                self.Render_List.update()
+            with self.profiler.phase('ui_update'):
+                self.UI_elements.update()
+            # The UI drawables mark themselves dirty when they change on their own (map tiles arriving,
+            # battery level, profiler HUD); the scene's drawables don't track it and change via the watchers
+            if self.UI_elements.dirty:
+                self.scheduler.invalidate('dirty')
 
-        Target.do_update(State.targets, self.Render_List, self.projection) # update the targets
-        self.Render_List.update()
-        self.UI_elements.update()
-        self.update()
+        if self.args.always_draw or self.scheduler.should_draw():
+            self.update()
+        else:
+            self.profiler.discard_frame()
+
+    def on_close(self, event):
+        # Free the shared GPU resources while the GL context is still around
+        if self.map_ob is not None:
+            self.map_ob.destroy()
+        self.Render_List.release()
+        self.UI_elements.release()
+        Logger.log('Freed {} shared GPU resources'.format(Resources.evict()))
 
     def on_resize(self, event):
         width, height = event.size
         gloo.set_viewport(0, 0, width, height)
         self.Render_List.on_resize()
+        self.scheduler.invalidate('resize')
     
     def on_draw(self, event):
         # Draw each drawable using the distorter
         gloo.set_viewport(0, 0, *self.size)
-        self.Distorter.draw(self.Render_List, self.UI_elements)
+        with self.profiler.phase('draw'), self.scheduler.drawing():
+            self.Distorter.draw(self.Render_List, self.UI_elements)
+        self.profiler.end_frame()
 
     def on_key_press(self, event):
         """Controls -
@@ -160,9 +299,11 @@ class Renderer(app.Canvas): # Canvas is a GUI object
         p(P) - print current view
         i(I) - zoom in
         o(O) - zoom out
+        +/- - raise/lower the eye buffer render scale
         """
         self.translate = [0, 0, 0]
         self.rotate = [0, 0, 0]
+        self.scheduler.invalidate('key')
 
         # print event.text
         if(event.text == 'p' or event.text == 'P'):
@@ -193,6 +334,10 @@ class Renderer(app.Canvas): # Canvas is a GUI object
         elif(event.text == 'Z'):
             self.rotate = [0, 0, -1]
         # '''
+        elif(event.text == '+' or event.text == '='):
+            self.Distorter.set_render_scale(self.Distorter.render_scale + 0.1)
+        elif(event.text == '-'):
+            self.Distorter.set_render_scale(self.Distorter.render_scale - 0.1)
         elif(event.text == 'B'):
             State.shutdown_flag = True
         elif(event.text == ' ' or event.key == 'Space'):
@@ -234,17 +379,23 @@ class Renderer(app.Canvas): # Canvas is a GUI object
         # '''
     
 def main():
+    args = parser.parse_args()
     if(args.no_audio): 
         State.do_init(audio=False) # initialize the state objects/threads
     else:
         State.do_init(audio=True) # initialize the state objects/threads
     app.use_app(backend_name='PyGlet')
-    c = Renderer()
+    c = Renderer(args=args)
     c.show()
     if(args.full): c.fullscreen = True # fullscreen mode
     c.app.run()
     State.destroy()
 
+    Logger.log('Frame pacing: ' + c.scheduler.summary())
+    if args.profile:
+        Logger.warn('Frame profile:\n' + c.profiler.summary())
+        c.profiler.dump_chrome_trace(args.profile)
+
     Logger.warn('Exiting VisAR')
 
 if __name__ == '__main__':
@@ -0,0 +1,224 @@
+'''Offline map seeding
+Downloads every map tile of an operating area, at a range of zoom levels, into the map's tile store
+(map_cache/tiles.mbtiles) before a deployment, and checks that nothing is missing, so the Map never
+needs the network in the field.
+
+The area is a bounding box, or a corridor around a GPX track/route. Either way it is widened by the
+map window's radius, so the tiles around the edge of the area are there too.
+
+Usage:
+    vsr-seed --bbox 29.60 -82.40 29.70 -82.30 --zoom 9 14 --estimate
+    vsr-seed --gpx route.gpx --corridor 3000 --zoom 9 14
+    vsr-seed --bbox 29.60 -82.40 29.70 -82.30 --zoom 9 14 --verify  # Check only, exit status 1 if incomplete
+
+Interrupting is safe: tiles are committed as they arrive, and running the same command again
+only fetches what is still missing.
+'''
+from __future__ import division
+import argparse
+import collections
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+import numpy as np
+
+from ..osmviz import OSMManager, PILImageManager, TileDownloader, TileStore
+from ..osmviz.tile_store import TILE_SIZE
+from .drawables import Map
+from .globals.tile_service import EARTH_RADIUS
+
+PNG_BYTES = 20 * 1024  # Typical OSM tile, for estimates before anything is downloaded
+
+parser = argparse.ArgumentParser(description='Download the map tiles of an operating area for offline use.')
+area = parser.add_mutually_exclusive_group(required=True)
+area.add_argument('--bbox', dest='bbox', type=float, nargs=4, metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'),
+                  help='Area to seed, in degrees')
+area.add_argument('--gpx', dest='gpx', default=None,
+                  help='Seed a corridor along the tracks, routes and waypoints of this GPX file')
+parser.add_argument('--corridor', dest='corridor', type=float, default=2000.0,
+                    help='Corridor half-width around the GPX path, meters (default 2000)')
+parser.add_argument('--zoom', dest='zoom', type=int, nargs=2, default=(9, 12),
+                    metavar=('MIN', 'MAX'), help='Zoom levels to seed, inclusive (default 9 12)')
+parser.add_argument('--margin', dest='margin', type=int, default=2,
+                    help='Extra tiles around the area at every zoom, for the map window (default 2, its radius)')
+parser.add_argument('--server', dest='server', default=None,
+                    help='Tile server URL (default OpenStreetMap)')
+parser.add_argument('--workers', dest='workers', type=int, default=4,
+                    help='Concurrent downloads (keep this low on public tile servers)')
+parser.add_argument('--store', dest='store', default=None,
+                    help='Tile store to fill (default the map\'s, in map_cache)')
+parser.add_argument('--estimate', dest='estimate', action='store_true', default=False,
+                    help='Only print the tile count and size')
+parser.add_argument('--verify', dest='verify', action='store_true', default=False,
+                    help='Only check that every tile is in the store')
+parser.add_argument('--force', dest='force', action='store_true', default=False,
+                    help='Seed even if the area is larger than the map\'s store bound (older tiles would be evicted)')
+
+
+def read_gpx(filename):
+    '''read_gpx(filename) -> [[(latitude, longitude), ...], ...], one path per track segment or route,
+    plus one single point path per waypoint
+    '''
+    root = ElementTree.parse(filename).getroot()
+    namespace = root.tag[:root.tag.index('}') + 1] if root.tag.startswith('{') else ''
+
+    def points(element, tag):
+        return [(float(point.get('lat')), float(point.get('lon'))) for point in element.iter(namespace + tag)]
+
+    paths = [points(segment, 'trkpt') for segment in root.iter(namespace + 'trkseg')]
+    paths += [points(route, 'rtept') for route in root.iter(namespace + 'rte')]
+    paths += [[point] for point in points(root, 'wpt')]
+    return [path for path in paths if path]
+
+
+def densify(path, step):
+    '''Points along $path (latitude, longitude) at most $step meters apart'''
+    path = np.asarray(path, dtype=np.float64)
+    points = [path[:1]]
+    for start, end in zip(path[:-1], path[1:]):
+        north = np.radians(end[0] - start[0]) * EARTH_RADIUS
+        east = np.radians(end[1] - start[1]) * EARTH_RADIUS * np.cos(np.radians(start[0]))
+        count = max(int(np.ceil(np.hypot(north, east) / step)), 1)
+        fractions = np.arange(1, count + 1)[:, np.newaxis] / count
+        points.append(start + (end - start) * fractions)
+    return np.vstack(points)
+
+
+def tile_range(osm, (min_lat, min_lon, max_lat, max_lon), zoom, margin=0):
+    '''-> (min_x, min_y, max_x, max_y) of the tiles covering a box, inclusive, widened by $margin tiles'''
+    n = 2 ** zoom
+    min_x, min_y = osm.getTileCoord(min_lon, max_lat, zoom)
+    max_x, max_y = osm.getTileCoord(max_lon, min_lat, zoom)
+    return (max(min_x - margin, 0), max(min_y - margin, 0), min(max_x + margin, n - 1), min(max_y + margin, n - 1))
+
+
+def box_tiles(osm, box, zoom, margin=0):
+    min_x, min_y, max_x, max_y = tile_range(osm, box, zoom, margin)
+    return set((x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1))
+
+
+def corridor_tiles(osm, paths, corridor, zoom, margin=0):
+    '''Tiles within $corridor meters of $paths, widened by $margin tiles'''
+    tiles = set()
+    for path in paths:
+        # Sample densely enough that consecutive boxes overlap
+        tile_width = 2 * np.pi * EARTH_RADIUS / 2 ** zoom * np.cos(np.radians(np.max(np.abs(np.asarray(path)[:, 0]))))
+        for latitude, longitude in densify(path, min(corridor, tile_width) / 2 or tile_width / 2):
+            half_lat = np.degrees(corridor / EARTH_RADIUS)
+            half_lon = np.degrees(corridor / (EARTH_RADIUS * max(np.cos(np.radians(latitude)), 1e-6)))
+            box = (latitude - half_lat, longitude - half_lon, latitude + half_lat, longitude + half_lon)
+            tiles |= box_tiles(osm, box, zoom, margin)
+    return tiles
+
+
+def region_tiles(osm, options):
+    '''-> OrderedDict of zoom -> sorted [(x, y), ...] to seed'''
+    region = collections.OrderedDict()
+    for zoom in range(options.zoom[0], options.zoom[1] + 1):
+        if options.gpx:
+            tiles = corridor_tiles(osm, read_gpx(options.gpx), options.corridor, zoom, options.margin)
+        else:
+            tiles = box_tiles(osm, options.bbox, zoom, options.margin)
+        region[zoom] = sorted(tiles)
+    return region
+
+
+def tile_bytes(store):
+    '''Bytes one more tile will take in $store: the mean of the stored ones, or a typical tile'''
+    count = len(store)
+    return store.size / count if count else PNG_BYTES + (TILE_SIZE ** 2 * 3 if store.raw else 0)
+
+
+def missing_tiles(store, region):
+    '''-> OrderedDict of zoom -> [(x, y), ...] the map cannot read from the store yet (no pixels)'''
+    return collections.OrderedDict(
+        (zoom, [tile for tile in tiles if not store.complete((zoom,) + tile)]) for zoom, tiles in region.items())
+
+
+def fill_pixels(store, missing):
+    '''Decode the tiles of $missing that are stored without their pixels (ex: seeded into a store that was
+    not raw); -> OrderedDict of zoom -> [(x, y), ...] still to download
+    '''
+    remaining = collections.OrderedDict()
+    for zoom, tiles in missing.items():
+        remaining[zoom] = []
+        for tile in tiles:
+            try:
+                if store.fill_pixels((zoom,) + tile) is not None:
+                    continue
+            except IOError:
+                store.discard((zoom,) + tile)  # Corrupt; download it again
+            remaining[zoom].append(tile)
+    return remaining
+
+
+def report(region, missing, per_tile):
+    print '{:>5} {:>10} {:>10} {:>12}'.format('zoom', 'tiles', 'missing', 'to fetch')
+    for zoom in region:
+        print '{:>5} {:>10} {:>10} {:>9.1f} MB'.format(
+            zoom, len(region[zoom]), len(missing[zoom]), len(missing[zoom]) * per_tile / 2 ** 20)
+    total, absent = sum(map(len, region.values())), sum(map(len, missing.values()))
+    print '{:>5} {:>10} {:>10} {:>9.1f} MB'.format('all', total, absent, absent * per_tile / 2 ** 20)
+    return total, absent
+
+
+def seed(osm, missing, chunk=64):
+    '''Fetch the $missing tiles, chunk by chunk; -> [(zoom, x, y), ...] that failed'''
+    failed = []
+    total = sum(map(len, missing.values()))
+    done = 0
+    start = time.time()
+    for zoom, tiles in missing.items():
+        for n in range(0, len(tiles), chunk):
+            results = osm.retrieveTiles(tiles[n:n + chunk], zoom)
+            for (x, y), response in results.items():
+                if response.error is not None:
+                    failed.append((zoom, x, y))
+                    print >> sys.stderr, 'Could not fetch tile {}: {}'.format((zoom, x, y), response.error)
+            done += len(results)
+            rate = done / max(time.time() - start, 1e-6)
+            sys.stdout.write('\r{}/{} tiles, {} failed, {:.1f} tiles/s, {:.0f} s left  '.format(
+                done, total, len(failed), rate, (total - done) / rate if rate else 0))
+            sys.stdout.flush()
+    if total:
+        print
+    return failed
+
+
+def main():
+    options = parser.parse_args()
+    if options.zoom[0] > options.zoom[1]:
+        parser.error('--zoom MIN must not exceed MAX')
+
+    store = TileStore(options.store, raw=True) if options.store else Map.tile_store()  # Raw, as the map reads it
+    store.max_bytes = None  # Never evict what we just seeded
+    server = options.server or 'http://tile.openstreetmap.org'
+    osm = OSMManager(image_manager=PILImageManager('RGB'), store=store, server=server,
+                     downloader=TileDownloader(server, workers=options.workers))
+
+    region = region_tiles(osm, options)
+    missing = missing_tiles(store, region)
+    per_tile = tile_bytes(store)
+    total, absent = report(region, missing, per_tile)
+    if options.estimate:
+        return
+    if options.verify:
+        print 'Complete' if not absent else '{} of {} tiles missing'.format(absent, total)
+        sys.exit(1 if absent else 0)
+
+    if not options.store and store.size + absent * per_tile > Map.store_bytes and not options.force:
+        parser.error('the map keeps at most {:.0f} MB of tiles and would evict part of this area; '
+                     'shrink it or pass --force'.format(Map.store_bytes / 2 ** 20))
+
+    failed = seed(osm, fill_pixels(store, missing))
+    store.close()
+
+    absent = sum(map(len, missing_tiles(store, region).values()))
+    if absent:
+        print '{} of {} tiles missing ({} failed); run again to retry them'.format(absent, total, len(failed))
+        sys.exit(1)
+    print 'Complete: {} tiles, store is {:.1f} MB'.format(total, store.size / 2 ** 20)
+
+
+if __name__ == '__main__':
+    main()
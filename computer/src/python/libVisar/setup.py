@@ -10,14 +10,18 @@ setup(name='libVisar',
     author_email='jpanikulam@ufl.edu',
     url='https://www.python.org/',
     entry_points={
-       "console_scripts": ["vsr=libVisar.visar.render_package:main"]
+       "console_scripts": [
+           "vsr=libVisar.visar.render_package:main",
+           "vsr-bench=libVisar.visar.benchmark:main",
+           "vsr-seed=libVisar.visar.seed:main",
+       ]
     },
     package_dir={
         '': '.',
     },
     packages=[
         'libVisar',
-        'libVisar.OpenGL', 'libVisar.OpenGL.shaders', 'libVisar.OpenGL.rift_parameters', 'libVisar.OpenGL.drawing',
+        'libVisar.OpenGL', 'libVisar.OpenGL.shaders', 'libVisar.OpenGL.rift_parameters', 'libVisar.OpenGL.drawing', 'libVisar.OpenGL.utils',
         'libVisar.visar', 'libVisar.visar.drawables', 'libVisar.visar.environments', 'libVisar.visar.globals',
         'libVisar.osmviz', 
         'libVisar.visar.audio', 
@@ -0,0 +1,55 @@
+'''Compare converting points one at a time through Map's scalar classmethods
+against one vectorized geodesy call
+
+Usage:
+    python geodesy_benchmark.py [repeats]
+'''
+from __future__ import division
+import sys
+import time
+import numpy as np
+
+from libVisar.visar.drawables import Map
+from libVisar.visar.globals import State, geodesy
+
+COUNTS = (10, 100, 1000, 10000)
+
+
+def make_points(count):
+    '''Scatter $count ECEF points in a 10km cube around our own position'''
+    return State.position_ecef + np.random.uniform(-5000.0, 5000.0, (count, 3))
+
+
+def time_call(function, repeats):
+    function()  # Warm up
+    start = time.time()
+    for n in range(repeats):
+        function()
+    return (time.time() - start) / repeats
+
+
+def scalar(points):
+    for point in points:
+        Map.llh2ecef(tuple(Map.ecef2llh(tuple(point))))
+
+
+def vectorized(points):
+    geodesy.lla_to_ecef(geodesy.ecef_to_lla(points))
+
+
+def local(points):
+    geodesy.ecef_to_enu(points, State.position_ecef)
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    print 'ECEF -> LLA -> ECEF round trips, and ECEF -> ENU'
+    print '{:>8} {:>14} {:>14} {:>8} {:>14} {:>14}'.format(
+        'points', 'scalar (ms)', 'batch (ms)', 'speedup', 'batch pts/s', 'ENU pts/s')
+    for count in COUNTS:
+        points = make_points(count)
+        one_at_a_time = time_call(lambda: scalar(points), max(repeats // 10, 1))
+        batch = time_call(lambda: vectorized(points), repeats)
+        enu = time_call(lambda: local(points), repeats)
+        print '{:>8} {:>14.3f} {:>14.3f} {:>7.1f}x {:>14.0f} {:>14.0f}'.format(
+            count, one_at_a_time * 1e3, batch * 1e3, one_at_a_time / batch, count / batch, count / enu)
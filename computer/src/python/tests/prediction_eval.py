@@ -0,0 +1,130 @@
+'''Replay a recorded pose stream through PosePredictor and report the prediction error against horizon
+
+Record (from a running pose server):
+    python prediction_eval.py --record poses.jsonl --seconds 60
+Evaluate:
+    python prediction_eval.py poses.jsonl --horizons 0 10 20 30 50 75 100
+
+Recordings are one JSON object per line: the pose server's beacon with the receive time added,
+    {"time": 1433000000.123, "id": "self", "data": {"position_ecef": ..., "orientation_ecef": ..., ...}}
+'''
+from __future__ import division
+import argparse
+import json
+import socket
+import time
+import numpy as np
+
+from libVisar.visar.globals import PosePredictor
+from libVisar.OpenGL.utils.transformations import quaternion_slerp
+
+POSE_PORT = 22156
+
+
+def record(path, seconds):
+    sock = socket.create_connection(('127.0.0.1', POSE_PORT))
+    end = time.time() + seconds
+    line_buffer = ''
+    count = 0
+    with open(path, 'w') as f:
+        while time.time() < end:
+            line_buffer += sock.recv(4096)
+            lines = line_buffer.split('\r\n')
+            now = time.time()
+            for line in lines[:-1]:
+                try:
+                    beacon = json.loads(line)
+                except ValueError:
+                    continue
+                if beacon.get('id') != 'self':
+                    continue
+                beacon['time'] = now
+                f.write(json.dumps(beacon) + '\n')
+                count += 1
+            line_buffer = lines[-1]
+    sock.close()
+    print 'Recorded {} poses to {}'.format(count, path)
+
+
+def load(path):
+    '''load(path) -> (times, [pose, ...]) of the local poses, in time order, duplicates dropped'''
+    samples = []
+    with open(path) as f:
+        for line in f:
+            beacon = json.loads(line)
+            if beacon.get('id', 'self') == 'self':
+                samples.append((beacon['time'], beacon['data']))
+    samples.sort(key=lambda sample: sample[0])
+    times, poses, last = [], [], None
+    for t, pose in samples:
+        if t != last:
+            times.append(t)
+            poses.append(pose)
+            last = t
+    return np.array(times), poses
+
+
+def truth(times, parsed, at_time):
+    '''Interpolated (quaternion, position) at $at_time, None outside the recording'''
+    i = np.searchsorted(times, at_time)
+    if i == 0 or i >= len(times):
+        return None
+    t0, t1 = times[i - 1], times[i]
+    fraction = (at_time - t0) / (t1 - t0)
+    q0, p0 = parsed[i - 1][:2]
+    q1, p1 = parsed[i][:2]
+    return quaternion_slerp(q0, q1, fraction), p0 + (p1 - p0) * fraction
+
+
+def angle_between(q0, q1):
+    '''Rotation angle between two unit quaternions, in degrees'''
+    return np.degrees(2 * np.arccos(np.clip(abs(np.dot(q0, q1)), 0.0, 1.0)))
+
+
+def evaluate(times, poses, model, horizon):
+    '''evaluate(...) -> (angular errors in degrees, position errors in meters) over the recording'''
+    predictor = PosePredictor(model, max_horizon=horizon)
+    parsed = [PosePredictor.parse_pose(pose) for pose in poses]
+    angular, linear = [], []
+    for t, pose in zip(times, poses):
+        predictor.add_sample(t, pose)
+        expected = truth(times, parsed, t + horizon)
+        if expected is None:
+            continue
+        quaternion, position = predictor.predict(t + horizon)
+        angular.append(angle_between(quaternion, expected[0]))
+        linear.append(np.linalg.norm(position - expected[1]))
+    return np.array(angular), np.array(linear)
+
+
+def report(times, poses, horizons):
+    print '{} poses over {:.1f} s'.format(len(times), times[-1] - times[0])
+    print '{:<14} {:>8} {:>10} {:>10} {:>10} {:>10}'.format(
+        'model', 'horizon', 'deg mean', 'deg p95', 'm mean', 'm p95')
+    for model in PosePredictor.models:
+        for horizon in horizons:
+            angular, linear = evaluate(times, poses, model, horizon / 1e3)
+            if not len(angular):
+                continue
+            print '{:<14} {:>6.0f}ms {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+                model, horizon, angular.mean(), np.percentile(angular, 95),
+                linear.mean(), np.percentile(linear, 95))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate pose prediction on a recorded pose stream')
+    parser.add_argument('path', help='Pose recording (JSON lines)')
+    parser.add_argument('--record', dest='record', action='store_true', default=False,
+                        help='Record the pose server to $path instead of evaluating')
+    parser.add_argument('--seconds', dest='seconds', type=float, default=30.0,
+                        help='Recording length')
+    parser.add_argument('--horizons', dest='horizons', type=float, nargs='+',
+                        default=[0, 10, 20, 30, 50, 75, 100],
+                        help='Prediction horizons to evaluate, in milliseconds')
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.path, args.seconds)
+    else:
+        times, poses = load(args.path)
+        report(times, poses, args.horizons)
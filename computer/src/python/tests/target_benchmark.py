@@ -0,0 +1,78 @@
+'''Compare drawing remote unit markers with one Program per Target
+against drawing them all from a single TargetField
+
+Usage:
+    python target_benchmark.py [frames]
+'''
+from __future__ import division
+import sys
+import time
+import numpy as np
+from vispy import app, gloo
+from vispy.util.transforms import perspective
+
+from libVisar.OpenGL.drawing import Context
+from libVisar.visar.drawables import Target, TargetField
+from libVisar.visar.globals import State
+
+COUNTS = (10, 100, 1000)
+
+
+def make_targets(count):
+    '''Scatter $count fake beacons in a 200m cube around our own position'''
+    offsets = np.random.uniform(-100.0, 100.0, (count, 3))
+    targets = {}
+    for n, offset in enumerate(offsets):
+        x, y, z = State.position_ecef + offset
+        targets['T%04d' % n] = {'position_ecef': {'x': x, 'y': y, 'z': z}}
+    return targets
+
+
+def make_legacy(targets):
+    context = Context()
+    for key in sorted(targets):
+        pos = targets[key]['position_ecef']
+        context.append(Target((pos['x'], pos['y'], pos['z'])))
+    return context
+
+
+def make_field(targets):
+    field = TargetField()
+    field.set_targets(targets)
+    return Context(field)
+
+
+class Benchmark(app.Canvas):
+    def __init__(self, frames):
+        app.Canvas.__init__(self, keys='interactive', size=(960, 1080))
+        self.frames = frames
+        self.projection = perspective(30.0, 960 / float(1080), 2.0, 10.0)
+
+    def time_context(self, context):
+        context.set_projection(self.projection)
+        context.set_view(State.orientation_matrix)
+        context.draw()  # Warm up; first draw uploads everything
+        gloo.finish()
+
+        start = time.time()
+        for frame in range(self.frames):
+            gloo.clear(color=True, depth=True)
+            context.draw()
+        gloo.finish()
+        return (time.time() - start) / self.frames
+
+    def on_draw(self, event):
+        print '{:>8} {:>14} {:>14} {:>8}'.format('targets', 'Target (ms)', 'Field (ms)', 'speedup')
+        for count in COUNTS:
+            targets = make_targets(count)
+            legacy = self.time_context(make_legacy(targets))
+            field = self.time_context(make_field(targets))
+            print '{:>8} {:>14.3f} {:>14.3f} {:>7.1f}x'.format(count, legacy * 1e3, field * 1e3, legacy / field)
+        self.close()
+
+
+if __name__ == '__main__':
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    c = Benchmark(frames)
+    c.show()
+    c.app.run()